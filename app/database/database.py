@@ -1,22 +1,204 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from collections import defaultdict
+from sqlalchemy import create_engine, event, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker, DeclarativeBase, Session as OrmSession, with_loader_criteria
 from dotenv import load_dotenv
+from fastapi import Depends, Header, HTTPException
+from typing import Optional
+import functools
+import logging
 import os
+import time
 
 load_dotenv()  # Załadowanie zmiennych środowiskowych z pliku .env
 
+from app.database.location import (  # noqa: E402 - konfiguracja placówek czyta .env
+    DEFAULT_LOCATION_ID,
+    LOCATION_DATABASE_URLS,
+    LOCATION_IDS,
+    LocationScoped,
+    current_location_id,
+    set_current_location,
+)
+
+log = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///dog_hotel.db")  # domyślnie SQLite, jeśli nie podano w .env
 
+# Opcjonalna replika tylko do odczytu (np. sqlite:///dog_hotel_replica.db)
+READ_REPLICA_URL = os.getenv("READ_REPLICA_URL")
+# Czy przy niedostępnej replice czytać z bazy głównej (domyślnie tak)
+READ_REPLICA_FALLBACK = os.getenv("READ_REPLICA_FALLBACK", "true").lower() == "true"
+READ_REPLICA_HEALTHCHECK_SECONDS = int(os.getenv("READ_REPLICA_HEALTHCHECK_SECONDS", "30"))
+
 engine = create_engine(DATABASE_URL)
+read_engine = create_engine(READ_REPLICA_URL, pool_pre_ping=True) if READ_REPLICA_URL else None
+# Placówki z własną bazą - bez repliki, wszystkie zapytania idą do ich silnika
+location_engines = {location_id: create_engine(url) for location_id, url in LOCATION_DATABASE_URLS.items()}
+
+
+# Tryb WAL: odczyty nie czekają na zapis, a commit nie robi fsync za każdym razem (synchronous=NORMAL).
+# Razem z nim włącza się group commit zapisów API, zob. app/database/group_commit.py
+SQLITE_WAL = os.getenv("SQLITE_WAL", "false").lower() == "true"
+# SQLite przed 3.32 przyjmuje najwyżej 999 parametrów na instrukcję - paczki wstawień liczymy pod ten limit
+SQLITE_MAX_VARIABLES = 999
+
+
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def _enable_sqlite_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+# SQLite domyślnie nie sprawdza kluczy obcych - włączamy to dla każdego połączenia
+for _engine in (engine, read_engine, *location_engines.values()):
+    if _engine is not None and _engine.dialect.name == "sqlite":
+        event.listen(_engine, "connect", _enable_sqlite_foreign_keys)
+        if SQLITE_WAL:
+            event.listen(_engine, "connect", _enable_sqlite_wal)
+
+_replica_state = {"healthy": True, "checked_at": 0.0}
+
+
+def replica_available() -> bool:
+    if read_engine is None:
+        return False
+    now = time.monotonic()
+    if now - _replica_state["checked_at"] < READ_REPLICA_HEALTHCHECK_SECONDS:
+        return _replica_state["healthy"]
+    try:
+        with read_engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        healthy = True
+    except Exception:
+        log.warning("Read replica is not reachable", exc_info=True)
+        healthy = False
+    _replica_state.update(healthy=healthy, checked_at=now)
+    return healthy
+
+
+def all_engines() -> list:
+    return [engine, *location_engines.values()]
+
+
+class RoutingSession(OrmSession):
+    """Session bound to one location that sends reads to the replica while `use_replica` is set.
 
-Session = sessionmaker(bind=engine)
+    Flushes always go to the primary, and once a session has written anything
+    all of its later reads go to the primary too (read-after-write). Without an
+    explicit `location_id` the session takes the current location context.
+    """
+
+    def __init__(self, *args, use_replica: bool = False, location_id: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.use_replica = use_replica
+        self.location_id = current_location_id() if location_id is None else location_id
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.location_id in location_engines:
+            return location_engines[self.location_id]
+        if (
+            self.use_replica
+            and read_engine is not None
+            and not self._flushing
+            and not self.info.get("wrote")
+        ):
+            return read_engine
+        return engine
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _mark_session_wrote(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _filter_by_location(execute_state):
+    # Każde zapytanie ORM (także UPDATE/DELETE i leniwe ładowanie relacji) widzi tylko swoją placówkę
+    if execute_state.is_select or execute_state.is_update or execute_state.is_delete:
+        location_id = execute_state.session.location_id
+        execute_state.statement = execute_state.statement.options(
+            with_loader_criteria(LocationScoped, lambda cls: cls.location_id == location_id, include_aliases=True)
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def _location_references(mapper) -> tuple:
+    """(attribute key, parent id attribute) of foreign keys pointing at location scoped tables."""
+    references = []
+    for column in mapper.local_table.columns:
+        for foreign_key in column.foreign_keys:
+            for parent in mapper.registry.mappers:
+                if parent.local_table is foreign_key.column.table and issubclass(parent.class_, LocationScoped):
+                    parent_key = parent.get_property_by_column(foreign_key.column).key
+                    references.append((mapper.get_property_by_column(column).key, getattr(parent.class_, parent_key)))
+    return tuple(references)
+
+
+@event.listens_for(RoutingSession, "before_flush")
+def _assign_location(session, flush_context, instances):
+    # Klucz obcy nie zna placówek - sprawdzamy, że zmienione odwołania wskazują wiersze tej samej placówki
+    referenced = defaultdict(set)
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, LocationScoped):
+            continue
+        if obj.location_id is None:
+            obj.location_id = session.location_id
+        state = inspect(obj)
+        for key, parent_id in _location_references(state.mapper):
+            value = getattr(obj, key)
+            if value is not None and (state.pending or state.attrs[key].history.has_changes()):
+                referenced[parent_id].add(value)
+
+    for parent_id, values in referenced.items():
+        found = set(session.execute(select(parent_id).where(parent_id.in_(values))).scalars())
+        if values - found:
+            raise IntegrityError(
+                "location check",
+                sorted(values - found),
+                Exception(f"FOREIGN KEY constraint failed: {parent_id} not found in location {session.location_id}"),
+            )
+
+
+Session = sessionmaker(bind=engine, class_=RoutingSession)
 
 class Base(DeclarativeBase):
     pass
 
-def get_db():
-    db = Session()
+async def get_location(x_location_id: Optional[int] = Header(default=None)) -> int:
+    """Location of the request from the X-Location-Id header, the default location without it.
+
+    Async so the location context it sets is inherited by the endpoint's thread.
+    """
+    location_id = DEFAULT_LOCATION_ID if x_location_id is None else x_location_id
+    if location_id not in LOCATION_IDS:
+        raise HTTPException(status_code=404, detail="Location not found")
+    set_current_location(location_id)
+    return location_id
+
+def get_db(location_id: int = Depends(get_location)):
+    db = Session(location_id=location_id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_read_db(location_id: int = Depends(get_location)):
+    if read_engine is not None and not replica_available():
+        if not READ_REPLICA_FALLBACK:
+            raise HTTPException(status_code=503, detail="Read replica is unavailable")
+        log.warning("Read replica unavailable, falling back to primary database")
+        db = Session(location_id=location_id)
+    else:
+        db = Session(use_replica=True, location_id=location_id)
     try:
         yield db
     finally:
-        db
\ No newline at end of file
+        db.close()
@@ -0,0 +1,218 @@
+"""Group commit: writes of concurrent requests applied by one writer thread, one transaction per batch.
+
+On SQLite every commit takes the single writer lock and an fsync, so concurrent
+bookings queue on the lock and end with `database is locked`. With group commit the
+API passes its write units to a writer thread. Units arriving within
+GROUP_COMMIT_WINDOW_MS of the first one are applied in one transaction, each in its own
+SAVEPOINT: a failing unit is rolled back alone and its request gets its own error,
+the others are committed together.
+
+Enabled with SQLITE_WAL=true (GROUP_COMMIT=auto), or forced with GROUP_COMMIT=true/false.
+Check that a batch really is one transaction on this SQLite build:
+
+    python -m app.database.group_commit
+"""
+import argparse
+import logging
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import Callable, Optional, TypeVar
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine, event, func, inspect, insert, select
+from sqlalchemy.orm import Session, sessionmaker
+from app.database.database import SQLITE_WAL, Session as SessionLocal, _enable_sqlite_wal, all_engines
+from app.database.location import DEFAULT_LOCATION_ID, location_scope
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_MODE = os.getenv("GROUP_COMMIT", "auto").lower()
+GROUP_COMMIT_ENABLED = _MODE == "true" or (
+    _MODE == "auto" and SQLITE_WAL and all(engine.dialect.name == "sqlite" for engine in all_engines())
+)
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "5"))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "64"))
+
+
+class _WriteUnit:
+    __slots__ = ("location_id", "unit", "future")
+
+    def __init__(self, location_id: int, unit: Callable[[Session], object]):
+        self.location_id = location_id
+        self.unit = unit
+        self.future: Future = Future()
+
+
+class GroupCommitWriter:
+    """Writer thread applying queued write units in batches, one transaction per location and batch."""
+
+    def __init__(
+        self,
+        window_ms: float = GROUP_COMMIT_WINDOW_MS,
+        max_batch: int = GROUP_COMMIT_MAX_BATCH,
+        session_factory: Optional[Callable[[int], Session]] = None,
+    ):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.session_factory = session_factory or (
+            lambda location_id: SessionLocal(location_id=location_id, expire_on_commit=False)
+        )
+        self.batches = 0
+        self.units = 0
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+
+    def submit(self, location_id: int, unit: Callable[[Session], T]) -> "Future[T]":
+        item = _WriteUnit(location_id, unit)
+        self._queue.put(item)
+        return item.future
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            # Okno liczone od pierwszej jednostki - pojedynczy zapis czeka najwyżej GROUP_COMMIT_WINDOW_MS
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            by_location: dict[int, list[_WriteUnit]] = defaultdict(list)
+            for item in batch:
+                by_location[item.location_id].append(item)
+            for location_id, items in by_location.items():
+                try:
+                    self._apply(location_id, items)
+                except Exception as e:
+                    # Wątek zapisu nie może zginąć - żądania czekałyby na wynik bez końca
+                    log.error(f"Group commit writer failed for location {location_id}", exc_info=True)
+                    for item in items:
+                        if not item.future.done():
+                            item.future.set_exception(e)
+            self.batches += 1
+            self.units += len(batch)
+            log.debug(f"Group commit of {len(batch)} write units")
+
+    def _apply(self, location_id: int, items: list[_WriteUnit]) -> None:
+        db = self.session_factory(location_id)
+        done = []
+        try:
+            with location_scope(location_id):
+                connection = db.connection()
+                if connection.dialect.name == "sqlite":
+                    # pysqlite nie wysyła BEGIN - bez niego pierwszy SAVEPOINT sam otwiera transakcję,
+                    # a jego RELEASE ją commituje, czyli każda jednostka miałaby własny commit
+                    connection.exec_driver_sql("BEGIN IMMEDIATE")
+                for item in items:
+                    try:
+                        with db.begin_nested():
+                            result = item.unit(db)
+                    except Exception as e:
+                        item.future.set_exception(e)
+                    else:
+                        done.append((item, result))
+                db.commit()
+
+                # Zwracane obiekty odświeżone jak po zwykłym commicie i odłączone - żądanie czyta je w swoim wątku
+                for _, result in done:
+                    state = inspect(result, raiseerr=False)
+                    if state is not None and state.persistent:
+                        try:
+                            db.refresh(result)
+                        except Exception:
+                            log.warning(f"Could not refresh {result!r} after group commit", exc_info=True)
+                db.expunge_all()
+        except Exception as e:
+            db.rollback()
+            log.error(f"Group commit of {len(done)} write units failed", exc_info=True)
+            for item, _ in done:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        finally:
+            db.close()
+        for item, result in done:
+            item.future.set_result(result)
+
+
+_writer: Optional[GroupCommitWriter] = None
+_writer_lock = threading.Lock()
+
+
+def writer() -> GroupCommitWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = GroupCommitWriter()
+        return _writer
+
+
+def run_write(db: Session, unit: Callable[[Session], T]) -> T:
+    """Run `unit(session)` and commit it; returns what the unit returned.
+
+    With group commit the unit runs on the writer thread in a session of the same
+    location, so it must read and write only through the session it gets, and the
+    ORM objects it returns come back detached. Otherwise it runs in `db` and is
+    committed there; on error the caller rolls `db` back as before.
+    """
+    if not GROUP_COMMIT_ENABLED:
+        result = unit(db)
+        db.commit()
+        return result
+    return writer().submit(db.location_id, unit).result()
+
+
+def check_batch_isolation(path: str) -> tuple[bool, int, int]:
+    """Apply two units in one batch on a fresh SQLite file in WAL mode.
+
+    The second unit counts the first unit's rows through another connection. Returns
+    (ok, rows seen by the other connection before the commit, rows after the commit).
+    """
+    engine = create_engine(f"sqlite:///{path}")
+    event.listen(engine, "connect", _enable_sqlite_wal)
+    table = Table("group_commit_check", MetaData(), Column("id", Integer, primary_key=True))
+    table.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine, expire_on_commit=False)
+
+    def count() -> int:
+        with engine.connect() as other:
+            return other.execute(select(func.count()).select_from(table)).scalar()
+
+    seen = []
+    # Długie okno - obie jednostki na pewno trafiają do jednej paczki
+    check_writer = GroupCommitWriter(window_ms=500, session_factory=lambda location_id: factory())
+    futures = [
+        check_writer.submit(DEFAULT_LOCATION_ID, lambda db: db.execute(insert(table).values(id=1))),
+        check_writer.submit(DEFAULT_LOCATION_ID, lambda db: (seen.append(count()), db.execute(insert(table).values(id=2)))),
+    ]
+    for future in futures:
+        future.result()
+    committed = count()
+    engine.dispose()
+    return seen == [0] and committed == 2 and check_writer.batches == 1, seen[0], committed
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Check that a group commit batch is one SQLite transaction")
+    parser.parse_args(argv)
+    path = os.path.join(tempfile.mkdtemp(prefix="group_commit_"), "check.db")
+    ok, before, after = check_batch_isolation(path)
+    print(f"Rows of unit 1 visible to another connection before the batch commit: {before}, after: {after}")
+    print("ok" if ok else "FAILED - units of a batch are committed one by one")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import contextvars
+import os
+from contextlib import contextmanager
+from typing import Optional
+from sqlalchemy.orm import Mapped, mapped_column
+
+
+def _parse_ids(value: str) -> list[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def _parse_urls(value: str) -> dict[int, str]:
+    urls = {}
+    for item in value.split(","):
+        if item.strip():
+            location_id, _, url = item.partition("=")
+            urls[int(location_id)] = url.strip()
+    return urls
+
+
+# Placówki obsługiwane przez to wdrożenie; pierwsza jest domyślna dla żądań bez nagłówka
+LOCATION_IDS = _parse_ids(os.getenv("LOCATION_IDS", "1"))
+DEFAULT_LOCATION_ID = LOCATION_IDS[0]
+# Opcjonalnie osobna baza dla placówki, np. "2=sqlite:///dog_hotel_2.db"
+LOCATION_DATABASE_URLS = _parse_urls(os.getenv("LOCATION_DATABASE_URLS", ""))
+
+_current_location: contextvars.ContextVar = contextvars.ContextVar("current_location", default=None)
+
+
+class LocationScoped:
+    """Mixin adding `location_id` to a model.
+
+    Every ORM query of a session sees only the rows of the session's location,
+    and new objects get that location on flush.
+    """
+
+    location_id: Mapped[int] = mapped_column(nullable=False)
+
+
+def current_location_id() -> int:
+    location_id = _current_location.get()
+    return DEFAULT_LOCATION_ID if location_id is None else location_id
+
+
+def set_current_location(location_id: Optional[int]) -> contextvars.Token:
+    return _current_location.set(location_id)
+
+
+@contextmanager
+def location_scope(location_id: int):
+    """Run a block, e.g. a scheduled job, with sessions created inside it bound to `location_id`."""
+    token = _current_location.set(location_id)
+    try:
+        yield
+    finally:
+        _current_location.reset(token)
@@ -0,0 +1,464 @@
+"""Query plan regression check for the list endpoints and the scheduled jobs.
+
+Seeds a throwaway SQLite database, runs every list endpoint with each filter and each
+pair of filters, then runs the scheduler services. It records the SQL they send and
+checks `EXPLAIN QUERY PLAN` of every statement against the baseline in
+query_plan_baseline.json. The check fails when an access to a large table turns into
+a full scan, or when its estimated row count grows past the budget recorded in the
+baseline.
+
+    python -m app.database.query_plans [--update-baseline] [--output report.json]
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from random import Random
+from typing import Callable, Optional
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "query_plan_baseline.json")
+LARGE_TABLE_ROWS = 1000  # pełny skan mniejszej tabeli nie jest regresją
+BUDGET_FACTOR = 2  # budżet zapisywany w bazie odniesienia: oszacowanie x 2
+MIN_BUDGET_ROWS = 50
+TIMING_RUNS = 3
+
+# Wiersze na placówkę; dane dwóch placówek, żeby filtr location_id miał znaczenie jak w produkcji
+SEED_ROWS = {
+    "owners": 2000, "dogs": 3000, "stays": 10000, "bank_transfers": 8000, "stays_archive": 3000, "recurring_stays": 200,
+}
+SEED_LOCATIONS = (1, 2)
+SEED = 47
+
+_ACCESS = re.compile(r"^(SCAN|SEARCH) (\S+)(?: USING (.*?))?(?: \((.*)\))?$")
+
+
+def _seed(engine, scale: float) -> None:
+    from sqlalchemy import insert
+    from app.database.database import Base
+
+    tables = Base.metadata.tables
+    rng = Random(SEED)
+    today = date.today()
+    rows = {name: int(count * scale) for name, count in SEED_ROWS.items()}
+    live_ids = rows["stays"] * len(SEED_LOCATIONS)
+    owner_id = dog_id = stay_id = transfer_id = 0
+
+    with engine.begin() as conn:
+        for location_id in SEED_LOCATIONS:
+            owners, dogs, stays, payments, transfers, ledger = [], [], [], [], [], []
+            first_owner = owner_id + 1
+            for _ in range(rows["owners"]):
+                owner_id += 1
+                owners.append({
+                    "id": owner_id, "location_id": location_id, "fullname": f"Owner {owner_id}",
+                    "email": f"owner{owner_id}@example.com", "phone_number": 500000000 + owner_id,
+                    "bank_account": 10**9 + owner_id if rng.random() < 0.7 else None,
+                })
+            dog_owners = {}
+            for _ in range(rows["dogs"]):
+                dog_id += 1
+                dog_owners[dog_id] = rng.randint(first_owner, owner_id)
+                dogs.append({
+                    "id": dog_id, "location_id": location_id, "name": f"Dog {dog_id}", "age": rng.randint(1, 15),
+                    "medicine": "vitamins" if rng.random() < 0.2 else None,
+                    "food": "standard" if rng.random() < 0.8 else "grain free",
+                    "notes": "shy" if rng.random() < 0.3 else None, "owner_id": dog_owners[dog_id],
+                    "created_at": datetime(2024, 1, 1),
+                })
+            for _ in range(rows["stays"]):
+                stay_id += 1
+                dog = rng.choice(list(dog_owners))
+                start_date = today + timedelta(days=rng.randint(-700, 180))
+                days = rng.randint(1, 14)
+                end_date = start_date + timedelta(days=days - 1)
+                stays.append({
+                    "id": stay_id, "location_id": location_id, "start_date": start_date, "end_date": end_date,
+                    "duration_days": days, "additional_fee_per_day": 0.0, "kennel_type": "standard", "notes": None,
+                    "created_at": datetime(2024, 1, 1), "version": 1, "dog_id": dog, "owner_id": dog_owners[dog],
+                })
+                is_paid = end_date < today and rng.random() < 0.85
+                payments.append({
+                    "id": stay_id, "location_id": location_id, "amount": days * 50.0, "is_paid": is_paid,
+                    "is_overdue": end_date < today and not is_paid,
+                    "overdue_days": max((today - end_date).days, 0) if not is_paid else 0,
+                    "paid_amount": 0.0, "version": 1, "stay_id": stay_id, "owner_id": dog_owners[dog],
+                })
+            for _ in range(rows["bank_transfers"]):
+                transfer_id += 1
+                payment = rng.choice(payments)
+                transfers.append({
+                    "id": transfer_id, "location_id": location_id, "from_account": f"PL{payment['owner_id']:026d}",
+                    "sender_name": f"Owner {payment['owner_id']}", "title": str(payment["stay_id"]),
+                    "amount": payment["amount"], "received_at": datetime.combine(today, datetime.min.time()),
+                    "bank_reference": f"REF{location_id}-{transfer_id}", "fingerprint": f"{location_id}-{transfer_id}",
+                    "matched_payment_id": payment["id"] if payment["is_paid"] else None,
+                })
+                if payment["is_paid"]:
+                    payment["paid_amount"] += payment["amount"]
+                    ledger.append({
+                        "location_id": location_id, "payment_id": payment["id"], "bank_transfer_id": transfer_id,
+                        "amount": payment["amount"], "created_at": datetime.combine(today, datetime.min.time()),
+                    })
+            conn.execute(insert(tables["owners"]), owners)
+            conn.execute(insert(tables["dogs"]), dogs)
+            conn.execute(insert(tables["stays"]), stays)
+            conn.execute(insert(tables["payments"]), payments)
+            conn.execute(insert(tables["bank_transfers"]), transfers)
+            conn.execute(insert(tables["payment_ledger"]), ledger)
+
+            archived = []
+            for i in range(rows["stays_archive"]):
+                dog = rng.choice(list(dog_owners))
+                start_date = today - timedelta(days=rng.randint(800, 2000))
+                archived.append({
+                    "id": live_ids + stay_id + i + 1, "location_id": location_id, "start_date": start_date,
+                    "end_date": start_date + timedelta(days=2), "duration_days": 3, "additional_fee_per_day": 0.0,
+                    "kennel_type": "standard", "notes": None, "created_at": datetime(2020, 1, 1), "version": 1,
+                    "dog_id": dog, "owner_id": dog_owners[dog], "archived_at": datetime(2024, 1, 1),
+                })
+            conn.execute(insert(tables["stays_archive"]), archived)
+            conn.execute(insert(tables["payments_archive"]), [
+                {
+                    "id": stay["id"], "location_id": location_id, "amount": 150.0, "paid_amount": 150.0, "is_paid": True, "is_overdue": False,
+                    "overdue_days": 0, "version": 1, "stay_id": stay["id"], "owner_id": stay["owner_id"],
+                    "archived_at": datetime(2024, 1, 1),
+                }
+                for stay in archived
+            ])
+
+            patterns = []
+            for _ in range(rows["recurring_stays"]):
+                dog = rng.choice(list(dog_owners))
+                # Wzorce zaczęte niedawno - zadania materializują i rozliczają ich wystąpienia
+                starts_on = today - timedelta(days=rng.randint(0, 90))
+                patterns.append({
+                    "location_id": location_id, "starts_on": starts_on, "ends_on": None,
+                    "by_weekday": rng.choice(("MO", "WE", "FR", "MO,WE", "MO,FR", "WE,FR")),
+                    "interval_weeks": rng.randint(1, 2), "duration_days": 1, "additional_fee_per_day": 0.0,
+                    "kennel_type": "standard", "notes": None, "materialized_until": starts_on - timedelta(days=1),
+                    "billed_until": starts_on - timedelta(days=1), "created_at": datetime(2024, 1, 1), "version": 1,
+                    "dog_id": dog, "owner_id": dog_owners[dog],
+                })
+            conn.execute(insert(tables["recurring_stays"]), patterns)
+        conn.exec_driver_sql("ANALYZE")
+
+
+def _endpoint_cases() -> list[tuple[str, Callable, dict]]:
+    from app.routers.bank_transfers import list_transfers
+    from app.routers.dogs import search_dogs
+    from app.routers.owners import search_owners
+    from app.routers.payments import search_payments
+    from app.routers.stays import search_stays
+
+    today = date.today()
+    # (endpoint, wartości filtrów, include); ten sam filtr z kilkoma wartościami nie trafia do jednej pary
+    endpoints = [
+        (search_stays, [
+            ("min_days", 10), ("max_days", 2), ("status", "upcoming"), ("status", "ongoing"), ("status", "ending_soon"),
+            ("year", today.year), ("month", today.month), ("day", 15),
+            ("start_date_from", today - timedelta(days=30)), ("start_date_to", today + timedelta(days=30)),
+            ("dog_id", 17), ("owner_id", 17), ("include_archived", True),
+        ], "dog,owner,payments"),
+        (search_owners, [
+            ("fullname", "owner 17"), ("email", "owner17@example.com"), ("phone_number", 500000017),
+            ("unpaid", True), ("unpaid", False), ("overdue", True), ("overdue", False), ("bank_account", 10**9 + 17),
+        ], "dogs,stays"),
+        (search_dogs, [
+            ("owner_id", 17), ("name", "dog 17"), ("medicated", True), ("medicated", False),
+            ("special_food", True), ("special_food", False), ("notes", True), ("notes", False),
+        ], "owner,stays"),
+        (search_payments, [
+            ("stay_id", 17), ("is_paid", True), ("is_paid", False), ("is_overdue", True), ("is_overdue", False),
+            ("is_overdue_30_days", True), ("owner_id", 17), ("include_archived", True),
+        ], "stay"),
+        (list_transfers, [("sender_name", "owner 17"), ("matched", True), ("matched", False), ("include_archived", True)], None),
+    ]
+
+    cases = []
+    for function, filters, include in endpoints:
+        combinations = [()] + [(item,) for item in filters] + [
+            pair for pair in itertools.combinations(filters, 2) if pair[0][0] != pair[1][0]
+        ]
+        for combination in combinations:
+            kwargs = dict(combination)
+            name = ", ".join(f"{key}={value}" for key, value in combination)
+            cases.append((f"{function.__name__}({name})", function, kwargs))
+        if include:
+            key, value = filters[0]
+            cases.append((f"{function.__name__}(include={include})", function, {"include": include}))
+            cases.append((f"{function.__name__}({key}={value}, include={include})", function, {key: value, "include": include}))
+    return cases
+
+
+class _SilentTransport:
+    def send(self, to: str, subject: str, body: str) -> None:
+        pass
+
+
+def _scheduler_cases() -> list[tuple[str, Callable, dict]]:
+    from app.services.archive import archive_completed_stays
+    from app.services.bank_webhook import process_batch, queue_depth
+    from app.services.dashboard import compute_counters, reconcile_counters
+    from app.services.occupancy import availability, rebuild_occupancy
+    from app.services.overdue import notify_overdue_owners, update_overdue_payments
+    from app.services.payment_ledger import rebuild_payment_balances
+    from app.services.recurring_stays import bill_recurring_stays, materialize_horizon, planned_occupancy
+    from app.services.update_dog_ages import update_dog_ages
+    from app.services.update_payments_from_transfers import has_unmatched_transfers, update_payments_from_transfers
+
+    today = date.today()
+    # Kolejność jak w produkcji; zadania zmieniają dane, więc są uruchamiane po endpointach
+    return [
+        ("compute_counters", compute_counters, {}),
+        ("availability", availability, {"start_date": today, "end_date": today + timedelta(days=30)}),
+        ("planned_occupancy", planned_occupancy, {"start_date": today, "end_date": today + timedelta(days=90)}),
+        ("has_unmatched_transfers", has_unmatched_transfers, {}),
+        ("queue_depth", queue_depth, {}),
+        ("process_batch", process_batch, {}),
+        ("update_payments_from_transfers", update_payments_from_transfers, {}),
+        ("rebuild_payment_balances", rebuild_payment_balances, {}),
+        ("update_overdue_payments", update_overdue_payments, {}),
+        ("notify_overdue_owners", notify_overdue_owners, {"transport": _SilentTransport()}),
+        ("update_dog_ages", update_dog_ages, {}),
+        ("rebuild_occupancy", rebuild_occupancy, {}),
+        ("materialize_horizon", materialize_horizon, {}),
+        ("bill_recurring_stays", bill_recurring_stays, {}),
+        ("reconcile_counters", reconcile_counters, {}),
+        ("archive_completed_stays", archive_completed_stays, {}),
+    ]
+
+
+def _capture(engine, case: Callable[[], None]) -> list[tuple[str, tuple]]:
+    from sqlalchemy import event
+
+    statements: dict[str, tuple] = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        if not executemany and verb in ("SELECT", "UPDATE", "DELETE") and statement not in statements:
+            statements[statement] = tuple(parameters or ())
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        case()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    return list(statements.items())
+
+
+def _statistics(conn) -> tuple[dict[str, int], dict[str, list[int]]]:
+    table_rows: dict[str, int] = {}
+    index_stats: dict[str, list[int]] = {}
+    for table, index, stat in conn.exec_driver_sql("SELECT tbl, idx, stat FROM sqlite_stat1").all():
+        values = [int(value) for value in stat.split() if value.isdigit()]
+        table_rows[table] = values[0]
+        if index:
+            index_stats[index] = values
+    return table_rows, index_stats
+
+
+def _table_name(name: str, table_rows: dict[str, int]) -> str:
+    # Aliasy SQLAlchemy (stays_1, owners_2) wskazują te same tabele
+    base = re.sub(r"_\d+$", "", name)
+    return base if base in table_rows else name
+
+
+def _estimate(rows: int, using: Optional[str], terms: Optional[str], index_stats: dict[str, list[int]]) -> int:
+    """Rows SQLite expects to visit for one table access, from sqlite_stat1 and its default range guess."""
+    if using is None or "AUTOMATIC" in using:
+        return rows  # indeks automatyczny i tak powstaje z pełnego skanu
+    conditions = terms.split(" AND ") if terms else []
+    equalities = sum(1 for condition in conditions if re.fullmatch(r"\w+=\?", condition))
+    bounds = sum(1 for condition in conditions if re.fullmatch(r"\w+[<>]=?\?", condition))
+    if "PRIMARY KEY" in using:
+        estimate = 1 if equalities else rows
+    else:
+        stats = index_stats.get(using.split()[-1])
+        if stats is None:
+            estimate = 1 if equalities else rows
+        else:
+            estimate = stats[min(equalities, len(stats) - 1)]
+    for _ in range(bounds):
+        estimate = max(estimate // 4, 1)  # jak SQLite bez sqlite_stat4: każda granica zakresu to 1/4 wierszy
+    return estimate
+
+
+def _plan_accesses(conn, statement: str, parameters: tuple, table_rows, index_stats) -> list[dict]:
+    accesses = []
+    for _, _, _, detail in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all():
+        match = _ACCESS.match(detail)
+        if not match:
+            continue
+        kind, name, using, terms = match.groups()
+        table = _table_name(name, table_rows)
+        if table not in table_rows:
+            continue  # podzapytania i stałe
+        rows = table_rows[table]
+        scan = kind == "SCAN" or (using is not None and "AUTOMATIC" in using)
+        accesses.append({
+            "table": table,
+            "access": "scan" if scan else "search",
+            "detail": detail,
+            "rows": rows if kind == "SCAN" else _estimate(rows, using, terms, index_stats),
+        })
+    return accesses
+
+
+def _severity(access: dict) -> tuple[bool, int]:
+    return access["access"] == "scan", access["rows"]
+
+
+def _time_statement(conn, statement: str, parameters: tuple) -> float:
+    timings = []
+    for _ in range(TIMING_RUNS):
+        started = time.perf_counter()
+        conn.exec_driver_sql(statement, parameters).all()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def run(scale: float = 1.0) -> dict[str, dict]:
+    """Plans of all cases: {"case :: table": worst access to that table in the case}."""
+    from fastapi import HTTPException
+    from app.database.database import Base, Session, engine
+
+    Base.metadata.create_all(bind=engine)
+    _seed(engine, scale)
+
+    results: dict[str, dict] = {}
+    with engine.connect() as conn:
+        table_rows, index_stats = _statistics(conn)
+        for name, function, kwargs in _endpoint_cases() + _scheduler_cases():
+            db = Session(location_id=SEED_LOCATIONS[0])
+
+            def call():
+                try:
+                    function(db=db, **kwargs)
+                except HTTPException:
+                    pass  # 400 dla niedozwolonej kombinacji filtrów - to nie jest błąd planu
+                except Exception as e:
+                    results[f"{name} :: error"] = {"error": repr(e)}
+
+            try:
+                statements = _capture(engine, call)
+            finally:
+                db.close()
+
+            for statement, parameters in statements:
+                is_select = statement.lstrip().upper().startswith("SELECT")
+                ms = _time_statement(conn, statement, parameters) if is_select else 0.0
+                for access in _plan_accesses(conn, statement, parameters, table_rows, index_stats):
+                    key = f"{name} :: {access['table']}"
+                    access["large"] = table_rows[access["table"]] >= LARGE_TABLE_ROWS
+                    worst = results.get(key)
+                    access["ms"] = ms + (worst["ms"] if worst else 0.0)
+                    if worst is None or _severity(access) > _severity(worst):
+                        results[key] = access
+                    else:
+                        worst["ms"] = access["ms"]
+    return results
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict]) -> list[dict]:
+    """Rows of the report; `status` is ok, new, known scan, or one of the failures SCAN / OVER BUDGET / ERROR."""
+    report = []
+    for key, access in results.items():
+        if "error" in access:
+            report.append({"key": key, "status": "ERROR", **access})
+            continue
+        expected = baseline.get(key)
+        status = "ok"
+        if access["access"] == "scan" and access["large"]:
+            status = "known scan" if expected is not None and expected["access"] == "scan" else "SCAN"
+        elif expected is not None and access["rows"] > expected["max_rows"]:
+            status = "OVER BUDGET"
+        elif expected is None:
+            status = "new"
+        report.append({
+            "key": key, "status": status, "max_rows": expected["max_rows"] if expected else None, **access,
+        })
+    return report
+
+
+def new_baseline(results: dict[str, dict]) -> dict[str, dict]:
+    return {
+        key: {
+            "access": access["access"],
+            "detail": access["detail"],
+            "rows": access["rows"],
+            "max_rows": max(access["rows"] * BUDGET_FACTOR, MIN_BUDGET_ROWS),
+        }
+        for key, access in sorted(results.items())
+        if "error" not in access
+    }
+
+
+def format_report(report: list[dict]) -> str:
+    lines = [f"{'status':<12} {'case :: table':<78} {'est rows':>9} {'budget':>8} {'ms':>8}  plan"]
+    order = {"ERROR": 0, "SCAN": 1, "OVER BUDGET": 2, "known scan": 3, "new": 4, "ok": 5}
+    for row in sorted(report, key=lambda row: order[row["status"]]):
+        if row["status"] == "ERROR":
+            lines.append(f"{row['status']:<12} {row['key']:<78} {row['error']}")
+            continue
+        budget = "-" if row["max_rows"] is None else str(row["max_rows"])
+        lines.append(
+            f"{row['status']:<12} {row['key'][:78]:<78} {row['rows']:>9} {budget:>8} {row['ms']:>8.2f}  {row['detail']}"
+        )
+    failures = sum(1 for row in report if row["status"] in ("ERROR", "SCAN", "OVER BUDGET"))
+    lines.append(f"{len(report)} table accesses checked, {failures} regressions")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Check EXPLAIN QUERY PLAN of endpoint and scheduler queries against the baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="accept the current plans and budgets")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier of the seeded row counts")
+    parser.add_argument("--database", help="SQLite file to seed and keep, a temporary file by default")
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    path = args.database or os.path.join(tempfile.mkdtemp(prefix="query_plans_"), "plans.db")
+    if os.path.exists(path):
+        parser.error(f"{path} already exists - the check needs an empty database")
+    # Silnik aplikacji tworzony jest przy imporcie, więc adres bazy trzeba ustawić wcześniej
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ.pop("READ_REPLICA_URL", None)
+    os.environ.pop("LOCATION_DATABASE_URLS", None)
+    os.environ["LOCATION_IDS"] = ",".join(str(location_id) for location_id in SEED_LOCATIONS)
+    logging.disable(logging.INFO)
+
+    from app.models import owner, dog, stay, payment, bank_transfer  # noqa: F401
+    from app.models import dashboard, job, matching_checkpoint, notification, occupancy, webhook_event  # noqa: F401
+    from app.models import archive  # noqa: F401
+
+    results = run(args.scale)
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(new_baseline(results), f, indent=2)
+            f.write("\n")
+        print(f"Baseline with {len(results)} table accesses written to {args.baseline}")
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report = compare(results, baseline)
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+    if any(row["status"] in ("ERROR", "SCAN", "OVER BUDGET") for row in report):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Typed lookups shared by the routers and services.
+
+Rows already in the session's identity map are returned without a query, so repeated
+loads in one request are free. Statements are built once per model and set of columns
+with bound parameters, so each call skips statement construction and reuses
+SQLAlchemy's compiled cache - cheaper than `Session.get` on a miss.
+"""
+from functools import lru_cache
+from typing import Any, Iterable, Optional, TypeVar
+from sqlalchemy import Select, bindparam, literal, select
+from sqlalchemy.orm import Session
+
+T = TypeVar("T")
+
+
+@lru_cache(maxsize=None)
+def _filter_statement(model: type, columns: tuple[str, ...]) -> Select:
+    return select(model).where(*(getattr(model, column) == bindparam(f"p_{column}") for column in columns))
+
+
+@lru_cache(maxsize=None)
+def _exists_statement(model: type, columns: tuple[str, ...]) -> Select:
+    return (
+        select(literal(1))
+        .select_from(model)
+        .where(*(getattr(model, column) == bindparam(f"p_{column}") for column in columns))
+        .limit(1)
+    )
+
+
+@lru_cache(maxsize=None)
+def _in_statement(model: type) -> Select:
+    return select(model).where(model.id.in_(bindparam("p_ids", expanding=True)))
+
+
+def _params(criteria: dict[str, Any]) -> tuple[tuple[str, ...], dict[str, Any]]:
+    columns = tuple(sorted(criteria))
+    return columns, {f"p_{column}": criteria[column] for column in columns}
+
+
+def get(db: Session, model: type[T], id: Any) -> Optional[T]:
+    obj = db.identity_map.get(db.identity_key(model, id))
+    if obj is not None:
+        return obj
+    return first_by(db, model, id=id)
+
+
+def get_many(db: Session, model: type[T], ids: Iterable[Any]) -> dict[Any, T]:
+    """Rows by id; ids already in the session's identity map are not queried again."""
+    found: dict[Any, T] = {}
+    missing = []
+    for id in set(ids):
+        obj = db.identity_map.get(db.identity_key(model, id))
+        if obj is not None:
+            found[id] = obj
+        else:
+            missing.append(id)
+    if missing:
+        for obj in db.execute(_in_statement(model), {"p_ids": missing}).scalars():
+            found[obj.id] = obj
+    return found
+
+
+def exists(db: Session, model: type, **criteria: Any) -> bool:
+    """Whether a row matches all `column=value` criteria."""
+    if list(criteria) == ["id"] and db.identity_map.get(db.identity_key(model, criteria["id"])) is not None:
+        return True
+    columns, params = _params(criteria)
+    return db.execute(_exists_statement(model, columns), params).first() is not None
+
+
+def filter_by(db: Session, model: type[T], **criteria: Any) -> list[T]:
+    columns, params = _params(criteria)
+    return list(db.execute(_filter_statement(model, columns), params).scalars().all())
+
+
+def first_by(db: Session, model: type[T], **criteria: Any) -> Optional[T]:
+    columns, params = _params(criteria)
+    return db.execute(_filter_statement(model, columns), params).scalars().first()
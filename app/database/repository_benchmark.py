@@ -0,0 +1,106 @@
+import argparse
+import time
+from typing import Callable, Optional
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+from app.database.database import Base
+from app.database import repository
+from app.database.location import DEFAULT_LOCATION_ID
+from app.models.owner import Owner
+from app.models.dog import Dog
+from app.models.stay import Stay  # relacje Dog wymagają zarejestrowanych modeli
+from app.models.payment import Payment
+
+ROWS = 1000
+
+
+def _setup(cached: bool):
+    options = {} if cached else {"compiled_cache": None}
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False}).execution_options(**options)
+    Base.metadata.create_all(engine)
+    # Zwykła sesja nie uzupełnia placówki przy zapisie - podajemy ją jawnie
+    with Session(engine) as db:
+        db.add_all(Owner(id=i, location_id=DEFAULT_LOCATION_ID, fullname=f"Owner {i}", email=f"o{i}@example.com", phone_number=i) for i in range(1, ROWS + 1))
+        db.add_all(Dog(id=i, location_id=DEFAULT_LOCATION_ID, name=f"Dog {i}", age=3, owner_id=i) for i in range(1, ROWS + 1))
+        db.commit()
+    queries = [0]
+    event.listen(engine, "before_cursor_execute", lambda *args: queries.__setitem__(0, queries[0] + 1))
+    return engine, queries
+
+
+def _time(label: str, iterations: int, engine, queries, request: Callable[[Session, int], None]) -> tuple[str, float, float]:
+    queries[0] = 0
+    started = time.perf_counter()
+    for i in range(iterations):
+        with Session(engine) as db:
+            request(db, i % ROWS + 1)
+    elapsed = time.perf_counter() - started
+    return label, elapsed / iterations * 1e6, queries[0] / iterations
+
+
+def select_first(db: Session, id: int) -> None:
+    db.execute(select(Dog).where(Dog.id == id)).scalars().first()
+
+
+def repository_get(db: Session, id: int) -> None:
+    repository.get(db, Dog, id)
+
+
+def session_get(db: Session, id: int) -> None:
+    db.get(Dog, id)
+
+
+# Wyniki trzymane w liście jak w prawdziwym żądaniu - mapa tożsamości trzyma obiekty słabo
+def select_first_three_times(db: Session, id: int) -> None:
+    [db.execute(select(Dog).where(Dog.id == id)).scalars().first() for _ in range(3)]
+
+
+def session_get_three_times(db: Session, id: int) -> None:
+    [db.get(Dog, id) for _ in range(3)]
+
+
+def repository_get_three_times(db: Session, id: int) -> None:
+    [repository.get(db, Dog, id) for _ in range(3)]
+
+
+def select_by_column(db: Session, id: int) -> None:
+    db.execute(select(Dog).where(Dog.owner_id == id)).scalars().first()
+
+
+def repository_first_by(db: Session, id: int) -> None:
+    repository.first_by(db, Dog, owner_id=id)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Compare ad-hoc select() lookups with app.database.repository")
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    # Sama budowa instrukcji, bez bazy
+    started = time.perf_counter()
+    for i in range(args.iterations):
+        select(Dog).where(Dog.id == i)
+    construction = (time.perf_counter() - started) / args.iterations * 1e6
+    print(f"{'statement construction, select(Dog).where(Dog.id == id)':58} {construction:8.1f} us/call")
+
+    for cached in (False, True):
+        engine, queries = _setup(cached)
+        print(f"\n{'with' if cached else 'without'} SQLAlchemy compiled cache:")
+        for label, request in (
+            ("db.execute(select(...).where(id == ...)).first()", select_first),
+            ("Session.get", session_get),
+            ("repository.get", repository_get),
+            ("3 lookups of the same row, select()", select_first_three_times),
+            ("3 lookups of the same row, Session.get", session_get_three_times),
+            ("3 lookups of the same row, repository.get", repository_get_three_times),
+            ("lookup by column, select()", select_by_column),
+            ("lookup by column, repository.first_by", repository_first_by),
+        ):
+            label, micros, per_request = _time(label, args.iterations, engine, queries, request)
+            print(f"  {label:56} {micros:8.1f} us/request {per_request:4.1f} queries/request")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
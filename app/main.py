@@ -1,25 +1,58 @@
+import functools
 from fastapi import FastAPI
-from app.database.database import Base, engine, Session
+from app.database.database import Base, engine, Session, all_engines
+from app.database.location import LOCATION_IDS, current_location_id, location_scope
 from app.services.update_dog_ages import update_dog_ages
 from apscheduler.schedulers.background import BackgroundScheduler
 from app.routers import dogs, owners, payments, stays
 import logging
 from app.routers import bank_transfers
 from app.routers import bank_transfer_scheduler
-from app.services.update_payments_from_transfers import update_payments_from_transfers
+from app.routers import batch
+from app.routers import dashboard
+from app.routers import availability
+from app.routers import webhooks
+from app.routers import invoices
+from app.routers import recurring_stays
+from app.services.update_payments_from_transfers import has_unmatched_transfers
 from app.utils.logging_config import setup_logging
+from app.middleware.admission_control import AdmissionControlMiddleware, admission_metrics
+from app.middleware.traffic_capture import TRAFFIC_CAPTURE_ENABLED, TrafficCaptureMiddleware
+from app.utils.profiling import PROFILING_ENABLED, ProfilingMiddleware, instrument_routes, profile_run
 
 from app.models.owner import Owner
 from app.models.dog import Dog
 from app.models.stay import Stay
 from app.models.payment import Payment
+from app.models.payment_ledger import PaymentLedgerEntry
 from app.models.bank_transfer import BankTransfer
+from app.models.job import Job
+from app.models.archive import ArchivedStay, ArchivedPayment, ArchivedBankTransfer, ArchivedPaymentLedgerEntry
+from app.services.archive import archive_completed_stays
+from app.models.notification import OverdueNotification
+from app.services.overdue import update_overdue_payments, notify_overdue_owners
+from app.services.jobs import enqueue_job, recover_interrupted_jobs, shutdown_jobs
+from app.models.dashboard import DashboardCounter
+from app.models.matching_checkpoint import MatchingCheckpoint
+from app.models.occupancy import DailyOccupancy
+from app.models.recurring_stay import RecurringStay, RecurringStayException
+from app.services.recurring_stays import bill_recurring_stays, materialize_horizon
+from app.services.occupancy import rebuild_occupancy
+from app.models.webhook_event import WebhookEvent
+from app.services.bank_webhook import BANK_WEBHOOK_SECRET, consumers as webhook_consumers
+from app.services.dashboard import DASHBOARD_RECONCILE_SECONDS, reconcile_counters
 
 setup_logging()
 
-Base.metadata.create_all(bind=engine)
+for _engine in all_engines():
+    Base.metadata.create_all(bind=_engine)
+recover_interrupted_jobs()
 
 app = FastAPI()
+app.add_middleware(AdmissionControlMiddleware)
+# Nagrywanie ruchu do odtworzenia (app/services/traffic_replay.py) - tylko gdy włączone
+if TRAFFIC_CAPTURE_ENABLED:
+    app.add_middleware(TrafficCaptureMiddleware)
 
 app.include_router(dogs.router)
 app.include_router(owners.router)
@@ -27,25 +60,128 @@ app.include_router(payments.router)
 app.include_router(stays.router)
 app.include_router(bank_transfers.router)
 app.include_router(bank_transfer_scheduler.router)
+app.include_router(batch.router)
+app.include_router(dashboard.router)
+app.include_router(availability.router)
+app.include_router(webhooks.router)
+app.include_router(invoices.router)
+app.include_router(recurring_stays.router)
+
+# Profilowanie tylko gdy włączone w konfiguracji - inaczej brak jakiegokolwiek narzutu
+if PROFILING_ENABLED:
+    from app.routers import debug
+    app.include_router(debug.router)
+    app.add_middleware(ProfilingMiddleware)
+    instrument_routes(app)
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Dog Hotel API"}
 
+@app.get("/admission/metrics")
+def read_admission_metrics():
+    return admission_metrics()
+
 # Funkcja do uruchomienia aktualizacji raz w roku
 def scheduled_update():
     print("Scheduled update triggered.")  # Debugging print
     logging.getLogger("update_logger").info("Scheduled update triggered.")
     db = Session(bind=engine)
-    update_dog_ages(db)
-    update_payments_from_transfers(db)  # <--- uruchamiamy automatyczne dopasowanie przelewów
+    with profile_run("scheduled_update"):
+        update_dog_ages(db)
+        # Przelewy z webhooka są dopasowywane od razu - poller tylko dobiera zaległe.
+        # Przez kolejkę zadań, więc łączy się z przebiegiem uruchomionym ręcznie zamiast dublować go
+        if has_unmatched_transfers(db):
+            enqueue_job("bank_transfer_matching", current_location_id())
+        else:
+            logging.getLogger("update_logger").info("No unmatched bank transfers, skipping matching.")
     db.close()
 
-# Scheduler
-scheduler = BackgroundScheduler()
-scheduler.add_job(scheduled_update, 'interval', seconds=200)  # change to days=1
-scheduler.start()
+# Przenoszenie starych, opłaconych pobytów do archiwum
+def scheduled_archive():
+    db = Session(bind=engine)
+    try:
+        archive_completed_stays(db)
+    except Exception:
+        logging.getLogger(__name__).error("Scheduled archiving failed", exc_info=True)
+    finally:
+        db.close()
+
+# Oznaczanie zaległych płatności i zbiorcze powiadomienia właścicieli - osobne zadanie,
+# żeby wysyłka maili nie blokowała pozostałych
+def scheduled_overdue_notifications():
+    db = Session(bind=engine)
+    try:
+        with profile_run("scheduled_overdue_notifications"):
+            update_overdue_payments(db)
+            notify_overdue_owners(db)
+    except Exception:
+        logging.getLogger(__name__).error("Scheduled overdue notifications failed", exc_info=True)
+    finally:
+        db.close()
+
+# Uzgadnianie liczników panelu z bazą - poprawia dryf i przełącza liczniki na nowy dzień
+def scheduled_dashboard_reconcile():
+    db = Session(bind=engine)
+    try:
+        reconcile_counters(db)
+    except Exception:
+        logging.getLogger(__name__).error("Dashboard counter reconciliation failed", exc_info=True)
+    finally:
+        db.close()
+
+# Przesuwanie horyzontu wystąpień cyklicznych pobytów i rozliczanie zakończonych miesięcy
+def scheduled_recurring_stays():
+    db = Session(bind=engine)
+    try:
+        with profile_run("scheduled_recurring_stays"):
+            materialize_horizon(db)
+            bill_recurring_stays(db)
+    except Exception:
+        logging.getLogger(__name__).error("Scheduled recurring stays failed", exc_info=True)
+    finally:
+        db.close()
+
+for location_id in LOCATION_IDS:
+    with location_scope(location_id):
+        scheduled_dashboard_reconcile()
+
+        # Liczniki zajętości od dziś przeliczone z pobytów - obejmują też dane sprzed tabeli daily_occupancy
+        with Session() as startup_db:
+            rebuild_occupancy(startup_db)
+        scheduled_recurring_stays()
+
+# Zadanie uruchamiane w kontekście placówki - sesje tworzone w środku widzą tylko jej dane
+def in_location(job, location_id: int):
+    @functools.wraps(job)
+    def run():
+        with location_scope(location_id):
+            job()
+    return run
+
+# Osobny scheduler (i pula wątków) dla każdej placówki, więc długie zadanie jednej nie blokuje innych
+def start_location_scheduler(location_id: int) -> BackgroundScheduler:
+    location_scheduler = BackgroundScheduler()
+    location_scheduler.add_job(in_location(scheduled_update, location_id), 'interval', seconds=200)  # change to days=1
+    location_scheduler.add_job(in_location(scheduled_archive, location_id), 'interval', days=1)
+    location_scheduler.add_job(in_location(scheduled_recurring_stays, location_id), 'interval', days=1)
+    location_scheduler.add_job(in_location(scheduled_overdue_notifications, location_id), 'interval', hours=1)
+    location_scheduler.add_job(
+        in_location(scheduled_dashboard_reconcile, location_id), 'interval', seconds=DASHBOARD_RECONCILE_SECONDS
+    )
+    location_scheduler.start()
+    return location_scheduler
+
+schedulers = {location_id: start_location_scheduler(location_id) for location_id in LOCATION_IDS}
+
+if BANK_WEBHOOK_SECRET:
+    for webhook_consumer in webhook_consumers.values():
+        webhook_consumer.start()
 
 @app.on_event("shutdown")
 def shutdown():
-    scheduler.shutdown()
\ No newline at end of file
+    for location_scheduler in schedulers.values():
+        location_scheduler.shutdown()
+    for webhook_consumer in webhook_consumers.values():
+        webhook_consumer.stop()
+    shutdown_jobs()
\ No newline at end of file
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true"
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "2"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+
+# Limity współbieżności i długość kolejki dla każdej klasy tras
+ROUTE_CLASS_LIMITS = {
+    "read": (int(os.getenv("ADMISSION_READ_LIMIT", "32")), int(os.getenv("ADMISSION_READ_QUEUE", "64"))),
+    "write": (int(os.getenv("ADMISSION_WRITE_LIMIT", "8")), int(os.getenv("ADMISSION_WRITE_QUEUE", "32"))),
+    "expensive": (int(os.getenv("ADMISSION_EXPENSIVE_LIMIT", "4")), int(os.getenv("ADMISSION_EXPENSIVE_QUEUE", "8"))),
+}
+
+EXEMPT_PATHS = {"/", "/admission/metrics", "/docs", "/openapi.json"}
+
+# Eksporty i raporty są zawsze kosztowne, tak jak GET na całej kolekcji
+EXPENSIVE_PREFIXES = ("/export", "/reports", "/invoices/export")
+
+
+def classify_route(method: str, path: str) -> str:
+    if path == "/batch":
+        return "expensive"  # POST, ale tylko odczyt wielu zasobów naraz
+    if method in ("GET", "HEAD"):
+        if path.endswith("/") or path.startswith(EXPENSIVE_PREFIXES):
+            return "expensive"
+        return "read"
+    return "write"
+
+
+class AdmissionGate:
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted_total = 0
+        self.rejected_total = 0
+        self.timed_out_total = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self, timeout: float) -> bool:
+        if self._semaphore.locked():
+            if self.queued >= self.max_queue:
+                self.rejected_total += 1
+                return False
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self.timed_out_total += 1
+                return False
+            finally:
+                self.queued -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        self.admitted_total += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def metrics(self) -> dict:
+        return {
+            "limit": self.limit,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "admitted_total": self.admitted_total,
+            "rejected_total": self.rejected_total,
+            "timed_out_total": self.timed_out_total,
+        }
+
+
+gates = {name: AdmissionGate(name, limit, queue) for name, (limit, queue) in ROUTE_CLASS_LIMITS.items()}
+
+
+def admission_metrics() -> dict:
+    return {name: gate.metrics() for name, gate in gates.items()}
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware that sheds load per route class before it reaches the database.
+
+    Requests wait in a bounded queue for a free slot; when the queue is full or
+    the wait times out the client gets an immediate 503 with Retry-After.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_CONTROL_ENABLED or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        route_class = classify_route(scope["method"], scope["path"])
+        gate = gates[route_class]
+
+        if not await gate.acquire(ADMISSION_QUEUE_TIMEOUT_SECONDS):
+            log.warning(f"Shedding {scope['method']} {scope['path']} ({route_class} queue depth {gate.queued})")
+            await self._reject(send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": "Service overloaded, retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(ADMISSION_RETRY_AFTER_SECONDS).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
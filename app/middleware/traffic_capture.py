@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from urllib.parse import parse_qsl
+from app.utils.anonymize import anonymize_value
+
+log = logging.getLogger(__name__)
+
+TRAFFIC_CAPTURE_ENABLED = os.getenv("TRAFFIC_CAPTURE_ENABLED", "false").lower() == "true"
+TRAFFIC_CAPTURE_FILE = os.getenv(
+    "TRAFFIC_CAPTURE_FILE", os.path.join(os.path.dirname(__file__), "..", "..", "logs", "traffic.ndjson")
+)
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", "1"))
+TRAFFIC_CAPTURE_MAX_BODY = int(os.getenv("TRAFFIC_CAPTURE_MAX_BODY", "65536"))  # większe ciała zapisujemy tylko jako rozmiar
+
+# Nagłówki potrzebne do odtworzenia żądania; podpisy webhooka i tak nie przejdą ponownie
+CAPTURED_HEADERS = {b"x-location-id": "X-Location-Id", b"if-match": "If-Match"}
+SKIPPED_PATHS = {"/docs", "/openapi.json", "/admission/metrics"}
+
+
+class CaptureWriter:
+    """Appends captured records to the NDJSON file from a background thread, off the request path."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+        self._thread.start()
+
+    def write(self, record: dict) -> None:
+        self._queue.put(record)
+
+    def _run(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a") as f:
+            while True:
+                record = self._queue.get()
+                f.write(json.dumps(record, separators=(",", ":"), default=str) + "\n")
+                # Dopisujemy całą kolejkę naraz i dopiero wtedy zrzucamy bufor na dysk
+                while not self._queue.empty():
+                    f.write(json.dumps(self._queue.get(), separators=(",", ":"), default=str) + "\n")
+                f.flush()
+
+
+def _anonymized_body(body: bytes):
+    if not body:
+        return None
+    if len(body) > TRAFFIC_CAPTURE_MAX_BODY:
+        return {"_bytes": len(body)}
+    try:
+        return anonymize_value("", json.loads(body))
+    except ValueError:
+        return {"_bytes": len(body)}
+
+
+class TrafficCaptureMiddleware:
+    """Records anonymized request shapes (route, query, body, headers, timing) for the replay tool.
+
+    Only installed when TRAFFIC_CAPTURE_ENABLED is set. Values of personal fields
+    are replaced by salted tokens, see app/utils/anonymize.py.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.writer = CaptureWriter(TRAFFIC_CAPTURE_FILE)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["path"] in SKIPPED_PATHS
+            or random.random() >= TRAFFIC_CAPTURE_SAMPLE_RATE
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        status = {"code": 500}
+
+        async def capturing_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                chunks.append(message.get("body", b""))
+            return message
+
+        async def capturing_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, capturing_receive, capturing_send)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            route = scope.get("route")
+            headers = {
+                CAPTURED_HEADERS[name]: value.decode()
+                for name, value in scope["headers"] if name in CAPTURED_HEADERS
+            }
+            self.writer.write({
+                "ts": round(started_at, 4),
+                "method": scope["method"],
+                "route": route.path if route is not None else None,
+                "path": scope["path"],
+                "query": [
+                    [key, anonymize_value(key, value)]
+                    for key, value in parse_qsl(scope["query_string"].decode(), keep_blank_values=True)
+                ],
+                "headers": headers,
+                "body": _anonymized_body(b"".join(chunks)),
+                "status": status["code"],
+                "ms": round(duration_ms, 2),
+            })
@@ -0,0 +1,44 @@
+from sqlalchemy import Column, DateTime, Index, Table
+from app.database.database import Base
+from app.database.location import LocationScoped
+from app.models.stay import Stay
+from app.models.payment import Payment
+from app.models.bank_transfer import BankTransfer
+from app.models.payment_ledger import PaymentLedgerEntry
+
+
+def _archive_table(source: Table, *indexes: tuple[str, ...]) -> Table:
+    """Copy of a live table without foreign keys, plus the time the row was archived.
+
+    Rows keep their primary keys so they can be restored unchanged.
+    """
+    columns = [
+        Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+        for column in source.columns
+    ]
+    name = f"{source.name}_archive"
+    return Table(
+        name,
+        Base.metadata,
+        *columns,
+        Column("archived_at", DateTime, nullable=False),
+        *(Index(f"ix_{name}_{'_'.join(columns)}", *columns) for columns in indexes),
+    )
+
+
+class ArchivedStay(LocationScoped, Base):
+    __table__ = _archive_table(
+        Stay.__table__, ("location_id", "start_date"), ("location_id", "owner_id"), ("location_id", "dog_id")
+    )
+
+
+class ArchivedPayment(LocationScoped, Base):
+    __table__ = _archive_table(Payment.__table__, ("stay_id",), ("location_id", "owner_id"))
+
+
+class ArchivedBankTransfer(LocationScoped, Base):
+    __table__ = _archive_table(BankTransfer.__table__, ("location_id", "matched_payment_id"), ("location_id", "fingerprint"))
+
+
+class ArchivedPaymentLedgerEntry(LocationScoped, Base):
+    __table__ = _archive_table(PaymentLedgerEntry.__table__, ("location_id", "payment_id"))
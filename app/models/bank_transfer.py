@@ -1,10 +1,18 @@
-from sqlalchemy import String, ForeignKey
+from sqlalchemy import String, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime, timezone
 from app.database.database import Base
+from app.database.location import LocationScoped
+import hashlib
 
-class BankTransfer(Base):
+class BankTransfer(LocationScoped, Base):
     __tablename__ = "bank_transfers"
+    __table_args__ = (
+        Index("ix_bank_transfers_location_id_matched_payment_id", "location_id", "matched_payment_id"),
+        # Ten sam przelew może trafić do dwóch placówek - duplikat liczy się tylko w obrębie jednej
+        UniqueConstraint("location_id", "fingerprint", name="uq_bank_transfers_location_id_fingerprint"),
+        {"sqlite_autoincrement": True},  # id nie może wrócić po archiwizacji
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     from_account: Mapped[str] = mapped_column(String, nullable=False)
@@ -12,6 +20,32 @@ class BankTransfer(Base):
     title: Mapped[str] = mapped_column(String, nullable=False)
     amount: Mapped[float] = mapped_column(nullable=False)
     received_at: Mapped[datetime] = mapped_column(default=datetime.now(timezone.utc))
+    bank_reference: Mapped[str | None] = mapped_column(String, nullable=True)
+
+    # Odcisk linii wyciągu - ten sam przelew nie może zostać zapisany dwa razy
+    fingerprint: Mapped[str | None] = mapped_column(String(64), nullable=True)
 
     matched_payment_id: Mapped[int | None] = mapped_column(ForeignKey("payments.id"), nullable=True)
     matched_payment = relationship("Payment", backref="matched_transfers")
+
+    @staticmethod
+    def compute_fingerprint(
+        from_account: str,
+        amount: float,
+        title: str,
+        received_at: datetime,
+        bank_reference: str | None = None,
+    ) -> str:
+        parts = [
+            "".join(from_account.split()),
+            f"{amount:.2f}",
+            " ".join(title.split()).lower(),
+            received_at.date().isoformat(),
+            (bank_reference or "").strip(),
+        ]
+        return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+    def refresh_fingerprint(self) -> None:
+        self.fingerprint = self.compute_fingerprint(
+            self.from_account, self.amount, self.title, self.received_at, self.bank_reference
+        )
@@ -0,0 +1,14 @@
+from sqlalchemy import String
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import date, datetime
+from app.database.database import Base
+from app.database.location import LocationScoped
+
+class DashboardCounter(LocationScoped, Base):
+    __tablename__ = "dashboard_counters"
+
+    location_id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String, primary_key=True)
+    value: Mapped[float] = mapped_column(default=0.0)
+    as_of: Mapped[date]  # dzień, dla którego liczniki zależne od daty są aktualne
+    reconciled_at: Mapped[datetime]
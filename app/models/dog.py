@@ -1,10 +1,15 @@
 from app.database.database import Base
+from app.database.location import LocationScoped
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, UniqueConstraint
 from datetime import datetime, timezone
 
-class Dog(Base):
+class Dog(LocationScoped, Base):
     __tablename__ = "dogs"
+    __table_args__ = (
+        UniqueConstraint("owner_id", "name", name="uq_dogs_owner_id_name"),
+        Index("ix_dogs_location_id_name", "location_id", "name"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str]
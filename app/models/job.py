@@ -0,0 +1,20 @@
+from sqlalchemy import Index, String, JSON
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import datetime
+from app.database.database import Base
+from app.database.location import LocationScoped
+
+class Job(LocationScoped, Base):
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_location_id_name", "location_id", "name"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String, nullable=False)
+    status: Mapped[str] = mapped_column(String, nullable=False, default="queued")  # queued, running, succeeded, failed
+    progress: Mapped[float] = mapped_column(default=0.0)  # 0.0 - 1.0
+    counts: Mapped[dict] = mapped_column(JSON, default=dict)
+    errors: Mapped[list] = mapped_column(JSON, default=list)
+
+    created_at: Mapped[datetime]
+    started_at: Mapped[datetime | None] = mapped_column(nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(nullable=True)
@@ -0,0 +1,20 @@
+from sqlalchemy import String
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import datetime
+from app.database.database import Base
+from app.database.location import LocationScoped
+
+class MatchingCheckpoint(LocationScoped, Base):
+    """Progress of one stay-id partition of a catch-up matching run."""
+    __tablename__ = "matching_checkpoints"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    run_id: Mapped[str] = mapped_column(String(32), nullable=False, index=True)
+    stay_from: Mapped[int]
+    stay_to: Mapped[int]
+    last_stay_id: Mapped[int | None] = mapped_column(nullable=True)  # ostatni pobyt zatwierdzony w tej partycji
+    status: Mapped[str] = mapped_column(String, nullable=False, default="pending")  # pending, done
+    processed: Mapped[int] = mapped_column(default=0)
+    updated: Mapped[int] = mapped_column(default=0)
+    failed: Mapped[int] = mapped_column(default=0)
+    updated_at: Mapped[datetime]
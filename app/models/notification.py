@@ -0,0 +1,15 @@
+from sqlalchemy import ForeignKey, String
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import datetime
+from app.database.database import Base
+
+class OverdueNotification(Base):
+    __tablename__ = "overdue_notifications"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # Jedno powiadomienie na płatność - ponowne uruchomienie nie wysyła go drugi raz
+    payment_id: Mapped[int] = mapped_column(nullable=False, unique=True, index=True)
+    owner_id: Mapped[int] = mapped_column(ForeignKey("owners.id"), nullable=False, index=True)
+    email: Mapped[str] = mapped_column(String, nullable=False)
+    digest_id: Mapped[str] = mapped_column(String, nullable=False)
+    sent_at: Mapped[datetime]
@@ -0,0 +1,14 @@
+from sqlalchemy import String
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import date
+from app.database.database import Base
+from app.database.location import LocationScoped
+
+class DailyOccupancy(LocationScoped, Base):
+    """Number of stays occupying a kennel type on a day; kennel_type "*" counts all types."""
+    __tablename__ = "daily_occupancy"
+
+    location_id: Mapped[int] = mapped_column(primary_key=True)
+    day: Mapped[date] = mapped_column(primary_key=True)
+    kennel_type: Mapped[str] = mapped_column(String, primary_key=True)
+    occupied: Mapped[int] = mapped_column(default=0)
@@ -1,9 +1,17 @@
 from app.database.database import Base
+from app.database.location import LocationScoped
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import Index, UniqueConstraint
 
 
-class Owner(Base):
+class Owner(LocationScoped, Base):
     __tablename__ = "owners"
+    __table_args__ = (
+        # Unikalność w obrębie placówki; indeksy zaczynają się od location_id
+        UniqueConstraint("location_id", "email", name="uq_owners_location_id_email"),
+        UniqueConstraint("location_id", "phone_number", name="uq_owners_location_id_phone_number"),
+        Index("ix_owners_location_id_fullname", "location_id", "fullname"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     fullname: Mapped[str]
@@ -1,23 +1,44 @@
-from app.database.database import Base
+from app.database.database import Base, RoutingSession
+from app.database.location import LocationScoped
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, UniqueConstraint, event, inspect
 from app.models.stay import Stay as StayModel
 from sqlalchemy.orm import Session
+from datetime import date
 
 DAILY_RATE = 50.0  # Stawka za dzień pobytu
 
-class Payment(Base):
+class Payment(LocationScoped, Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        UniqueConstraint("stay_id", name="uq_payments_stay_id"),  # jedna płatność na pobyt
+        Index("ix_payments_location_id_is_paid", "location_id", "is_paid"),
+        # "Płatności właściciela X" (z filtrem opłacone/zaległe) to jeden zakres indeksu, bez złączenia z pobytami
+        Index("ix_payments_location_id_owner_id_is_paid_is_overdue", "location_id", "owner_id", "is_paid", "is_overdue"),
+        {"sqlite_autoincrement": True},  # id nie może wrócić po archiwizacji
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    amount: Mapped[float]
+    amount: Mapped[float]  # kwota należna
+    paid_amount: Mapped[float] = mapped_column(default=0.0)  # suma wpisów w payment_ledger
     is_paid: Mapped[bool] = mapped_column(default=False)  
     is_overdue: Mapped[bool] = mapped_column(default=False)  
     overdue_days: Mapped[int] = mapped_column(default=0)  
+    # Termin płatności okresu cyklicznego pobytu; brak - płatne do końca pobytu
+    due_date: Mapped[date | None] = mapped_column(nullable=True)
+    version: Mapped[int] = mapped_column(nullable=False)  # rośnie przy każdym zapisie, patrz __mapper_args__
 
     stay_id: Mapped[int] = mapped_column(ForeignKey("stays.id"), nullable=False)
     stay = relationship("Stay", back_populates="payments")
+    owner_id: Mapped[int] = mapped_column(ForeignKey("owners.id"), nullable=False)  # kopia Stay.owner_id, patrz _sync_owner_id
+
+    # Blokada optymistyczna - UPDATE z nieaktualną wersją kończy się StaleDataError
+    __mapper_args__ = {"version_id_col": version}
     
+    def due_on(self) -> date:
+        """Day after which the unpaid payment is overdue."""
+        return self.due_date or self.stay.end_date
+
     def calculate_amount(self, db: Session) -> float:
         stay = db.get(StayModel, self.stay_id)
         if not stay:
@@ -28,4 +49,19 @@ class Payment(Base):
         if stay_duration <= 0:
             raise ValueError("Stay duration must be greater than 0 days.")
         additional_fee = stay.additional_fee_per_day if stay.additional_fee_per_day else 0
-        return stay_duration * (DAILY_RATE + additional_fee)
\ No newline at end of file
+        return stay_duration * (DAILY_RATE + additional_fee)
+
+
+@event.listens_for(RoutingSession, "before_flush")
+def _sync_owner_id(session, flush_context, instances):
+    # Płatność przejmuje właściciela pobytu - przy utworzeniu, zmianie pobytu i zmianie właściciela pobytu
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Payment):
+            if obj in session.new or inspect(obj).attrs.stay_id.history.has_changes():
+                stay = session.get(StayModel, obj.stay_id) if obj.stay_id is not None else obj.stay
+                if stay is not None:
+                    obj.owner_id = stay.owner_id
+        elif isinstance(obj, StayModel) and obj not in session.new:
+            if inspect(obj).attrs.owner_id.history.has_changes():
+                for payment in obj.payments:
+                    payment.owner_id = obj.owner_id
@@ -0,0 +1,27 @@
+from datetime import datetime, timezone
+from sqlalchemy import ForeignKey, Index
+from sqlalchemy.orm import Mapped, backref, mapped_column, relationship
+from app.database.database import Base
+from app.database.location import LocationScoped
+
+
+class PaymentLedgerEntry(LocationScoped, Base):
+    """Money received for a payment - one entry per matched bank transfer.
+
+    Payment.paid_amount is the running SUM of its entries, see app/services/payment_ledger.py.
+    """
+    __tablename__ = "payment_ledger"
+    __table_args__ = (
+        # Suma wpłat płatności czytana z samego indeksu, bez odwołań do tabeli
+        Index("ix_payment_ledger_location_id_payment_id_amount", "location_id", "payment_id", "amount"),
+        {"sqlite_autoincrement": True},  # id nie może wrócić po archiwizacji
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    amount: Mapped[float]
+    created_at: Mapped[datetime] = mapped_column(default=lambda: datetime.now(timezone.utc))
+
+    payment_id: Mapped[int] = mapped_column(ForeignKey("payments.id"), nullable=False)
+    payment = relationship("Payment", backref=backref("ledger_entries", cascade="all, delete-orphan"))
+    # Przelew wpisany do księgi najwyżej raz
+    bank_transfer_id: Mapped[int] = mapped_column(ForeignKey("bank_transfers.id"), nullable=False, unique=True)
@@ -0,0 +1,64 @@
+from datetime import date, datetime, timezone
+from sqlalchemy import ForeignKey, Index
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from app.database.database import Base
+from app.database.location import LocationScoped
+
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+
+
+class RecurringStay(LocationScoped, Base):
+    """Stay repeated every `interval_weeks` weeks on the same weekdays (RRULE FREQ=WEEKLY;INTERVAL;BYDAY).
+
+    Occurrences get rows in `stays` only up to `materialized_until` (the rolling horizon),
+    when one is edited, or when its month is billed; later ones are expanded on demand,
+    see app/services/recurring_stays.py.
+    """
+    __tablename__ = "recurring_stays"
+    __table_args__ = (
+        Index("ix_recurring_stays_location_id_dog_id", "location_id", "dog_id"),
+        Index("ix_recurring_stays_location_id_materialized_until", "location_id", "materialized_until"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    starts_on: Mapped[date]
+    ends_on: Mapped[date] = mapped_column(nullable=True)  # brak - wzorzec bez końca
+    by_weekday: Mapped[str]  # np. "MO,WE,FR"
+    interval_weeks: Mapped[int] = mapped_column(default=1)
+    duration_days: Mapped[int] = mapped_column(default=1)  # długość jednego wystąpienia
+    additional_fee_per_day: Mapped[float] = mapped_column(default=0.0)
+    kennel_type: Mapped[str] = mapped_column(default="standard")
+    notes: Mapped[str] = mapped_column(nullable=True)
+    # Wystąpienia do tego dnia mają już wiersze w stays (albo zostały odwołane)
+    materialized_until: Mapped[date]
+    # Miesiące do tego dnia są rozliczone płatnościami
+    billed_until: Mapped[date]
+    created_at: Mapped[datetime] = mapped_column(default=lambda: datetime.now(timezone.utc))
+    version: Mapped[int] = mapped_column(nullable=False)
+
+    dog_id: Mapped[int] = mapped_column(ForeignKey("dogs.id"), nullable=False)
+    owner_id: Mapped[int] = mapped_column(ForeignKey("owners.id"), nullable=False)
+
+    exceptions = relationship("RecurringStayException", cascade="all, delete-orphan")
+
+    __mapper_args__ = {"version_id_col": version}
+
+    @property
+    def weekday_numbers(self) -> list[int]:
+        return sorted(WEEKDAYS.index(code) for code in self.by_weekday.split(","))
+
+    @property
+    def rrule(self) -> str:
+        rule = f"FREQ=WEEKLY;INTERVAL={self.interval_weeks};BYDAY={self.by_weekday}"
+        if self.ends_on is not None:
+            rule += f";UNTIL={self.ends_on:%Y%m%d}"
+        return rule
+
+
+class RecurringStayException(LocationScoped, Base):
+    """Occurrence that must not be materialized: cancelled, or skipped for lack of capacity."""
+    __tablename__ = "recurring_stay_exceptions"
+
+    recurring_stay_id: Mapped[int] = mapped_column(ForeignKey("recurring_stays.id"), primary_key=True)
+    occurrence_date: Mapped[date] = mapped_column(primary_key=True)
+    reason: Mapped[str] = mapped_column(default="cancelled")  # "cancelled" albo "no capacity"
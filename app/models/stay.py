@@ -1,27 +1,57 @@
 from __future__ import annotations
 from app.database.database import Base
+from app.database.location import LocationScoped
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy import ForeignKey
 from datetime import date, datetime, timezone
 
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, UniqueConstraint, event
 from app.models.owner import Owner
+from app.models.recurring_stay import RecurringStay  # noqa: F401 - klucz obcy recurring_stay_id
 
-class Stay(Base):
+class Stay(LocationScoped, Base):
     __tablename__ = "stays"
+    __table_args__ = (
+        # Każde zapytanie filtruje po placówce, więc indeksy zaczynają się od location_id
+        Index("ix_stays_location_id_start_date", "location_id", "start_date"),
+        Index("ix_stays_location_id_end_date_start_date", "location_id", "end_date", "start_date"),
+        Index("ix_stays_location_id_duration_days", "location_id", "duration_days"),
+        Index("ix_stays_location_id_dog_id", "location_id", "dog_id"),
+        # Jedno wystąpienie wzorca to najwyżej jeden pobyt; indeks służy też wyszukiwaniu wystąpień wzorca
+        UniqueConstraint("recurring_stay_id", "occurrence_date", name="uq_stays_recurring_stay_id_occurrence_date"),
+        {"sqlite_autoincrement": True},  # id nie może wrócić po archiwizacji
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     start_date: Mapped[date]
     end_date: Mapped[date]
+    duration_days: Mapped[int]  # liczba dni łącznie z ostatnim, utrzymywana przez zdarzenia poniżej
     additional_fee_per_day: Mapped[float] = mapped_column(default=0.0)  # Dodatkowa stawka
+    kennel_type: Mapped[str] = mapped_column(default="standard")  # rodzaj boksu, patrz KENNEL_TYPE_CAPACITY
     notes: Mapped[str] = mapped_column(nullable=True)
     created_at: Mapped[datetime] = mapped_column(default=datetime.now(timezone.utc))
+    version: Mapped[int] = mapped_column(nullable=False)  # rośnie przy każdym zapisie, patrz __mapper_args__
 
     dog_id: Mapped[int] = mapped_column(ForeignKey("dogs.id"), nullable=False)
     owner_id: Mapped[int] = mapped_column(ForeignKey("owners.id"), nullable=False)
+    # Zmaterializowane wystąpienie wzorca; occurrence_date zostaje także po przesunięciu dat pobytu
+    recurring_stay_id: Mapped[int] = mapped_column(ForeignKey("recurring_stays.id"), nullable=True)
+    occurrence_date: Mapped[date] = mapped_column(nullable=True)
 
     dog = relationship("Dog", back_populates="stays")
     owner = relationship("Owner", back_populates="stays")
-    payments = relationship("Payment", back_populates="stay")
+    payments = relationship("Payment", back_populates="stay", cascade="all, delete-orphan")
+
+    # Blokada optymistyczna - UPDATE z nieaktualną wersją kończy się StaleDataError
+    __mapper_args__ = {"version_id_col": version}
+
+
+def stay_duration_days(start_date: date, end_date: date) -> int:
+    return (end_date - start_date).days + 1  # +1 to include the last day
+
 
+@event.listens_for(Stay, "before_insert")
+@event.listens_for(Stay, "before_update")
+def _set_duration_days(mapper, connection, target: Stay):
+    target.duration_days = stay_duration_days(target.start_date, target.end_date)
@@ -0,0 +1,25 @@
+from sqlalchemy import JSON, Index, String
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import datetime
+from app.database.database import Base
+from app.database.location import LocationScoped
+
+class WebhookEvent(LocationScoped, Base):
+    """Bank push notification stored on receipt, drained by the webhook consumer."""
+    __tablename__ = "webhook_events"
+    __table_args__ = (
+        Index("ix_webhook_events_location_id_status_next_attempt_at", "location_id", "status", "next_attempt_at"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    event_id: Mapped[str] = mapped_column(String, nullable=False, unique=True)  # identyfikator nadany przez bank
+    event_type: Mapped[str] = mapped_column(String, nullable=False)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)
+    status: Mapped[str] = mapped_column(String, nullable=False, default="pending")  # pending, processing, done, failed
+    attempts: Mapped[int] = mapped_column(default=0)
+    next_attempt_at: Mapped[datetime]
+    claim_token: Mapped[str | None] = mapped_column(String(32), nullable=True, index=True)
+    claimed_at: Mapped[datetime | None] = mapped_column(nullable=True)
+    last_error: Mapped[str | None] = mapped_column(nullable=True)
+    received_at: Mapped[datetime]
+    processed_at: Mapped[datetime | None] = mapped_column(nullable=True)
@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from app.database.database import get_read_db
+from app.schemas.availability import DayAvailability
+from app.services.occupancy import availability
+from app.services.recurring_stays import planned_occupancy
+from datetime import date
+import logging
+
+router = APIRouter(prefix="/availability", tags=["Availability"])
+log = logging.getLogger(__name__)
+
+MAX_AVAILABILITY_DAYS = 366
+
+@router.get("", response_model=list[DayAvailability])
+def get_availability(start_date: date, end_date: date, db: Session = Depends(get_read_db)):
+    log.info(f"Checking availability from {start_date} to {end_date}")
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="End date cannot be earlier than start date.")
+    if (end_date - start_date).days >= MAX_AVAILABILITY_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range cannot exceed {MAX_AVAILABILITY_DAYS} days")
+    return availability(db, start_date, end_date, planned=planned_occupancy(db, start_date, end_date))
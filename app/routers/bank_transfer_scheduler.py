@@ -1,11 +1,35 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from app.database.database import get_db
-from app.services.update_payments_from_transfers import update_payments_from_transfers
+from sqlalchemy import select
+from app.database.database import get_db, get_location
+from app.models.job import Job as JobModel
+from app.schemas.job import JobRead, JobEnqueued
+from app.services.jobs import enqueue_job
+import logging
 
 router = APIRouter(prefix="/scheduler", tags=["Scheduler"])
+log = logging.getLogger(__name__)
 
-@router.post("/run-bank-transfer-scheduler")
-def run_scheduler_endpoint(db: Session = Depends(get_db)):
-    update_payments_from_transfers(db)
-    return {"detail": "Bank transfer scheduler ran successfully"}
\ No newline at end of file
+@router.post("/run-bank-transfer-scheduler", response_model=JobEnqueued, status_code=202)
+def run_scheduler_endpoint(location_id: int = Depends(get_location)):
+    job, coalesced = enqueue_job("bank_transfer_matching", location_id)
+    detail = "Bank transfer scheduler already running" if coalesced else "Bank transfer scheduler queued"
+    return {"detail": detail, "coalesced": coalesced, "job": job}
+
+@router.post("/run-bank-transfer-catchup", response_model=JobEnqueued, status_code=202)
+def run_catchup_endpoint(location_id: int = Depends(get_location)):
+    job, coalesced = enqueue_job("bank_transfer_catchup", location_id)
+    detail = "Bank transfer catch-up already running" if coalesced else "Bank transfer catch-up queued"
+    return {"detail": detail, "coalesced": coalesced, "job": job}
+
+@router.get("/jobs", response_model=list[JobRead])
+def list_jobs(limit: int = 20, db: Session = Depends(get_db)):
+    return db.execute(select(JobModel).order_by(JobModel.id.desc()).limit(limit)).scalars().all()
+
+@router.get("/jobs/{job_id}", response_model=JobRead)
+def get_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.get(JobModel, job_id)
+    if not job:
+        log.warning(f"Job {job_id} not found")
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -1,9 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from app.models.bank_transfer import BankTransfer as BankTransferModel
-from app.schemas.bank_transfer import BankTransferRead, BankTransferCreate, BankTransferUpdate
-from app.database.database import get_db
+from app.models.archive import ArchivedBankTransfer
+from app.schemas.bank_transfer import BankTransferRead, BankTransferCreate, BankTransferUpdate, BankTransferBulkResult
+from app.services.ingest_bank_transfers import ingest_transfers
+from app.services.payment_ledger import record_transfer, reverse_transfer
+from app.services.update_payments_from_transfers import match_selected_transfers
+from app.models.payment import Payment as PaymentModel
+from app.database.database import get_db, get_read_db
+from app.database import repository
 from typing import Optional
 import logging
 
@@ -14,30 +21,35 @@ log = logging.getLogger(__name__)
 def list_transfers(
     sender_name: Optional[str] = None,
     matched: Optional[bool] = None,
-    db: Session = Depends(get_db)
+    include_archived: bool = False,
+    db: Session = Depends(get_read_db)
 ):
-    log.info(f"Searching transfers with filters: sender_name={sender_name}, matched={matched}")
-    stmt = select(BankTransferModel)
+    log.info(f"Searching transfers with filters: sender_name={sender_name}, matched={matched}, include_archived={include_archived}")
+    # Te same filtry dla tabeli żywej i archiwum
+    def filter_transfers(model):
+        stmt = select(model)
+
+        if sender_name:
+            stmt = stmt.where(model.sender_name.ilike(f"%{sender_name.strip().lower()}%"))
 
-    if sender_name:
-        stmt = stmt.where(BankTransferModel.sender_name.ilike(f"%{sender_name.strip().lower()}%"))
+        if matched is not None:
+            if matched:
+                stmt = stmt.where(model.matched_payment_id.is_not(None))
+            else:
+                stmt = stmt.where(model.matched_payment_id.is_(None))
+            log.debug(f"Filtering by matched status: {matched}")
 
-    if matched is not None:
-        if matched:
-            stmt = stmt.where(BankTransferModel.matched_payment_id.is_not(None))
-        else:
-            stmt = stmt.where(BankTransferModel.matched_payment_id.is_(None))
-        log.debug(f"Filtering by matched status: {matched}")
+        return stmt
 
-    transfers = db.execute(stmt).scalars().all()
+    transfers = db.execute(filter_transfers(BankTransferModel)).scalars().all()
+    if include_archived:
+        transfers = list(transfers) + list(db.execute(filter_transfers(ArchivedBankTransfer)).scalars().all())
     return transfers
 
 @router.get("/{transfer_id}", response_model=BankTransferRead)
-def get_transfer(transfer_id: int, db: Session = Depends(get_db)):
+def get_transfer(transfer_id: int, db: Session = Depends(get_read_db)):
     log.info(f"Fetching bank transfer with id: {transfer_id}")
-    transfer = db.execute(
-        select(BankTransferModel).where(BankTransferModel.id == transfer_id)
-    ).scalars().first()
+    transfer = repository.get(db, BankTransferModel, transfer_id)
     
     if not transfer:
         log.warning(f"Bank transfer with id {transfer_id} not found")
@@ -46,20 +58,44 @@ def get_transfer(transfer_id: int, db: Session = Depends(get_db)):
     return transfer
 
 @router.post("/", response_model=BankTransferRead)
-def create_transfer(transfer: BankTransferCreate, db: Session = Depends(get_db)):
+def create_transfer(transfer: BankTransferCreate, response: Response, db: Session = Depends(get_db)):
     log.info(f"Creating new bank transfer from {transfer.sender_name}")
     try:
-        new_transfer = BankTransferModel(**transfer.model_dump())
-        db.add(new_transfer)
-        db.commit()
-        db.refresh(new_transfer)
-        log.info(f"Successfully created bank transfer {new_transfer.id}")
-        return new_transfer
+        created, skipped = ingest_transfers(db, [transfer.model_dump()])
     except Exception as e:
         log.error(f"Error creating bank transfer: {str(e)}", exc_info=True)
         db.rollback()
         raise HTTPException(status_code=500, detail="Failed to create bank transfer")
 
+    if skipped:
+        fingerprint = skipped[0]["fingerprint"]
+        existing_transfer = (
+            repository.first_by(db, BankTransferModel, fingerprint=fingerprint)
+            or repository.first_by(db, ArchivedBankTransfer, fingerprint=fingerprint)
+        )
+        if existing_transfer is None:
+            log.error(f"Bank transfer with fingerprint {fingerprint} was skipped as a duplicate but cannot be found")
+            raise HTTPException(status_code=409, detail="An identical bank transfer already exists")
+        log.warning(f"Duplicate bank transfer skipped, already stored as {existing_transfer.id}")
+        response.headers["X-Duplicate-Transfer"] = "true"
+        return existing_transfer
+
+    log.info(f"Successfully created bank transfer {created[0].id}")
+    return created[0]
+
+@router.post("/bulk", response_model=BankTransferBulkResult)
+def create_transfers_bulk(transfers: list[BankTransferCreate], db: Session = Depends(get_db)):
+    log.info(f"Bulk importing {len(transfers)} bank transfers")
+    try:
+        created, skipped = ingest_transfers(db, [t.model_dump() for t in transfers])
+    except Exception as e:
+        log.error(f"Error importing bank transfers: {str(e)}", exc_info=True)
+        db.rollback()
+        raise HTTPException(status_code=500, detail="Failed to import bank transfers")
+
+    log.info(f"Imported {len(created)} bank transfers, skipped {len(skipped)} duplicates")
+    return {"created": created, "skipped_duplicates": skipped}
+
 @router.put("/{transfer_id}", response_model=BankTransferRead)
 def update_transfer(
     transfer_id: int, 
@@ -68,22 +104,47 @@ def update_transfer(
 ):
     log.info(f"Updating bank transfer {transfer_id}")
     
-    existing_transfer = db.execute(
-        select(BankTransferModel).where(BankTransferModel.id == transfer_id)
-    ).scalars().first()
+    existing_transfer = repository.get(db, BankTransferModel, transfer_id)
 
     if not existing_transfer:
         log.warning(f"Bank transfer {transfer_id} not found for update")
         raise HTTPException(status_code=404, detail="Bank transfer not found")
 
     try:
-        for key, value in update_data.model_dump(exclude_unset=True).items():
+        changes = update_data.model_dump(exclude_unset=True)
+        if changes.get("matched_payment_id") is not None:
+            if not repository.get(db, PaymentModel, changes["matched_payment_id"]):
+                raise HTTPException(status_code=400, detail="Matched payment does not exist")
+        # Poprawiony tytuł wskazuje pobyt od nowa - zdejmujemy dopasowanie, chyba że podano je jawnie
+        retitled = "title" in changes and changes["title"] != existing_transfer.title
+        if retitled and "matched_payment_id" not in changes:
+            changes["matched_payment_id"] = None
+        # Zmiana kwoty albo dopasowania przepisuje wpis w księdze płatności
+        rebook = "amount" in changes or "matched_payment_id" in changes
+        if rebook:
+            reverse_transfer(db, existing_transfer)
+            db.flush()  # stary wpis usunięty przed wstawieniem nowego - unikalny bank_transfer_id
+        for key, value in changes.items():
             setattr(existing_transfer, key, value)
+        existing_transfer.refresh_fingerprint()
+        if rebook and existing_transfer.matched_payment_id is not None:
+            payment = repository.get(db, PaymentModel, existing_transfer.matched_payment_id)
+            record_transfer(db, existing_transfer, payment)
+        elif retitled:
+            db.flush()
+            match_selected_transfers(db, [existing_transfer.id])
 
         db.commit()
         db.refresh(existing_transfer)
         log.info(f"Successfully updated bank transfer {transfer_id}")
         return existing_transfer
+    except HTTPException:
+        db.rollback()
+        raise
+    except IntegrityError:
+        log.warning(f"Update of bank transfer {transfer_id} would duplicate an existing transfer")
+        db.rollback()
+        raise HTTPException(status_code=400, detail="An identical bank transfer already exists")
     except Exception as e:
         log.error(f"Error updating bank transfer {transfer_id}: {str(e)}", exc_info=True)
         db.rollback()
@@ -93,15 +154,14 @@ def update_transfer(
 def delete_transfer(transfer_id: int, db: Session = Depends(get_db)):
     log.info(f"Attempting to delete bank transfer {transfer_id}")
     
-    existing_transfer = db.execute(
-        select(BankTransferModel).where(BankTransferModel.id == transfer_id)
-    ).scalars().first()
+    existing_transfer = repository.get(db, BankTransferModel, transfer_id)
 
     if not existing_transfer:
         log.warning(f"Bank transfer {transfer_id} not found for deletion")
         raise HTTPException(status_code=404, detail="Bank transfer not found")
     
     try:
+        reverse_transfer(db, existing_transfer)
         db.delete(existing_transfer)
         db.commit()
         log.info(f"Successfully deleted bank transfer {transfer_id}")
@@ -0,0 +1,58 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from app.models.dog import Dog as DogModel
+from app.models.owner import Owner as OwnerModel
+from app.models.stay import Stay as StayModel
+from app.models.payment import Payment as PaymentModel
+from app.models.bank_transfer import BankTransfer as BankTransferModel
+from app.schemas.batch import BatchRequest, BatchResult
+from app.schemas.dog import DogRead
+from app.schemas.owner import OwnerRead
+from app.schemas.stay import StayRead
+from app.schemas.payment import PaymentRead
+from app.schemas.bank_transfer import BankTransferRead
+from app.database.database import get_read_db
+from app.database import repository
+from collections import defaultdict
+import logging
+
+router = APIRouter(prefix="/batch", tags=["Batch"])
+log = logging.getLogger(__name__)
+
+MAX_BATCH_ITEMS = 500
+
+# zasób -> (model, schemat odczytu, nazwa w komunikacie błędu)
+BATCH_RESOURCES = {
+    "dogs": (DogModel, DogRead, "Dog"),
+    "owners": (OwnerModel, OwnerRead, "Owner"),
+    "stays": (StayModel, StayRead, "Stay"),
+    "payments": (PaymentModel, PaymentRead, "Payment"),
+    "bank_transfers": (BankTransferModel, BankTransferRead, "Bank transfer"),
+}
+
+@router.post("", response_model=list[BatchResult])
+def batch_read(batch: BatchRequest, db: Session = Depends(get_read_db)):
+    log.info(f"Batch read of {len(batch.items)} items")
+    if len(batch.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch cannot contain more than {MAX_BATCH_ITEMS} items")
+
+    ids_by_resource: dict[str, set[int]] = defaultdict(set)
+    for item in batch.items:
+        ids_by_resource[item.resource].add(item.id)
+
+    # Jedno zapytanie IN (...) na model
+    found: dict[str, dict[int, dict]] = {}
+    for resource, ids in ids_by_resource.items():
+        model, read_schema, _ = BATCH_RESOURCES[resource]
+        rows = repository.get_many(db, model, ids)
+        found[resource] = {id: read_schema.model_validate(row).model_dump(mode="json") for id, row in rows.items()}
+
+    results = []
+    for item in batch.items:
+        data = found[item.resource].get(item.id)
+        if data is None:
+            label = BATCH_RESOURCES[item.resource][2]
+            results.append(BatchResult(resource=item.resource, id=item.id, status=404, error=f"{label} not found"))
+        else:
+            results.append(BatchResult(resource=item.resource, id=item.id, status=200, data=data))
+    return results
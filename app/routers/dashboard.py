@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from app.database.database import get_db
+from app.schemas.dashboard import DashboardSummary
+from app.services.dashboard import dashboard_summary
+import logging
+
+router = APIRouter(prefix="/dashboard", tags=["Dashboard"])
+log = logging.getLogger(__name__)
+
+@router.get("/summary", response_model=DashboardSummary)
+def get_dashboard_summary(db: Session = Depends(get_db)):
+    return dashboard_summary(db)
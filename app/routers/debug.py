@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import FileResponse
+from typing import Optional
+from app.utils.profiling import PROFILE_DIR, PROFILING_TOKEN, list_profiles
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+def require_profiling_token(x_profile: Optional[str] = Header(default=None)):
+    # Bez skonfigurowanego PROFILING_TOKEN profile nie są dostępne dla nikogo
+    if not PROFILING_TOKEN or x_profile != PROFILING_TOKEN:
+        log.warning("Rejected access to profiles without a valid X-Profile token")
+        raise HTTPException(status_code=403, detail="Missing or invalid X-Profile token")
+
+router = APIRouter(prefix="/debug", tags=["Debug"], dependencies=[Depends(require_profiling_token)])
+
+@router.get("/profiles")
+def get_profiles():
+    return list_profiles()
+
+@router.get("/profiles/{file_name}")
+def download_profile(file_name: str):
+    if file_name not in {p["file"] for p in list_profiles()}:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(os.path.join(PROFILE_DIR, file_name))
@@ -1,35 +1,57 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from app.models.dog import Dog as DogModel
 from app.models.owner import Owner as OwnerModel
 from app.schemas.dog import DogRead, DogCreate, DogUpdate
-from app.database.database import get_db
+from app.schemas.owner import OwnerRead
+from app.schemas.stay import StayRead
+from app.utils.fieldsets import SparseFieldset
+from app.utils.integrity import DOG_NAME_PER_OWNER, FOREIGN_KEY, violates
+from app.database.database import get_db, get_read_db
+from app.database import repository
+from app.database.group_commit import run_write
 from typing import Optional
 import logging
 
 router = APIRouter(prefix="/dogs", tags=["Dogs"])
 log = logging.getLogger(__name__)
 
-@router.get("/", response_model=list[DogRead])
+dog_fieldset = SparseFieldset(DogModel, DogRead, {"owner": OwnerRead, "stays": list[StayRead]})
+
+def dog_conflict(e: IntegrityError, name, owner_id) -> HTTPException:
+    if violates(e, FOREIGN_KEY):
+        log.error(f"Owner with id {owner_id} not found")
+        return HTTPException(status_code=400, detail="Owner does not exist")
+    if violates(e, DOG_NAME_PER_OWNER):
+        log.warning(f"Dog with name {name} already exists for owner {owner_id}")
+        return HTTPException(status_code=400, detail="Dog with this name already exists for this owner")
+    log.error(f"Unexpected integrity error for dog: {str(e)}", exc_info=True)
+    return HTTPException(status_code=400, detail="Dog data violates a database constraint")
+
+@router.get("/", response_model=dog_fieldset.list_response)
 def search_dogs(
     owner_id: Optional[int] = None,
     name: Optional[str] = None,
     medicated: Optional[bool] = None,
     special_food: Optional[bool] = None,  # "standard" lub "non-standard"
     notes: Optional[bool] = None,
-    db: Session = Depends(get_db),
+    fields: Optional[str] = None,
+    include: Optional[str] = None,  # "owner", "stays"
+    db: Session = Depends(get_read_db),
 ):
     log.info(
         f"Searching dogs with filters: owner_id={owner_id}, name={name}, "
-        f"medicated={medicated}, special_food={special_food}, notes={notes}"
+        f"medicated={medicated}, special_food={special_food}, notes={notes}, "
+        f"fields={fields}, include={include}"
     )
+    field_names, include_names = dog_fieldset.parse(fields, include)
     
     query = select(DogModel)
 
     if owner_id is not None:
-        owner = db.execute(select(OwnerModel).where(OwnerModel.id == owner_id)).scalars().first()
-        if not owner:
+        if not repository.exists(db, OwnerModel, id=owner_id):
             log.warning(f"Owner with id {owner_id} not found during dog search")
             raise HTTPException(status_code=404, detail="Owner not found")
         query = query.where(DogModel.owner_id == owner_id)
@@ -54,51 +76,55 @@ def search_dogs(
     elif notes is False:
         query = query.where((DogModel.notes.is_(None)) | (DogModel.notes == ""))
         
+    query = dog_fieldset.apply(query, field_names, include_names)
     dogs = db.execute(query).scalars().all()
+    if field_names or include_names:
+        return dog_fieldset.render(dogs, field_names, include_names)
     return dogs
 
-@router.get("/{dog_id}", response_model=DogRead)
-def get_dog(dog_id, db: Session=Depends(get_db)):
+@router.get("/{dog_id}", response_model=dog_fieldset.item_response)
+def get_dog(
+    dog_id: int,
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
+    db: Session=Depends(get_read_db),
+):
     log.info(f"Fetching dog with id: {dog_id}")
+    field_names, include_names = dog_fieldset.parse(fields, include)
     
-    existing_dog = db.execute(
-        select(DogModel).where(DogModel.id == dog_id)
-    ).scalars().first()
+    if field_names or include_names:
+        existing_dog = db.execute(
+            dog_fieldset.apply(select(DogModel).where(DogModel.id == dog_id), field_names, include_names)
+        ).scalars().first()
+    else:
+        existing_dog = repository.get(db, DogModel, dog_id)
 
     if not existing_dog:
         log.warning(f"Dog with id {dog_id} not found")
         raise HTTPException(status_code=404, detail="Dog not found")
     
     log.debug(f"Successfully retrieved dog {dog_id}")
+    if field_names or include_names:
+        return dog_fieldset.render(existing_dog, field_names, include_names)
     return existing_dog
 
 @router.post("/", response_model=DogRead)
 def create_dog(dog_data: DogCreate, db: Session=Depends(get_db)):
     log.info(f"Creating new dog with name: {dog_data.name} for owner_id: {dog_data.owner_id}")
     
-    owner = db.execute(
-        select(OwnerModel).where(OwnerModel.id == dog_data.owner_id)
-    ).scalars().first()
-    
-    if not owner:
-        log.error(f"Owner with id {dog_data.owner_id} not found")
-        raise HTTPException(status_code=400, detail="Owner does not exist")
-    
-    dog_name = db.execute(
-        select(DogModel).where(DogModel.name == dog_data.name, DogModel.owner_id == dog_data.owner_id)
-    ).scalars().first()
-    
-    if dog_name:
-        log.warning(f"Dog with name {dog_data.name} already exists for owner {dog_data.owner_id}")
-        raise HTTPException(status_code=400, detail="Dog with this name already exists for this owner")
-    
-    try:
+    def create(db: Session) -> DogModel:
         new_dog = DogModel(**dog_data.model_dump())
         db.add(new_dog)
-        db.commit()
-        db.refresh(new_dog)
+        db.flush()
+        return new_dog
+
+    try:
+        new_dog = run_write(db, create)
         log.info(f"Successfully created dog {new_dog.id}")
         return new_dog
+    except IntegrityError as e:
+        db.rollback()
+        raise dog_conflict(e, dog_data.name, dog_data.owner_id)
     except Exception as e:
         log.error(f"Error creating dog: {str(e)}", exc_info=True)
         db.rollback()
@@ -108,9 +134,7 @@ def create_dog(dog_data: DogCreate, db: Session=Depends(get_db)):
 def update_dog(dog_id: int, update_data: DogUpdate, db: Session = Depends(get_db)):
     log.info(f"Updating dog {dog_id}")
     
-    existing_dog = db.execute(
-        select(DogModel).where(DogModel.id == dog_id)
-    ).scalars().first()
+    existing_dog = repository.get(db, DogModel, dog_id)
 
     if not existing_dog:
         log.warning(f"Dog {dog_id} not found for update")
@@ -124,18 +148,19 @@ def update_dog(dog_id: int, update_data: DogUpdate, db: Session = Depends(get_db
         db.refresh(existing_dog)
         log.info(f"Successfully updated dog {dog_id}")
         return existing_dog
+    except IntegrityError as e:
+        db.rollback()
+        raise dog_conflict(e, update_data.name, update_data.owner_id)
     except Exception as e:
         log.error(f"Error updating dog {dog_id}: {str(e)}", exc_info=True)
         db.rollback()
         raise HTTPException(status_code=500, detail="Failed to update dog")
 
 @router.delete("/{dog_id}", response_model=DogRead)
-def delete_dog(dog_id, db: Session=Depends(get_db)):
+def delete_dog(dog_id: int, db: Session=Depends(get_db)):
     log.info(f"Attempting to delete dog {dog_id}")
     
-    existing_dog = db.execute(
-        select(DogModel).where(DogModel.id == dog_id)
-    ).scalars().first()
+    existing_dog = repository.get(db, DogModel, dog_id)
 
     if not existing_dog:
         log.warning(f"Dog {dog_id} not found for deletion")
@@ -146,6 +171,10 @@ def delete_dog(dog_id, db: Session=Depends(get_db)):
         db.commit()
         log.info(f"Successfully deleted dog {dog_id}")
         return existing_dog
+    except IntegrityError:
+        log.warning(f"Dog {dog_id} still has stays, not deleted")
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Dog still has stays")
     except Exception as e:
         log.error(f"Error deleting dog {dog_id}: {str(e)}", exc_info=True)
         db.rollback()
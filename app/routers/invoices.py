@@ -0,0 +1,54 @@
+from datetime import date
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import HTMLResponse, StreamingResponse
+from sqlalchemy.orm import Session
+from app.database.database import get_read_db
+from app.services.invoices import collect_documents, render_document, stream_zip
+import logging
+
+router = APIRouter(prefix="/invoices", tags=["Invoices"])
+log = logging.getLogger(__name__)
+
+MAX_EXPORT_DAYS = 366
+
+
+@router.get("/stays/{stay_id}", response_class=HTMLResponse)
+def get_stay_invoice(stay_id: int, db: Session = Depends(get_read_db)):
+    documents = collect_documents(db, date.min, date.max, statements=False, stay_id=stay_id)
+    if not documents:
+        raise HTTPException(status_code=404, detail="Stay not found")
+    return HTMLResponse(render_document(documents[0]))
+
+
+@router.get("/owners/{owner_id}/statement", response_class=HTMLResponse)
+def get_owner_statement(owner_id: int, start_date: date, end_date: date, db: Session = Depends(get_read_db)):
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    documents = collect_documents(db, start_date, end_date, invoices=False, owner_id=owner_id)
+    if not documents:
+        raise HTTPException(status_code=404, detail="No stays of this owner ended in the period")
+    return HTMLResponse(render_document(documents[0]))
+
+
+@router.get("/export")
+def export_invoices(
+    start_date: date,
+    end_date: date,
+    invoices: bool = True,
+    statements: bool = True,
+    db: Session = Depends(get_read_db),
+):
+    log.info(f"Exporting invoices: start_date={start_date}, end_date={end_date}, invoices={invoices}, statements={statements}")
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    if (end_date - start_date).days >= MAX_EXPORT_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range is limited to {MAX_EXPORT_DAYS} days")
+
+    # Dane ładowane tutaj, póki sesja jest otwarta; renderowanie i pakowanie idzie już strumieniem
+    documents = collect_documents(db, start_date, end_date, invoices=invoices, statements=statements)
+    filename = f"invoices-{start_date.isoformat()}-{end_date.isoformat()}.zip"
+    return StreamingResponse(
+        stream_zip(documents),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -1,18 +1,38 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import exists, select
+from sqlalchemy.exc import IntegrityError
 from app.models.owner import Owner as OwnerModel
 from app.models.payment import Payment as PaymentModel
-from app.models.stay import Stay as StayModel
 from app.schemas.owner import OwnerRead, OwnerCreate, OwnerUpdate
-from app.database.database import get_db
+from app.schemas.dog import DogRead
+from app.schemas.stay import StayRead
+from app.utils.fieldsets import SparseFieldset
+from app.utils.integrity import OWNER_EMAIL, OWNER_PHONE_NUMBER, violates
+from app.database.database import get_db, get_read_db
+from app.database import repository
+from app.database.group_commit import run_write
 from typing import Optional
 import logging
 
 router = APIRouter(prefix="/owners", tags=["Owners"])
 log = logging.getLogger(__name__)
 
-@router.get("/", response_model=list[OwnerRead])
+owner_fieldset = SparseFieldset(OwnerModel, OwnerRead, {"dogs": list[DogRead], "stays": list[StayRead]})
+
+def owner_conflict(
+    e: IntegrityError, email, phone_number, phone_detail="Owner with this phone number already exists"
+) -> HTTPException:
+    if violates(e, OWNER_EMAIL):
+        log.warning(f"Owner with email {email} already exists")
+        return HTTPException(status_code=400, detail="Owner with this email already exists")
+    if violates(e, OWNER_PHONE_NUMBER):
+        log.warning(f"Owner with phone number {phone_number} already exists")
+        return HTTPException(status_code=400, detail=phone_detail)
+    log.error(f"Unexpected integrity error for owner: {str(e)}", exc_info=True)
+    return HTTPException(status_code=400, detail="Owner data violates a database constraint")
+
+@router.get("/", response_model=owner_fieldset.list_response)
 def search_owners(
     fullname: Optional[str] = None,
     email: Optional[str] = None,
@@ -20,13 +40,16 @@ def search_owners(
     unpaid: Optional[bool] = None,
     overdue: Optional[bool] = None,
     bank_account: Optional[int] = None,
-    db: Session = Depends(get_db)
+    fields: Optional[str] = None,
+    include: Optional[str] = None,  # "dogs", "stays"
+    db: Session = Depends(get_read_db)
 ):
     log.info(
         f"Searching owners with filters: fullname={fullname}, email={email}, "
         f"phone_number={phone_number}, unpaid={unpaid}, overdue={overdue}, "
-        f"bank_account={bank_account}"
+        f"bank_account={bank_account}, fields={fields}, include={include}"
     )
+    field_names, include_names = owner_fieldset.parse(fields, include)
     stmt = select(OwnerModel)
 
     if fullname:
@@ -39,32 +62,47 @@ def search_owners(
         stmt = stmt.where(OwnerModel.phone_number == phone_number)
 
     if unpaid or overdue:
-        stmt = stmt.join(StayModel, StayModel.owner_id == OwnerModel.id).join(
-            PaymentModel, PaymentModel.stay_id == StayModel.id
-        )
+        # Półzłączenie po payments.owner_id - każdy właściciel raz, bez przechodzenia przez pobyty.
+        # exists() to zapytanie Core, filtr placówki sesji do niego nie sięga - location_id podajemy jawnie
+        payment_filters = [PaymentModel.location_id == OwnerModel.location_id, PaymentModel.owner_id == OwnerModel.id]
         if unpaid:
-            stmt = stmt.where(PaymentModel.is_paid == False)
+            payment_filters.append(PaymentModel.is_paid == False)
         if overdue:
-            stmt = stmt.where(PaymentModel.is_overdue > 0)
+            payment_filters.append(PaymentModel.is_overdue > 0)
+        stmt = stmt.where(exists().where(*payment_filters))
             
     if bank_account:
         stmt = stmt.where(OwnerModel.bank_account == bank_account)
 
+    stmt = owner_fieldset.apply(stmt, field_names, include_names)
     owners = db.execute(stmt).scalars().all()
 
+    if field_names or include_names:
+        return owner_fieldset.render(owners, field_names, include_names)
     return owners
 
-@router.get("/{owner_id}", response_model=OwnerRead)
-def get_owner_by_id(owner_id, db: Session=Depends(get_db)):
+@router.get("/{owner_id}", response_model=owner_fieldset.item_response)
+def get_owner_by_id(
+    owner_id: int,
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
+    db: Session=Depends(get_read_db),
+):
     log.info(f"Fetching owner with id: {owner_id}")
-    existing_owner = db.execute(
-        select(OwnerModel).where(OwnerModel.id == owner_id)
-    ).scalars().first()
+    field_names, include_names = owner_fieldset.parse(fields, include)
+    if field_names or include_names:
+        existing_owner = db.execute(
+            owner_fieldset.apply(select(OwnerModel).where(OwnerModel.id == owner_id), field_names, include_names)
+        ).scalars().first()
+    else:
+        existing_owner = repository.get(db, OwnerModel, owner_id)
 
     if not existing_owner:
         log.warning(f"Owner with id {owner_id} not found")
         raise HTTPException(status_code=404, detail="Owner not found")
     
+    if field_names or include_names:
+        return owner_fieldset.render(existing_owner, field_names, include_names)
     return existing_owner
 
 
@@ -72,34 +110,12 @@ def get_owner_by_id(owner_id, db: Session=Depends(get_db)):
 def update_owner(owner_id: int, update_data: OwnerUpdate, db: Session = Depends(get_db)):
     log.info(f"Updating owner {owner_id}")
     
-    existing_owner = db.execute(
-        select(OwnerModel).where(OwnerModel.id == owner_id)
-    ).scalars().first()
+    existing_owner = repository.get(db, OwnerModel, owner_id)
 
     if not existing_owner:
         log.warning(f"Owner {owner_id} not found for update")
         raise HTTPException(status_code=400, detail="Owner doesn't exist")
 
-    if update_data.email:
-        log.debug(f"Checking if email {update_data.email} is available")
-        existing_email = db.execute(
-            select(OwnerModel).where(OwnerModel.email == update_data.email).where(OwnerModel.id != owner_id)
-        ).scalars().first()
-
-        if existing_email:
-            log.warning(f"Email {update_data.email} already in use by another owner")
-            raise HTTPException(status_code=400, detail="Owner with this email already exists")
-
-    if update_data.phone_number:
-        log.debug(f"Checking if phone number {update_data.phone_number} is available")
-        existing_phone_number = db.execute(
-            select(OwnerModel).where(OwnerModel.phone_number == update_data.phone_number).where(OwnerModel.id != owner_id)
-        ).scalars().first()
-
-        if existing_phone_number:
-            log.warning(f"Phone number {update_data.phone_number} already in use by another owner")
-            raise HTTPException(status_code=400, detail="Owner with this phone number already exists")
-
     try:
         for key, value in update_data.model_dump(exclude_unset=True).items():
             setattr(existing_owner, key, value)
@@ -108,6 +124,9 @@ def update_owner(owner_id: int, update_data: OwnerUpdate, db: Session = Depends(
         db.refresh(existing_owner)
         log.info(f"Successfully updated owner {owner_id}")
         return existing_owner
+    except IntegrityError as e:
+        db.rollback()
+        raise owner_conflict(e, update_data.email, update_data.phone_number)
     except Exception as e:
         log.error(f"Error updating owner {owner_id}: {str(e)}", exc_info=True)
         db.rollback()
@@ -117,41 +136,31 @@ def update_owner(owner_id: int, update_data: OwnerUpdate, db: Session = Depends(
 def create_owner(owner_data: OwnerCreate, db: Session=Depends(get_db)):
     log.info(f"Creating new owner with email: {owner_data.email}")
     
-    existing_email = db.execute(
-        select(OwnerModel).where(OwnerModel.email == owner_data.email)
-    ).scalars().first()
-
-    if existing_email:
-        log.warning(f"Owner with email {owner_data.email} already exists")
-        raise HTTPException(status_code=400, detail="Owner with this email already exists")
-    
-    existing_phone_number = db.execute(
-        select(OwnerModel).where(OwnerModel.phone_number == owner_data.phone_number)
-    ).scalars().first()
-
-    if existing_phone_number:
-        log.warning(f"Owner with phone number {owner_data.phone_number} already exists")
-        raise HTTPException(status_code=400, detail="Owner with this phone_number already exists")
-    
-    try:
+    def create(db: Session) -> OwnerModel:
         new_owner = OwnerModel(**owner_data.model_dump())
         db.add(new_owner)
-        db.commit()
-        db.refresh(new_owner)
+        db.flush()
+        return new_owner
+
+    try:
+        new_owner = run_write(db, create)
         log.info(f"Successfully created owner {new_owner.id}")
         return new_owner
+    except IntegrityError as e:
+        db.rollback()
+        raise owner_conflict(
+            e, owner_data.email, owner_data.phone_number, "Owner with this phone_number already exists"
+        )
     except Exception as e:
         log.error(f"Error creating owner: {str(e)}", exc_info=True)
         db.rollback()
         raise HTTPException(status_code=500, detail="Failed to create owner")
 
 @router.delete("/{owner_id}", response_model=OwnerRead)
-def delete_owner(owner_id, db: Session=Depends(get_db)):
+def delete_owner(owner_id: int, db: Session=Depends(get_db)):
     log.info(f"Attempting to delete owner {owner_id}")
     
-    existing_owner = db.execute(
-        select(OwnerModel).where(OwnerModel.id == owner_id)
-    ).scalars().first()
+    existing_owner = repository.get(db, OwnerModel, owner_id)
 
     if not existing_owner:
         log.warning(f"Owner {owner_id} not found for deletion")
@@ -162,6 +171,10 @@ def delete_owner(owner_id, db: Session=Depends(get_db)):
         db.commit()
         log.info(f"Successfully deleted owner {owner_id}")
         return existing_owner
+    except IntegrityError:
+        log.warning(f"Owner {owner_id} still has dogs or stays, not deleted")
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Owner still has dogs or stays")
     except Exception as e:
         log.error(f"Error deleting owner {owner_id}: {str(e)}", exc_info=True)
         db.rollback()
@@ -1,136 +1,209 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Header, Response
+from sqlalchemy.orm import Session, load_only
 from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from app.models.payment import Payment as PaymentModel
-from app.models.stay import Stay as StayModel
+from app.models.archive import ArchivedPayment
 from app.schemas.payment import PaymentCreate, PaymentRead
-from app.database.database import get_db
+from app.schemas.stay import StayRead
+from app.utils.fieldsets import SparseFieldset
+from app.utils.integrity import PAYMENT_PER_STAY, violates
+from app.utils.concurrency import check_version, etag
+from app.database.database import get_db, get_read_db
+from app.database import repository
+from app.database.group_commit import run_write
 from typing import Optional
 import logging
 
 router = APIRouter(prefix="/payments", tags=["Payments"])
 log = logging.getLogger(__name__)
 
-@router.get("/", response_model=list[PaymentRead])
+payment_fieldset = SparseFieldset(PaymentModel, PaymentRead, {"stay": StayRead})
+
+@router.get("/", response_model=payment_fieldset.list_response)
 def search_payments(
-    stay_id: Optional[bool] = None,
+    stay_id: Optional[int] = None,
     is_paid: Optional[bool] = None,
     is_overdue: Optional[bool] = None,
     is_overdue_30_days: Optional[bool] = None,
     owner_id: Optional[int] = None,
-    db: Session = Depends(get_db),
+    fields: Optional[str] = None,
+    include: Optional[str] = None,  # "stay"
+    include_archived: bool = False,
+    db: Session = Depends(get_read_db),
 ):
-    log.info(f"Searching payments with filters: stay_id={stay_id}, is_paid={is_paid}, is_overdue={is_overdue}, is_overdue_30_days={is_overdue_30_days}, owner_id={owner_id}")
+    log.info(f"Searching payments with filters: stay_id={stay_id}, is_paid={is_paid}, is_overdue={is_overdue}, is_overdue_30_days={is_overdue_30_days}, owner_id={owner_id}, fields={fields}, include={include}, include_archived={include_archived}")
+    field_names, include_names = payment_fieldset.parse(fields, include)
+
+    if include_archived and include_names:
+        raise HTTPException(status_code=400, detail="include is not supported for archived payments")
 
-    stmt = select(PaymentModel)
+    # Te same filtry dla tabeli żywej i archiwum
+    def filter_payments(model):
+        stmt = select(model)
 
-    if stay_id is not None:
-        stmt = stmt.where(PaymentModel.stay_id == stay_id)
+        if stay_id is not None:
+            stmt = stmt.where(model.stay_id == stay_id)
 
-    if is_paid is not None:
-        stmt = stmt.where(PaymentModel.is_paid == is_paid)
+        if is_paid is not None:
+            stmt = stmt.where(model.is_paid == is_paid)
 
-    if is_overdue is not None:
-        stmt = stmt.where(PaymentModel.is_overdue == is_overdue)
+        if is_overdue is not None:
+            stmt = stmt.where(model.is_overdue == is_overdue)
 
-    if is_overdue_30_days:
-        stmt = stmt.where(PaymentModel.overdue_days >= 30)
-        
-    if owner_id is not None:
-        stmt = stmt.where(StayModel.owner_id == owner_id)
+        if is_overdue_30_days:
+            stmt = stmt.where(model.overdue_days >= 30)
+            
+        if owner_id is not None:
+            stmt = stmt.where(model.owner_id == owner_id)
 
+        return stmt
+
+    stmt = payment_fieldset.apply(filter_payments(PaymentModel), field_names, include_names)
     payments = db.execute(stmt).scalars().all()
+
+    if include_archived:
+        archived_stmt = filter_payments(ArchivedPayment)
+        if field_names:
+            archived_stmt = archived_stmt.options(load_only(*(getattr(ArchivedPayment, name) for name in field_names)))
+        payments = list(payments) + list(db.execute(archived_stmt).scalars().all())
+
+    if field_names or include_names:
+        return payment_fieldset.render(payments, field_names, include_names)
     return payments
 
 
-@router.get("/{payment_id}", response_model=PaymentRead)
-def get_payment(payment_id: int, db: Session = Depends(get_db)):
+@router.get("/{payment_id}", response_model=payment_fieldset.item_response)
+def get_payment(
+    payment_id: int,
+    response: Response,
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
+    include_archived: bool = False,
+    db: Session = Depends(get_read_db),
+):
     log.info(f"Fetching payment with id: {payment_id}")
-    payment = db.execute(
-        select(PaymentModel).where(PaymentModel.id == payment_id)
-    ).scalars().first()
+    field_names, include_names = payment_fieldset.parse(fields, include)
+    if field_names or include_names:
+        payment = db.execute(
+            payment_fieldset.apply(select(PaymentModel).where(PaymentModel.id == payment_id), field_names, include_names)
+        ).scalars().first()
+    else:
+        payment = repository.get(db, PaymentModel, payment_id)
+
+    if not payment and include_archived and not include_names:
+        payment = db.get(ArchivedPayment, payment_id)
     
     if not payment:
         log.warning(f"Payment with id {payment_id} not found")
         raise HTTPException(status_code=404, detail="Payment not found")
     
+    if field_names or include_names:
+        rendered = payment_fieldset.render(payment, field_names, include_names)
+        rendered.headers["ETag"] = etag(payment.version)
+        return rendered
+    response.headers["ETag"] = etag(payment.version)
     return payment
 
 @router.post("/", response_model=PaymentRead)
 def create_payment(payment_create: PaymentCreate, db: Session = Depends(get_db)):
     log.info(f"Creating new payment for stay_id: {payment_create.stay_id}")
-    
-    stay = db.execute(select(StayModel).where(StayModel.id == payment_create.stay_id)).scalars().first()
-    if not stay:
-        log.error(f"Stay with id {payment_create.stay_id} not found")
-        raise HTTPException(status_code=404, detail="Stay not found")
-    
-    existing_payment = db.execute(
-        select(PaymentModel).where(PaymentModel.stay_id == payment_create.stay_id)
-    ).scalars().first()
-    
-    if existing_payment:
-        log.warning(f"Payment already exists for stay {payment_create.stay_id}")
-        raise HTTPException(status_code=400, detail="Payment already exists for this stay")
 
-    try:
+    def create(db: Session) -> PaymentModel:
         payment = PaymentModel(
-            stay_id=stay.id,
+            stay_id=payment_create.stay_id,
             is_paid=payment_create.is_paid,
             is_overdue=payment_create.is_overdue,
             overdue_days=payment_create.overdue_days
         )
-        payment.amount = payment.calculate_amount(db)
+        try:
+            # calculate_amount wczytuje pobyt - brak pobytu kończy się ValueError
+            payment.amount = payment.calculate_amount(db)
+        except ValueError:
+            log.error(f"Stay with id {payment_create.stay_id} not found")
+            raise HTTPException(status_code=404, detail="Stay not found")
         db.add(payment)
-        db.commit()
-        db.refresh(payment)
-        log.info(f"Successfully created payment {payment.id} for stay {stay.id}")
+        db.flush()
         return payment
+
+    try:
+        payment = run_write(db, create)
+        log.info(f"Successfully created payment {payment.id} for stay {payment.stay_id}")
+        return payment
+    except HTTPException:
+        db.rollback()
+        raise
+    except IntegrityError as e:
+        db.rollback()
+        if violates(e, PAYMENT_PER_STAY):
+            log.warning(f"Payment already exists for stay {payment_create.stay_id}")
+            raise HTTPException(status_code=400, detail="Payment already exists for this stay")
+        log.error(f"Error creating payment for stay {payment_create.stay_id}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400, detail="Payment violates a database constraint")
     except Exception as e:
-        log.error(f"Error creating payment for stay {stay.id}: {str(e)}", exc_info=True)
+        log.error(f"Error creating payment for stay {payment_create.stay_id}: {str(e)}", exc_info=True)
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.put("/{payment_id}", response_model=PaymentRead)
-def update_payment(payment_id: int, payment_update: PaymentCreate, db: Session = Depends(get_db)):
+def update_payment(
+    payment_id: int,
+    payment_update: PaymentCreate,
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
+    db: Session = Depends(get_db),
+):
     log.info(f"Updating payment {payment_id}")
-    
-    existing_payment = db.execute(
-        select(PaymentModel).where(PaymentModel.id == payment_id)
-    ).scalars().first()
 
-    if not existing_payment:
-        log.warning(f"Payment {payment_id} not found for update")
-        raise HTTPException(status_code=404, detail="Payment not found")
-    
-    stay = db.execute(select(StayModel).where(StayModel.id == payment_update.stay_id)).scalars().first()
-    if not stay:
-        log.error(f"Stay {payment_update.stay_id} not found for payment update")
-        raise HTTPException(status_code=404, detail="Stay not found")
+    def update(db: Session) -> PaymentModel:
+        existing_payment = repository.get(db, PaymentModel, payment_id)
+
+        if not existing_payment:
+            log.warning(f"Payment {payment_id} not found for update")
+            raise HTTPException(status_code=404, detail="Payment not found")
+
+        check_version(existing_payment, if_match, "Payment")
+
+        existing_payment.stay_id = payment_update.stay_id
+        try:
+            existing_payment.amount = existing_payment.calculate_amount(db)
+        except ValueError:
+            log.error(f"Stay {payment_update.stay_id} not found for payment update")
+            raise HTTPException(status_code=404, detail="Stay not found")
 
-    try:
-        existing_payment.stay_id = stay.id
         existing_payment.is_paid = payment_update.is_paid
         existing_payment.is_overdue = payment_update.is_overdue
         existing_payment.overdue_days = payment_update.overdue_days
-        existing_payment.amount = existing_payment.calculate_amount(db)
-        
-        db.commit()
-        db.refresh(existing_payment)
+        db.flush()
+        return existing_payment
+
+    try:
+        existing_payment = run_write(db, update)
         log.info(f"Successfully updated payment {payment_id}")
+        response.headers["ETag"] = etag(existing_payment.version)
         return existing_payment
+    except HTTPException:
+        db.rollback()
+        raise
+    except StaleDataError:
+        log.warning(f"Payment {payment_id} was modified concurrently")
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Payment was modified by another request")
+    except IntegrityError:
+        log.warning(f"Stay {payment_update.stay_id} already has another payment")
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Payment already exists for this stay")
     except Exception as e:
         log.error(f"Error updating payment {payment_id}: {str(e)}", exc_info=True)
         db.rollback()
         raise HTTPException(status_code=500, detail="Failed to update payment")
 
 @router.delete("/{payment_id}", response_model=PaymentRead)
-def delete_payment(payment_id, db: Session=Depends(get_db)):
+def delete_payment(payment_id: int, db: Session=Depends(get_db)):
     log.info(f"Attempting to delete payment {payment_id}")
     
-    existing_payment = db.execute(
-        select(PaymentModel).where(PaymentModel.id == payment_id)
-    ).scalars().first()
+    existing_payment = repository.get(db, PaymentModel, payment_id)
 
     if not existing_payment:
         log.warning(f"Payment {payment_id} not found for deletion")
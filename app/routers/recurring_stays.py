@@ -0,0 +1,228 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from app.models.recurring_stay import RecurringStay as RecurringStayModel
+from app.models.stay import Stay as StayModel
+from app.schemas.recurring_stay import OccurrenceRead, RecurringStayCreate, RecurringStayRead, RecurringStayUpdate
+from app.schemas.stay import StayRead
+from app.utils.concurrency import check_version, etag
+from app.services.occupancy import KENNEL_TYPE_CAPACITY, CapacityError
+from app.services import recurring_stays
+from app.database.database import get_db, get_read_db
+from app.database import repository
+from app.database.group_commit import run_write
+from datetime import date, timedelta
+from typing import Optional
+import logging
+
+router = APIRouter(prefix="/recurring_stays", tags=["Recurring stays"])
+log = logging.getLogger(__name__)
+
+MAX_OCCURRENCE_RANGE_DAYS = 366
+
+
+def _get_pattern(db: Session, recurring_stay_id: int) -> RecurringStayModel:
+    pattern = repository.get(db, RecurringStayModel, recurring_stay_id)
+    if not pattern:
+        log.warning(f"Recurring stay {recurring_stay_id} not found")
+        raise HTTPException(status_code=404, detail="Recurring stay not found")
+    return pattern
+
+
+@router.get("/", response_model=list[RecurringStayRead])
+def list_recurring_stays(
+    dog_id: Optional[int] = None,
+    owner_id: Optional[int] = None,
+    db: Session = Depends(get_read_db),
+):
+    log.info(f"Listing recurring stays with filters: dog_id={dog_id}, owner_id={owner_id}")
+    query = select(RecurringStayModel).order_by(RecurringStayModel.id)
+    if dog_id is not None:
+        query = query.where(RecurringStayModel.dog_id == dog_id)
+    if owner_id is not None:
+        query = query.where(RecurringStayModel.owner_id == owner_id)
+    return db.execute(query).scalars().all()
+
+
+@router.get("/{recurring_stay_id}", response_model=RecurringStayRead)
+def get_recurring_stay(recurring_stay_id: int, response: Response, db: Session = Depends(get_read_db)):
+    log.info(f"Fetching recurring stay {recurring_stay_id}")
+    pattern = _get_pattern(db, recurring_stay_id)
+    response.headers["ETag"] = etag(pattern.version)
+    return pattern
+
+
+@router.post("/", response_model=RecurringStayRead)
+def create_recurring_stay(data: RecurringStayCreate, db: Session = Depends(get_db)):
+    log.info(f"Creating recurring stay for dog_id: {data.dog_id}, owner_id: {data.owner_id}, weekdays: {data.weekdays}")
+
+    if data.ends_on is not None and data.ends_on < data.starts_on:
+        raise HTTPException(status_code=400, detail="End date cannot be earlier than start date")
+    if data.kennel_type not in KENNEL_TYPE_CAPACITY:
+        raise HTTPException(status_code=400, detail=f"Unknown kennel type: {data.kennel_type}")
+
+    fields = data.model_dump(exclude={"weekdays"})
+    pattern = RecurringStayModel(
+        **fields,
+        by_weekday=",".join(data.weekdays),
+        # Nic jeszcze nie zmaterializowano ani nie rozliczono
+        materialized_until=data.starts_on - timedelta(days=1),
+        billed_until=data.starts_on - timedelta(days=1),
+    )
+    if pattern.additional_fee_per_day is None:
+        pattern.additional_fee_per_day = 0.0
+    if data.duration_days > recurring_stays.min_gap_days(pattern.weekday_numbers, data.interval_weeks):
+        raise HTTPException(status_code=400, detail="Occurrences of the pattern would overlap each other")
+
+    def create(db: Session) -> RecurringStayModel:
+        overlap = recurring_stays.pattern_overlap(db, pattern)
+        if overlap:
+            log.warning(f"Recurring stay for dog {data.dog_id} overlaps {overlap}")
+            raise HTTPException(status_code=400, detail=f"Recurring stay overlaps {overlap} of this dog")
+
+        db.add(pattern)
+        db.flush()
+        # Wystąpienia w horyzoncie dostają wiersze od razu, w tej samej transakcji co wzorzec
+        until = date.today() + timedelta(days=recurring_stays.RECURRING_HORIZON_DAYS)
+        created = recurring_stays.materialize(db, pattern, max(until, pattern.materialized_until))
+        db.flush()
+        log.info(f"Created recurring stay {pattern.id} with {len(created)} materialized occurrences")
+        return pattern
+
+    try:
+        return run_write(db, create)
+    except HTTPException:
+        db.rollback()
+        raise
+    except CapacityError as e:
+        db.rollback()
+        log.warning(f"Recurring stay for dog {data.dog_id} rejected: {e}")
+        raise HTTPException(status_code=409, detail=str(e))
+    except IntegrityError as e:
+        db.rollback()
+        log.warning(f"Recurring stay references a missing dog {data.dog_id} or owner {data.owner_id}: {str(e)}")
+        raise HTTPException(status_code=400, detail="Dog or owner does not exist")
+    except Exception as e:
+        db.rollback()
+        log.error(f"Error creating recurring stay: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error creating recurring stay: {str(e)}")
+
+
+@router.put("/{recurring_stay_id}", response_model=RecurringStayRead)
+def update_recurring_stay(
+    recurring_stay_id: int,
+    update_data: RecurringStayUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
+    db: Session = Depends(get_db),
+):
+    log.info(f"Updating recurring stay {recurring_stay_id}")
+    pattern = _get_pattern(db, recurring_stay_id)
+    check_version(pattern, if_match, "Recurring stay")
+    changes = update_data.model_dump(exclude_unset=True)
+
+    try:
+        if "ends_on" in changes:
+            ends_on = changes.pop("ends_on")
+            if ends_on is not None:
+                if ends_on < pattern.starts_on:
+                    raise HTTPException(status_code=400, detail="End date cannot be earlier than start date")
+                removed = recurring_stays.end_pattern(db, pattern, ends_on)
+                log.info(f"Recurring stay {recurring_stay_id} ends on {ends_on}, removed {removed} later occurrences")
+            else:
+                pattern.ends_on = None
+        for key, value in changes.items():
+            setattr(pattern, key, value)
+
+        db.commit()
+        db.refresh(pattern)
+        response.headers["ETag"] = etag(pattern.version)
+        return pattern
+    except HTTPException:
+        db.rollback()
+        raise
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except StaleDataError:
+        db.rollback()
+        log.warning(f"Recurring stay {recurring_stay_id} was modified concurrently")
+        raise HTTPException(status_code=409, detail="Recurring stay was modified by another request")
+    except Exception as e:
+        db.rollback()
+        log.error(f"Error updating recurring stay {recurring_stay_id}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to update recurring stay.")
+
+
+@router.get("/{recurring_stay_id}/occurrences", response_model=list[OccurrenceRead])
+def list_occurrences(
+    recurring_stay_id: int,
+    start_date: date,
+    end_date: date,
+    db: Session = Depends(get_read_db),
+):
+    log.info(f"Listing occurrences of recurring stay {recurring_stay_id} from {start_date} to {end_date}")
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="End date cannot be earlier than start date.")
+    if (end_date - start_date).days >= MAX_OCCURRENCE_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range cannot exceed {MAX_OCCURRENCE_RANGE_DAYS} days")
+    pattern = _get_pattern(db, recurring_stay_id)
+
+    # Zmaterializowane wystąpienia z tabeli, dalsze rozwinięte z wzorca
+    stays = db.execute(
+        select(StayModel).where(
+            StayModel.recurring_stay_id == pattern.id,
+            StayModel.occurrence_date >= start_date,
+            StayModel.occurrence_date <= end_date,
+        )
+    ).scalars().all()
+    occurrences = [
+        OccurrenceRead(occurrence_date=stay.occurrence_date, start_date=stay.start_date, end_date=stay.end_date, stay_id=stay.id)
+        for stay in stays
+    ]
+    excluded = {exception.occurrence_date for exception in pattern.exceptions} | {stay.occurrence_date for stay in stays}
+    for first_day, last_day in recurring_stays.pending_occurrences(pattern, start_date, end_date, excluded):
+        if first_day >= start_date:
+            occurrences.append(OccurrenceRead(occurrence_date=first_day, start_date=first_day, end_date=last_day))
+    return sorted(occurrences, key=lambda occurrence: occurrence.occurrence_date)
+
+
+@router.post("/{recurring_stay_id}/occurrences/{occurrence_date}", response_model=StayRead)
+def materialize_occurrence(recurring_stay_id: int, occurrence_date: date, db: Session = Depends(get_db)):
+    log.info(f"Materializing occurrence {occurrence_date} of recurring stay {recurring_stay_id}")
+    pattern = _get_pattern(db, recurring_stay_id)
+    try:
+        stay = recurring_stays.materialize_occurrence(db, pattern, occurrence_date)
+        db.commit()
+        db.refresh(stay)
+        return stay
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except CapacityError as e:
+        db.rollback()
+        log.warning(f"Occurrence {occurrence_date} of recurring stay {recurring_stay_id} rejected: {e}")
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        log.error(f"Error materializing occurrence {occurrence_date} of recurring stay {recurring_stay_id}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to materialize occurrence")
+
+
+@router.delete("/{recurring_stay_id}/occurrences/{occurrence_date}", status_code=204)
+def cancel_occurrence(recurring_stay_id: int, occurrence_date: date, db: Session = Depends(get_db)):
+    log.info(f"Cancelling occurrence {occurrence_date} of recurring stay {recurring_stay_id}")
+    pattern = _get_pattern(db, recurring_stay_id)
+    try:
+        recurring_stays.cancel_occurrence(db, pattern, occurrence_date)
+        db.commit()
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        log.error(f"Error cancelling occurrence {occurrence_date} of recurring stay {recurring_stay_id}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to cancel occurrence")
+    return Response(status_code=204)
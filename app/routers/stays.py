@@ -1,12 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import extract, select, func
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import bindparam, extract, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from app.models.stay import Stay as StayModel
 from app.models.owner import Owner as OwnerModel
 from app.models.payment import Payment as PaymentModel
 from app.models.dog import Dog as DogModel  
+from app.models.archive import ArchivedStay
 from app.schemas.stay import StayRead, StayCreate, StayUpdate
-from app.database.database import get_db
+from app.schemas.dog import DogRead
+from app.schemas.owner import OwnerRead
+from app.schemas.payment import PaymentRead
+from app.utils.fieldsets import SparseFieldset
+from app.utils.concurrency import check_version, etag
+from app.services.archive import range_needs_archive
+from app.services.occupancy import KENNEL_TYPE_CAPACITY, CapacityError, reserve, release
+from app.services.recurring_stays import pending_overlap, planned_occupancy
+from app.models.recurring_stay import RecurringStay, RecurringStayException
+from app.database.database import get_db, get_read_db
+from app.database import repository
+from app.database.group_commit import run_write
 from datetime import date, timedelta
 from typing import Optional
 import logging
@@ -14,7 +28,39 @@ import logging
 router = APIRouter(prefix="/stays", tags=["Stays"])
 log = logging.getLogger(__name__)
 
-@router.get("/", response_model=list[StayRead])
+# Zapytanie budowane raz, przy kolejnych wywołaniach zmieniają się tylko parametry
+# (nie lambda_stmt - filtr placówki sesji zamroziłby w nim parametry pierwszego wywołania)
+OVERLAPPING_STAY = select(StayModel.id).where(
+    StayModel.dog_id == bindparam("dog_id"),
+    StayModel.start_date <= bindparam("end_date"),
+    StayModel.end_date >= bindparam("start_date"),
+).limit(1)
+
+stay_fieldset = SparseFieldset(StayModel, StayRead, {"dog": DogRead, "owner": OwnerRead, "payments": list[PaymentRead]})
+
+def start_date_range(
+    year: Optional[int], month: Optional[int], day: Optional[int]
+) -> tuple[Optional[tuple[date, date]], list[str]]:
+    """Turn year/month/day filters into a half-open start_date range.
+
+    Only a leading year, year+month or year+month+day maps to one range; any part
+    that doesn't (e.g. month without year) is returned to be filtered with extract().
+    """
+    if not year:
+        return None, [part for part, value in (("month", month), ("day", day)) if value]
+
+    if not month:
+        return (date(year, 1, 1), date(year + 1, 1, 1)), (["day"] if day else [])
+
+    month_start = date(year, month, 1)
+    next_month = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    if not day:
+        return (month_start, next_month), []
+
+    day_start = date(year, month, day)
+    return (day_start, day_start + timedelta(days=1)), []
+
+@router.get("/", response_model=stay_fieldset.list_response)
 def search_stays(
     min_days: Optional[int] = None,
     max_days: Optional[int] = None,
@@ -26,80 +72,124 @@ def search_stays(
     start_date_to: Optional[date] = None,
     dog_id: Optional[int] = None,
     owner_id: Optional[int] = None,
-    db: Session = Depends(get_db),
+    fields: Optional[str] = None,
+    include: Optional[str] = None,  # "dog", "owner", "payments"
+    include_archived: bool = False,
+    db: Session = Depends(get_read_db),
 ):
     log.info(
         f"Searching stays with filters: min_days={min_days}, max_days={max_days}, "
         f"status={status}, year={year}, month={month}, day={day}, "
         f"start_date_from={start_date_from}, start_date_to={start_date_to}, "
-        f"dog_id={dog_id}, owner_id={owner_id}"
+        f"dog_id={dog_id}, owner_id={owner_id}, fields={fields}, include={include}, "
+        f"include_archived={include_archived}"
     )
+    field_names, include_names = stay_fieldset.parse(fields, include)
     
-    query = select(StayModel)
     today = date.today()
+    if status and status not in ("upcoming", "ongoing", "ending_soon"):
+        raise HTTPException(status_code=400, detail="Invalid status value")
+    try:
+        start_range, leftover = start_date_range(year, month, day)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid year/month/day filter")
 
-    # Filtruj status (upcoming, ongoing, ending_soon)
-    if status:
+    # Te same filtry dla tabeli żywej i archiwum
+    def filter_stays(model):
+        query = select(model)
+
+        # Filtruj status (upcoming, ongoing, ending_soon)
         if status == "upcoming":
-            query = query.where(StayModel.start_date > today)
+            query = query.where(model.start_date > today)
         elif status == "ongoing":
+            # warunek na end_date jako pierwszy - zakres po indeksie (end_date, start_date)
             query = query.where(
-                StayModel.start_date <= today,
-                StayModel.end_date >= today
+                model.end_date >= today,
+                model.start_date <= today
             )
         elif status == "ending_soon":
             soon = today + timedelta(days=7)
             query = query.where(
-                StayModel.end_date >= today,
-                StayModel.end_date <= soon
+                model.end_date >= today,
+                model.end_date <= soon
             )
-        else:
-            raise HTTPException(status_code=400, detail="Invalid status value")
 
-    # Filtruj po długości pobytu
-    if min_days is not None:
-        query = query.where(
-            func.julianday(StayModel.end_date) - func.julianday(StayModel.start_date) + 1 >= min_days
-        )
-    if max_days is not None:
-        query = query.where(
-            func.julianday(StayModel.end_date) - func.julianday(StayModel.start_date) + 1 <= max_days
-        )
+        # Filtruj po długości pobytu
+        if min_days is not None:
+            query = query.where(model.duration_days >= min_days)
+        if max_days is not None:
+            query = query.where(model.duration_days <= max_days)
 
-    # Filtruj po dacie rozpoczęcia
-    if year:
-        query = query.where(extract('year', StayModel.start_date) == year)
-    if month:
-        query = query.where(extract('month', StayModel.start_date) == month)
-    if day:
-        query = query.where(extract('day', StayModel.start_date) == day)
-
-    if start_date_from:
-        query = query.where(StayModel.start_date >= start_date_from)
-    if start_date_to:
-        query = query.where(StayModel.start_date <= start_date_to)
-        
-    if dog_id is not None:
-        query = query.where(StayModel.dog_id == dog_id)
+        # Filtruj po dacie rozpoczęcia - rok/miesiąc/dzień jako zakres [od, do)
+        if start_range:
+            query = query.where(model.start_date >= start_range[0], model.start_date < start_range[1])
+        for part in leftover:
+            query = query.where(extract(part, model.start_date) == {"month": month, "day": day}[part])
+
+        if start_date_from:
+            query = query.where(model.start_date >= start_date_from)
+        if start_date_to:
+            query = query.where(model.start_date <= start_date_to)
+            
+        if dog_id is not None:
+            query = query.where(model.dog_id == dog_id)
 
-    if owner_id is not None:
-        query = query.where(StayModel.owner_id == owner_id)
+        if owner_id is not None:
+            query = query.where(model.owner_id == owner_id)
 
+        return query
+
+    # Archiwum tylko na żądanie albo gdy zakres dat sięga przed granicę archiwizacji
+    lower_bounds = [d for d in (start_range[0] if start_range else None, start_date_from) if d]
+    has_date_filter = bool(start_range or start_date_from or start_date_to)
+    search_archive = include_archived or range_needs_archive(max(lower_bounds, default=None), has_date_filter)
+    if search_archive and include_names:
+        raise HTTPException(status_code=400, detail="include is not supported for archived stays")
+
+    query = stay_fieldset.apply(filter_stays(StayModel), field_names, include_names)
     stays = db.execute(query).scalars().all()
 
+    if search_archive:
+        archived_query = filter_stays(ArchivedStay)
+        if field_names:
+            archived_query = archived_query.options(load_only(*(getattr(ArchivedStay, name) for name in field_names)))
+        stays = list(stays) + list(db.execute(archived_query).scalars().all())
+        log.debug(f"Search included archived stays, {len(stays)} results in total")
+
+    if field_names or include_names:
+        return stay_fieldset.render(stays, field_names, include_names)
     return stays
 
-@router.get("/{stay_id}", response_model=StayRead)
-def get_stay(stay_id, db: Session=Depends(get_db)):
+@router.get("/{stay_id}", response_model=stay_fieldset.item_response)
+def get_stay(
+    stay_id: int,
+    response: Response,
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
+    include_archived: bool = False,
+    db: Session=Depends(get_read_db),
+):
     log.info(f"Fetching stay with id: {stay_id}")
-    existing_stay = db.execute(
-        select(StayModel).where(StayModel.id == stay_id)
-    ).scalars().first()
+    field_names, include_names = stay_fieldset.parse(fields, include)
+    if field_names or include_names:
+        existing_stay = db.execute(
+            stay_fieldset.apply(select(StayModel).where(StayModel.id == stay_id), field_names, include_names)
+        ).scalars().first()
+    else:
+        existing_stay = repository.get(db, StayModel, stay_id)
+
+    if not existing_stay and include_archived and not include_names:
+        existing_stay = db.get(ArchivedStay, stay_id)
 
     if not existing_stay:
         log.warning(f"Stay with id {stay_id} not found")
         raise HTTPException(status_code=404, detail="Stay not found")
     
+    if field_names or include_names:
+        rendered = stay_fieldset.render(existing_stay, field_names, include_names)
+        rendered.headers["ETag"] = etag(existing_stay.version)
+        return rendered
+    response.headers["ETag"] = etag(existing_stay.version)
     return existing_stay
 
 @router.post("/", response_model=StayRead)
@@ -113,32 +203,47 @@ def create_stay(stay_data: StayCreate, db: Session = Depends(get_db)):
             status_code=400,
             detail="End date cannot be earlier than start date"
         )
-    
-    # Check for overlapping stays
-    overlapping_stay = db.execute(
-        select(StayModel).where(
-            StayModel.dog_id == stay_data.dog_id,
-            StayModel.start_date <= stay_data.end_date,
-            StayModel.end_date >= stay_data.start_date
-        )
-    ).scalars().first()
-    
-    if overlapping_stay:
-        log.warning(
-            f"Overlapping stay found for dog_id: {stay_data.dog_id}, "
-            f"owner_id: {stay_data.owner_id}, dates: {stay_data.start_date} - {stay_data.end_date}"
-        )
-        raise HTTPException(
-            status_code=400, 
-            detail="Overlapping stay exists for this dog and owner"
-        )
 
-    try:
+    if stay_data.kennel_type not in KENNEL_TYPE_CAPACITY:
+        raise HTTPException(status_code=400, detail=f"Unknown kennel type: {stay_data.kennel_type}")
+
+    # Sprawdzenia i zapis w jednej jednostce - przy group commit wykonywane po kolei przez wątek zapisu
+    def create(db: Session) -> StayModel:
+        # Check for overlapping stays
+        overlapping_stay = db.execute(
+            OVERLAPPING_STAY,
+            {"dog_id": stay_data.dog_id, "start_date": stay_data.start_date, "end_date": stay_data.end_date},
+        ).first()
+        
+        if overlapping_stay:
+            log.warning(
+                f"Overlapping stay found for dog_id: {stay_data.dog_id}, "
+                f"owner_id: {stay_data.owner_id}, dates: {stay_data.start_date} - {stay_data.end_date}"
+            )
+            raise HTTPException(
+                status_code=400, 
+                detail="Overlapping stay exists for this dog and owner"
+            )
+
+        # Wystąpienia wzorców poza horyzontem nie mają jeszcze wierszy w stays
+        pending = pending_overlap(db, stay_data.dog_id, stay_data.start_date, stay_data.end_date)
+        if pending:
+            log.warning(f"Stay for dog {stay_data.dog_id} overlaps occurrence {pending[1]} of recurring stay {pending[0]}")
+            raise HTTPException(
+                status_code=400,
+                detail=f"Overlapping recurring stay {pending[0]} exists for this dog"
+            )
+
         new_stay = StayModel(**stay_data.model_dump())
         db.add(new_stay)
-        db.commit()
-        db.refresh(new_stay)
-        
+        # Zajętość liczona w tej samej transakcji co pobyt
+        reserve(
+            db, new_stay.kennel_type, new_stay.start_date, new_stay.end_date,
+            planned=planned_occupancy(db, new_stay.start_date, new_stay.end_date),
+        )
+        db.flush()
+
+        # Płatność w tej samej transakcji - jeden commit na rezerwację
         payment = PaymentModel(
             stay_id=new_stay.id,
             is_paid=False,
@@ -147,47 +252,91 @@ def create_stay(stay_data: StayCreate, db: Session = Depends(get_db)):
         )
         payment.amount = payment.calculate_amount(db)
         db.add(payment)
-        db.commit()
-        db.refresh(payment)
-        
+        db.flush()
         log.info(f"Successfully created stay {new_stay.id} with payment {payment.id}")
         return new_stay
-        
+
+    try:
+        return run_write(db, create)
+    except HTTPException:
+        db.rollback()
+        raise
+    except CapacityError as e:
+        db.rollback()
+        log.warning(f"Stay for dog {stay_data.dog_id} rejected: {e}")
+        raise HTTPException(status_code=409, detail=str(e))
+    except IntegrityError as e:
+        db.rollback()
+        log.warning(f"Stay references a missing dog {stay_data.dog_id} or owner {stay_data.owner_id}: {str(e)}")
+        raise HTTPException(status_code=400, detail="Dog or owner does not exist")
     except Exception as e:
         db.rollback()
         log.error(f"Error creating stay: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error creating stay: {str(e)}")
 
 @router.put("/{stay_id}", response_model=StayRead)
-def update_stay(stay_id: int, update_data: StayUpdate, db: Session = Depends(get_db)):
+def update_stay(
+    stay_id: int,
+    update_data: StayUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
+    db: Session = Depends(get_db),
+):
     log.info(f"Updating stay {stay_id}")
-    existing_stay = db.execute(
-        select(StayModel).where(StayModel.id == stay_id)
-    ).scalars().first()
 
-    if not existing_stay:
-        log.warning(f"Update failed: Stay with ID {stay_id} not found.")
-        raise HTTPException(status_code=404, detail="Stay doesn't exist")
+    def update(db: Session) -> StayModel:
+        existing_stay = repository.get(db, StayModel, stay_id)
 
-    # Ustal nowe daty (z danych aktualizacji lub obecnych z bazy)
-    new_start = update_data.start_date or existing_stay.start_date
-    new_end = update_data.end_date or existing_stay.end_date
+        if not existing_stay:
+            log.warning(f"Update failed: Stay with ID {stay_id} not found.")
+            raise HTTPException(status_code=404, detail="Stay doesn't exist")
 
-    # Walidacja dat
-    if new_end < new_start:
-        log.warning(f"Invalid date update for stay {stay_id}: start={new_start}, end={new_end}")
-        raise HTTPException(status_code=400, detail="End date cannot be earlier than start date.")
+        check_version(existing_stay, if_match, "Stay")
+
+        # Ustal nowe daty (z danych aktualizacji lub obecnych z bazy)
+        new_start = update_data.start_date or existing_stay.start_date
+        new_end = update_data.end_date or existing_stay.end_date
+
+        # Walidacja dat
+        if new_end < new_start:
+            log.warning(f"Invalid date update for stay {stay_id}: start={new_start}, end={new_end}")
+            raise HTTPException(status_code=400, detail="End date cannot be earlier than start date.")
+
+        new_kennel_type = update_data.kennel_type or existing_stay.kennel_type
+        if new_kennel_type not in KENNEL_TYPE_CAPACITY:
+            raise HTTPException(status_code=400, detail=f"Unknown kennel type: {new_kennel_type}")
+        booking_changed = (new_start, new_end, new_kennel_type) != (
+            existing_stay.start_date, existing_stay.end_date, existing_stay.kennel_type
+        )
+
+        if booking_changed:
+            release(db, existing_stay.kennel_type, existing_stay.start_date, existing_stay.end_date)
+            reserve(db, new_kennel_type, new_start, new_end, planned=planned_occupancy(db, new_start, new_end))
 
-    try:
         for key, value in update_data.model_dump(exclude_unset=True).items():
+            if key == "kennel_type" and value is None:
+                continue
             setattr(existing_stay, key, value)
+        db.flush()
+        return existing_stay
 
-        db.commit()
-        db.refresh(existing_stay)
-
+    try:
+        existing_stay = run_write(db, update)
         log.info(f"Stay {stay_id} successfully updated.")
+        response.headers["ETag"] = etag(existing_stay.version)
         return existing_stay
 
+    except HTTPException:
+        db.rollback()
+        raise
+    except CapacityError as e:
+        db.rollback()
+        log.warning(f"Date update of stay {stay_id} rejected: {e}")
+        raise HTTPException(status_code=409, detail=str(e))
+    except StaleDataError:
+        db.rollback()
+        log.warning(f"Stay {stay_id} was modified concurrently")
+        raise HTTPException(status_code=409, detail="Stay was modified by another request")
     except Exception as e:
         db.rollback()
         log.error(f"Error updating stay {stay_id}: {str(e)}", exc_info=True)
@@ -195,25 +344,40 @@ def update_stay(stay_id: int, update_data: StayUpdate, db: Session = Depends(get
 
 
 @router.delete("/{stay_id}", response_model=StayRead)
-def delete_dog(stay_id, db: Session=Depends(get_db)):
+def delete_dog(stay_id: int, db: Session=Depends(get_db)):
     log.info(f"Attempting to delete stay {stay_id}")
-    existing_stay = db.execute(
-        select(StayModel).where(StayModel.id == stay_id)
-    ).scalars().first()
 
-    if not existing_stay:
-        log.warning(f"Stay {stay_id} not found for deletion")
-        raise HTTPException(status_code=400, detail="Stay does not exist")
-    
-    try:
+    def delete(db: Session) -> StayModel:
+        existing_stay = repository.get(db, StayModel, stay_id)
+
+        if not existing_stay:
+            log.warning(f"Stay {stay_id} not found for deletion")
+            raise HTTPException(status_code=400, detail="Stay does not exist")
+
+        if existing_stay.recurring_stay_id is not None:
+            pattern = repository.get(db, RecurringStay, existing_stay.recurring_stay_id)
+            if existing_stay.occurrence_date <= pattern.billed_until:
+                # Płatność miesiąca wisi na jednym z wystąpień - rozliczonych nie usuwamy
+                raise HTTPException(status_code=400, detail="Occurrence is in an already billed month")
+
+        release(db, existing_stay.kennel_type, existing_stay.start_date, existing_stay.end_date)
+        if existing_stay.recurring_stay_id is not None:
+            # Usunięte wystąpienie nie może wrócić przy następnej materializacji
+            db.merge(RecurringStayException(
+                recurring_stay_id=existing_stay.recurring_stay_id, occurrence_date=existing_stay.occurrence_date
+            ))
         db.delete(existing_stay)
-        db.commit()
+        db.flush()
+        return existing_stay
+
+    try:
+        existing_stay = run_write(db, delete)
         log.info(f"Successfully deleted stay {stay_id}")
         return existing_stay
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         log.error(f"Error deleting stay {stay_id}: {str(e)}", exc_info=True)
         db.rollback()
         raise HTTPException(status_code=500, detail="Failed to delete stay")
-
-
-
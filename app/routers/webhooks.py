@@ -0,0 +1,64 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+from app.database.database import get_db
+from app.schemas.webhook import BankWebhookEvent, WebhookAck
+from app.services.bank_webhook import (
+    BANK_WEBHOOK_SECRET,
+    WEBHOOK_QUEUE_LIMIT,
+    consumers,
+    enqueue_event,
+    queue_depth,
+    verify_signature,
+)
+from datetime import datetime, timezone
+from typing import Optional
+import logging
+
+router = APIRouter(prefix="/webhooks", tags=["Webhooks"])
+log = logging.getLogger(__name__)
+
+WEBHOOK_RETRY_AFTER_SECONDS = 30
+
+async def raw_body(request: Request) -> bytes:
+    return await request.body()
+
+@router.post("/bank", response_model=WebhookAck, status_code=202)
+def receive_bank_event(
+    response: Response,
+    body: bytes = Depends(raw_body),
+    x_bank_signature: Optional[str] = Header(default=None),
+    x_bank_timestamp: Optional[str] = Header(default=None),
+    db: Session = Depends(get_db),
+):
+    if not BANK_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Bank webhook is not configured")
+    if not verify_signature(body, x_bank_timestamp, x_bank_signature):
+        log.warning("Rejected bank webhook with invalid signature")
+        raise HTTPException(status_code=401, detail="Invalid signature")
+
+    try:
+        event = BankWebhookEvent.model_validate_json(body)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+
+    # Kolejka pełna - bank ponowi dostarczenie później
+    if queue_depth(db) >= WEBHOOK_QUEUE_LIMIT:
+        log.warning(f"Webhook queue full, deferring event {event.event_id}")
+        raise HTTPException(
+            status_code=503,
+            detail="Webhook queue is full",
+            headers={"Retry-After": str(WEBHOOK_RETRY_AFTER_SECONDS)},
+        )
+
+    # Data przelewu ustalana przy odbiorze, żeby odcisk był taki sam przy każdej próbie przetworzenia
+    if event.data.received_at is None:
+        event.data.received_at = datetime.now(timezone.utc)
+    is_new = enqueue_event(db, event.event_id, event.type, event.data.model_dump(mode="json"))
+    if is_new:
+        consumers[db.location_id].wake()
+        log.info(f"Queued bank webhook event {event.event_id}")
+    else:
+        log.info(f"Bank webhook event {event.event_id} already received")
+        response.status_code = 200
+    return {"detail": "accepted", "event_id": event.event_id, "duplicate": not is_new}
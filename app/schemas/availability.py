@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+from datetime import date
+
+class SlotAvailability(BaseModel):
+    capacity: int
+    occupied: int
+    free: int
+
+class DayAvailability(BaseModel):
+    day: date
+    total: SlotAvailability
+    kennel_types: dict[str, SlotAvailability]
@@ -8,6 +8,7 @@ class BankTransferCreate(BaseModel):
     title: str
     amount: float
     received_at: Optional[datetime] = None
+    bank_reference: Optional[str] = None
     
     class Config:
         extra = "forbid"  # Disallow extra fields
@@ -25,4 +26,18 @@ class BankTransferUpdate(BaseModel):
     title: Optional[str] = None
     amount: Optional[float] = None
     received_at: Optional[datetime] = None
+    bank_reference: Optional[str] = None
     matched_payment_id: Optional[int] = None
+
+class BankTransferDuplicate(BaseModel):
+    from_account: str
+    sender_name: str
+    title: str
+    amount: float
+    received_at: datetime
+    bank_reference: Optional[str] = None
+    fingerprint: str
+
+class BankTransferBulkResult(BaseModel):
+    created: list[BankTransferRead]
+    skipped_duplicates: list[BankTransferDuplicate]
@@ -0,0 +1,24 @@
+from pydantic import BaseModel
+from typing import Any, Literal, Optional
+
+BatchResource = Literal["dogs", "owners", "stays", "payments", "bank_transfers"]
+
+class BatchItem(BaseModel):
+    resource: BatchResource
+    id: int
+
+    class Config:
+        extra = "forbid"
+
+class BatchRequest(BaseModel):
+    items: list[BatchItem]
+
+    class Config:
+        extra = "forbid"
+
+class BatchResult(BaseModel):
+    resource: BatchResource
+    id: int
+    status: int
+    data: Optional[dict[str, Any]] = None
+    error: Optional[str] = None
@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+from datetime import date, datetime
+
+class DashboardSummary(BaseModel):
+    date: date
+    dogs_on_site: int
+    check_ins: int
+    check_outs: int
+    unpaid_total: float
+    overdue_payments: int
+    overdue_after_days: int
+    reconciled_at: datetime
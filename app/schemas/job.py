@@ -0,0 +1,22 @@
+from pydantic import BaseModel
+from typing import Optional
+from datetime import datetime
+
+class JobRead(BaseModel):
+    id: int
+    name: str
+    status: str
+    progress: float
+    counts: dict
+    errors: list[str]
+    created_at: datetime
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+class JobEnqueued(BaseModel):
+    detail: str
+    coalesced: bool
+    job: JobRead
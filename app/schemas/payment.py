@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from typing import Optional
+from datetime import date
 
 class PaymentCreate(BaseModel):
     stay_id: int
@@ -13,6 +14,9 @@ class PaymentCreate(BaseModel):
 class PaymentRead(PaymentCreate):
     id: int
     amount: float
+    paid_amount: float
+    due_date: Optional[date] = None
+    version: int
     
     class Config:
         from_attributes = True  # Zezwala na korzystanie z ORM
@@ -0,0 +1,63 @@
+from pydantic import BaseModel, Field, field_validator
+from typing import Optional, List
+from datetime import date, datetime
+from app.models.recurring_stay import WEEKDAYS
+
+
+class RecurringStayCreate(BaseModel):
+    starts_on: date
+    ends_on: Optional[date] = None
+    weekdays: List[str]  # np. ["MO", "WE"]
+    interval_weeks: int = Field(default=1, ge=1)
+    duration_days: int = Field(default=1, ge=1, le=7)
+    notes: Optional[str] = None
+    additional_fee_per_day: Optional[float] = None
+    kennel_type: str = "standard"
+    owner_id: int
+    dog_id: int
+
+    @field_validator("weekdays")
+    @classmethod
+    def check_weekdays(cls, value: List[str]) -> List[str]:
+        codes = {code.strip().upper() for code in value}
+        unknown = codes - set(WEEKDAYS)
+        if unknown or not codes:
+            raise ValueError(f"weekdays must be a non-empty list of {', '.join(WEEKDAYS)}")
+        return [code for code in WEEKDAYS if code in codes]
+
+    class Config:
+        extra = "forbid"
+
+
+class RecurringStayRead(BaseModel):
+    id: int
+    starts_on: date
+    ends_on: Optional[date]
+    by_weekday: str
+    interval_weeks: int
+    duration_days: int
+    notes: Optional[str]
+    additional_fee_per_day: Optional[float]
+    kennel_type: str
+    owner_id: int
+    dog_id: int
+    rrule: str
+    materialized_until: date
+    billed_until: date
+    created_at: datetime
+    version: int
+
+    class Config:
+        from_attributes = True
+
+
+class RecurringStayUpdate(BaseModel):
+    ends_on: Optional[date] = None
+    notes: Optional[str] = None
+
+
+class OccurrenceRead(BaseModel):
+    occurrence_date: date
+    start_date: date
+    end_date: date
+    stay_id: Optional[int] = None  # brak - wystąpienie nie ma jeszcze wiersza w stays
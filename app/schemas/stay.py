@@ -8,6 +8,7 @@ class StayCreate(BaseModel):
     end_date: date
     notes: Optional[str] = None
     additional_fee_per_day: Optional[float] = None
+    kennel_type: str = "standard"
     owner_id: int
     dog_id: int
     
@@ -17,6 +18,7 @@ class StayCreate(BaseModel):
 class StayRead(StayCreate):
     id: int
     created_at: datetime
+    version: int
     
     class Config:
         from_attributes = True  # Enable ORM mode to read data from ORM models
@@ -26,6 +28,7 @@ class StayUpdate(BaseModel):
     end_date: Optional[date]
     notes: Optional[str]
     additional_fee_per_day: Optional[float]
+    kennel_type: Optional[str] = None
     
 
     
\ No newline at end of file
@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+from typing import Literal
+from app.schemas.bank_transfer import BankTransferCreate
+
+class BankWebhookEvent(BaseModel):
+    event_id: str
+    type: Literal["transfer.received"]
+    data: BankTransferCreate
+
+class WebhookAck(BaseModel):
+    detail: str
+    event_id: str
+    duplicate: bool
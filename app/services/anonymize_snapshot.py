@@ -0,0 +1,73 @@
+import argparse
+import logging
+from typing import Optional
+from sqlalchemy import create_engine, insert, select
+from app.utils.anonymize import anonymize_value
+
+logger = logging.getLogger(__name__)
+
+COPY_BATCH_SIZE = 1000
+# Surowe zdarzenia banku zawierają pełne dane przelewów - nie trafiają do migawki
+SKIPPED_TABLES = {"webhook_events"}
+# Kolumny z danymi osobowymi; tabele archiwum jak ich tabele żywe
+ANONYMIZED_COLUMNS = {
+    "owners": {"fullname", "email", "phone_number", "bank_account"},
+    "dogs": {"name", "notes", "medicine"},
+    "stays": {"notes"},
+    "bank_transfers": {"sender_name", "from_account", "bank_reference", "title"},  # tytuł z numerem pobytu zostaje
+    "overdue_notifications": {"email"},
+}
+
+
+def _anonymize_row(table, row: dict) -> dict:
+    columns = ANONYMIZED_COLUMNS.get(table.name.removesuffix("_archive"), set())
+    row = {key: anonymize_value(key, value) if key in columns else value for key, value in row.items()}
+    if row.get("fingerprint") is not None:
+        # Odcisk liczony z danych konta - przeliczamy go z zanonimizowanych wartości
+        from app.models.bank_transfer import BankTransfer
+        row["fingerprint"] = BankTransfer.compute_fingerprint(
+            row["from_account"], row["amount"], row["title"], row["received_at"], row["bank_reference"]
+        )
+    return row
+
+
+def copy_anonymized(source_url: str, target_url: str) -> dict[str, int]:
+    """Copy every table from `source_url` into an empty `target_url`, replacing personal data with tokens.
+
+    Tokens come from the same salt as traffic capture (ANONYMIZE_SALT), so recorded
+    searches still find the matching rows in the snapshot.
+    """
+    from app.database.database import Base
+    # Rejestracja wszystkich tabel w metadanych; archiwum na końcu, bo kopiuje typy kolumn tabel żywych
+    from app.models import owner, dog, stay, payment, bank_transfer  # noqa: F401
+    from app.models import dashboard, job, matching_checkpoint, notification, occupancy, webhook_event  # noqa: F401
+    from app.models import archive  # noqa: F401
+
+    source, target = create_engine(source_url), create_engine(target_url)
+    Base.metadata.create_all(bind=target)
+    copied = {}
+    with source.connect() as src, target.begin() as dst:
+        for table in Base.metadata.sorted_tables:
+            if table.name in SKIPPED_TABLES:
+                continue
+            copied[table.name] = 0
+            result = src.execution_options(stream_results=True).execute(select(table))
+            for rows in result.mappings().partitions(COPY_BATCH_SIZE):
+                dst.execute(insert(table), [_anonymize_row(table, dict(row)) for row in rows])
+                copied[table.name] += len(rows)
+            logger.info(f"Copied {copied[table.name]} rows of {table.name}")
+    return copied
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Copy the database with personal data replaced by stable tokens")
+    parser.add_argument("source_url", help="e.g. sqlite:///dog_hotel.db")
+    parser.add_argument("target_url", help="empty database for the snapshot, e.g. sqlite:///snapshot.db")
+    args = parser.parse_args(argv)
+
+    copied = copy_anonymized(args.source_url, args.target_url)
+    print(f"Copied {sum(copied.values())} rows from {len(copied)} tables")
+
+
+if __name__ == "__main__":
+    main()
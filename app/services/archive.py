@@ -0,0 +1,184 @@
+import argparse
+import logging
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import DateTime, delete, exists, insert, literal, or_, select
+from sqlalchemy.orm import Session, aliased
+from app.models.stay import Stay
+from app.models.recurring_stay import RecurringStay
+from app.models.payment import Payment
+from app.models.bank_transfer import BankTransfer
+from app.models.payment_ledger import PaymentLedgerEntry
+from app.models.archive import ArchivedStay, ArchivedPayment, ArchivedBankTransfer, ArchivedPaymentLedgerEntry
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+
+# (tabela żywa, tabela archiwum) w kolejności przenoszenia - od tabel zależnych
+_TABLES = (
+    (PaymentLedgerEntry.__table__, ArchivedPaymentLedgerEntry.__table__),
+    (BankTransfer.__table__, ArchivedBankTransfer.__table__),
+    (Payment.__table__, ArchivedPayment.__table__),
+    (Stay.__table__, ArchivedStay.__table__),
+)
+
+
+def archive_cutoff(today: Optional[date] = None) -> date:
+    """Stays that ended before this date may live in the archive tables."""
+    return (today or date.today()) - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+def range_needs_archive(lower_bound: Optional[date], has_date_filter: bool) -> bool:
+    """Whether a start_date range reaches back far enough to touch archived stays."""
+    return has_date_filter and (lower_bound is None or lower_bound <= archive_cutoff())
+
+
+def _row_filters(source, stay_ids: list[int]):
+    if source is Stay.__table__ or source is ArchivedStay.__table__:
+        return source.c.id.in_(stay_ids)
+    if source is Payment.__table__ or source is ArchivedPayment.__table__:
+        return source.c.stay_id.in_(stay_ids)
+    live = source is BankTransfer.__table__ or source is PaymentLedgerEntry.__table__
+    payments = Payment.__table__ if live else ArchivedPayment.__table__
+    payment_id = source.c.payment_id if "payment_id" in source.c else source.c.matched_payment_id
+    return payment_id.in_(select(payments.c.id).where(payments.c.stay_id.in_(stay_ids)))
+
+
+def _move(db: Session, stay_ids: list[int], to_archive: bool) -> None:
+    archived_at = datetime.now(timezone.utc)
+    pairs = _TABLES if to_archive else tuple(reversed(_TABLES))
+    # Przy przywracaniu najpierw pobyty, potem płatności i przelewy; usuwamy zawsze od tabel zależnych
+    for live, archive in pairs:
+        source, target = (live, archive) if to_archive else (archive, live)
+        columns = [column.name for column in live.columns]
+        selected = [source.c[name] for name in columns]
+        if to_archive:
+            selected.append(literal(archived_at, DateTime).label("archived_at"))
+            columns = columns + ["archived_at"]
+        db.execute(
+            insert(target).from_select(columns, select(*selected).where(_row_filters(source, stay_ids)))
+        )
+    for live, archive in _TABLES:
+        source = live if to_archive else archive
+        db.execute(delete(source).where(_row_filters(source, stay_ids)))
+
+
+def archive_completed_stays(db: Session, older_than_days: Optional[int] = None, batch_size: Optional[int] = None) -> int:
+    """Move fully paid stays that ended long ago, with payments, matched transfers and ledger entries, into the archive.
+
+    Each batch is its own transaction so the live tables are never locked for long.
+    """
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    cutoff = date.today() - timedelta(days=days)
+    logger.info(f"Archiving fully paid stays that ended before {cutoff}")
+
+    # Wystąpienia wzorca są rozliczane zbiorczo płatnością na ostatnim wystąpieniu miesiąca;
+    # nieopłacony późniejszy miesiąc zatrzymuje wcześniejsze wystąpienia w tabelach żywych
+    sibling = aliased(Stay)
+    fully_paid = (
+        select(Stay.id)
+        .where(
+            Stay.end_date < cutoff,
+            or_(
+                exists().where(Payment.stay_id == Stay.id),
+                exists().where(RecurringStay.id == Stay.recurring_stay_id, RecurringStay.billed_until >= Stay.end_date),
+            ),
+            ~exists().where(Payment.stay_id == Stay.id, Payment.is_paid == False),
+            ~exists().where(
+                sibling.recurring_stay_id == Stay.recurring_stay_id,
+                sibling.occurrence_date >= Stay.occurrence_date,
+                Payment.stay_id == sibling.id,
+                Payment.is_paid == False,
+            ),
+        )
+        .order_by(Stay.id)
+        .limit(batch_size)
+    )
+
+    archived = 0
+    while True:
+        stay_ids = db.execute(fully_paid).scalars().all()
+        if not stay_ids:
+            break
+        try:
+            _move(db, stay_ids, to_archive=True)
+            db.commit()
+        except Exception:
+            logger.error(f"Failed to archive batch of {len(stay_ids)} stays", exc_info=True)
+            db.rollback()
+            raise
+        archived += len(stay_ids)
+        logger.info(f"Archived {archived} stays so far")
+
+    logger.info(f"Finished archiving. Total stays archived: {archived}")
+    return archived
+
+
+def restore_stays(
+    db: Session,
+    stay_ids: Optional[list[int]] = None,
+    ended_after: Optional[date] = None,
+    batch_size: Optional[int] = None,
+) -> int:
+    """Move archived stays (selected by id or end date) back to the live tables."""
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    stmt = select(ArchivedStay.id).order_by(ArchivedStay.id).limit(batch_size)
+    if stay_ids is not None:
+        stmt = stmt.where(ArchivedStay.id.in_(stay_ids))
+    if ended_after is not None:
+        stmt = stmt.where(ArchivedStay.end_date >= ended_after)
+
+    restored = 0
+    while True:
+        batch = db.execute(stmt).scalars().all()
+        if not batch:
+            break
+        try:
+            _move(db, batch, to_archive=False)
+            db.commit()
+        except Exception:
+            logger.error(f"Failed to restore batch of {len(batch)} stays", exc_info=True)
+            db.rollback()
+            raise
+        restored += len(batch)
+
+    logger.info(f"Restored {restored} stays from the archive")
+    return restored
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    from app.database.database import Base, Session as SessionLocal, engine
+    from app.models.dog import Dog  # relacje Stay wymagają zarejestrowanych modeli
+
+    parser = argparse.ArgumentParser(description="Archive or restore completed stays")
+    commands = parser.add_subparsers(dest="command", required=True)
+    archive_cmd = commands.add_parser("archive", help="move fully paid old stays to the archive")
+    archive_cmd.add_argument("--older-than-days", type=int, default=None)
+    archive_cmd.add_argument("--batch-size", type=int, default=None)
+    restore_cmd = commands.add_parser("restore", help="move archived stays back to the live tables")
+    restore_cmd.add_argument("stay_ids", type=int, nargs="*")
+    restore_cmd.add_argument("--ended-after", type=date.fromisoformat, default=None)
+    parser.add_argument("--location", type=int, default=None, help="location id, the default location if omitted")
+    args = parser.parse_args(argv)
+    if args.command == "restore" and not args.stay_ids and args.ended_after is None:
+        parser.error("restore needs stay ids or --ended-after")
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal(location_id=args.location)
+    try:
+        if args.command == "archive":
+            count = archive_completed_stays(db, args.older_than_days, args.batch_size)
+            print(f"Archived {count} stays")
+        else:
+            count = restore_stays(db, args.stay_ids or None, args.ended_after)
+            print(f"Restored {count} stays")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
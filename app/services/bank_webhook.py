@@ -0,0 +1,233 @@
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from app.database.database import Session as SessionLocal
+from app.database.location import LOCATION_IDS
+from app.models.bank_transfer import BankTransfer
+from app.models.webhook_event import WebhookEvent
+from app.schemas.bank_transfer import BankTransferCreate
+from app.services.ingest_bank_transfers import ingest_transfers
+from app.services.update_payments_from_transfers import (
+    MATCH_MAX_ATTEMPTS,
+    MATCH_RETRY_BACKOFF_SECONDS,
+    match_selected_transfers,
+)
+
+logger = logging.getLogger(__name__)
+
+BANK_WEBHOOK_SECRET = os.getenv("BANK_WEBHOOK_SECRET")  # bez sekretu odbiornik jest wyłączony
+BANK_WEBHOOK_TOLERANCE_SECONDS = int(os.getenv("BANK_WEBHOOK_TOLERANCE_SECONDS", "300"))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+WEBHOOK_QUEUE_LIMIT = int(os.getenv("WEBHOOK_QUEUE_LIMIT", "10000"))  # powyżej odbiornik odpowiada 503
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_RETRY_BASE_SECONDS = float(os.getenv("WEBHOOK_RETRY_BASE_SECONDS", "2"))
+WEBHOOK_RETRY_MAX_SECONDS = float(os.getenv("WEBHOOK_RETRY_MAX_SECONDS", "300"))
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", "5"))
+WEBHOOK_CLAIM_TIMEOUT_SECONDS = int(os.getenv("WEBHOOK_CLAIM_TIMEOUT_SECONDS", "300"))
+
+
+def sign(secret: str, timestamp: str, body: bytes) -> str:
+    digest = hmac.new(secret.encode(), timestamp.encode() + b"." + body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def verify_signature(body: bytes, timestamp: Optional[str], signature: Optional[str], now: Optional[float] = None) -> bool:
+    """Check `X-Bank-Signature` (HMAC-SHA256 of "<timestamp>.<body>") and reject stale timestamps."""
+    if not BANK_WEBHOOK_SECRET or not timestamp or not signature:
+        return False
+    try:
+        age = abs((now or time.time()) - int(timestamp))
+    except ValueError:
+        return False
+    if age > BANK_WEBHOOK_TOLERANCE_SECONDS:
+        return False
+    return hmac.compare_digest(sign(BANK_WEBHOOK_SECRET, timestamp, body), signature)
+
+
+def queue_depth(db: Session) -> int:
+    return db.execute(
+        select(func.count()).select_from(WebhookEvent).where(WebhookEvent.status.in_(("pending", "processing")))
+    ).scalar()
+
+
+def enqueue_event(db: Session, event_id: str, event_type: str, payload: dict) -> bool:
+    """Store an event unless it was delivered before; returns whether it is new."""
+    now = datetime.now(timezone.utc)
+    row = {
+        "location_id": db.location_id,
+        "event_id": event_id,
+        "event_type": event_type,
+        "payload": payload,
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "received_at": now,
+    }
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        dialect_insert = sqlite_insert if dialect == "sqlite" else pg_insert
+        inserted = db.execute(
+            dialect_insert(WebhookEvent).values(row)
+            .on_conflict_do_nothing(index_elements=["event_id"])
+            .returning(WebhookEvent.id)
+        ).first()
+    else:
+        inserted = None
+        if not db.execute(select(WebhookEvent.id).where(WebhookEvent.event_id == event_id)).first():
+            inserted = db.execute(insert(WebhookEvent).values(row))
+    db.commit()
+    return inserted is not None
+
+
+def _claim_batch(db: Session, now: datetime) -> list[WebhookEvent]:
+    token = uuid.uuid4().hex
+    due = (
+        select(WebhookEvent.id)
+        .where(WebhookEvent.status == "pending", WebhookEvent.next_attempt_at <= now)
+        .order_by(WebhookEvent.id)
+        .limit(WEBHOOK_BATCH_SIZE)
+    )
+    # Warunek na status chroni przed podwójnym pobraniem przez innego workera
+    db.execute(
+        update(WebhookEvent)
+        .where(WebhookEvent.id.in_(due.scalar_subquery()), WebhookEvent.status == "pending")
+        .values(status="processing", claim_token=token, claimed_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return list(db.execute(
+        select(WebhookEvent).where(WebhookEvent.claim_token == token).order_by(WebhookEvent.id)
+    ).scalars().all())
+
+
+def _store_and_match(db: Session, events: list[WebhookEvent]) -> dict:
+    rows = [BankTransferCreate.model_validate(event.payload).model_dump() for event in events]
+    created, skipped = ingest_transfers(db, rows)
+    # Także przelewy zapisane przy wcześniejszej, przerwanej próbie - dopasowujemy wszystko z paczki
+    fingerprints = [transfer.fingerprint for transfer in created] + [row["fingerprint"] for row in skipped]
+    transfer_ids = db.execute(
+        select(BankTransfer.id).where(BankTransfer.fingerprint.in_(fingerprints))
+    ).scalars().all()
+
+    for attempt in range(1, MATCH_MAX_ATTEMPTS + 1):
+        try:
+            counts = match_selected_transfers(db, transfer_ids)
+            db.commit()
+            return counts
+        except StaleDataError:
+            db.rollback()
+            if attempt == MATCH_MAX_ATTEMPTS:
+                raise
+            time.sleep(MATCH_RETRY_BACKOFF_SECONDS * attempt)
+
+
+def process_batch(db: Session) -> int:
+    """Drain one batch of due events into transfers and match them; returns the batch size."""
+    now = datetime.now(timezone.utc)
+    events = _claim_batch(db, now)
+    if not events:
+        return 0
+
+    try:
+        counts = _store_and_match(db, events)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to process batch of {len(events)} webhook events", exc_info=True)
+        for event in events:
+            event.attempts += 1
+            event.last_error = str(e)[:500]
+            event.claim_token = None
+            if event.attempts >= WEBHOOK_MAX_ATTEMPTS:
+                event.status = "failed"
+            else:
+                delay = min(WEBHOOK_RETRY_BASE_SECONDS * 2 ** (event.attempts - 1), WEBHOOK_RETRY_MAX_SECONDS)
+                event.status = "pending"
+                event.next_attempt_at = now + timedelta(seconds=delay)
+        db.commit()
+        return len(events)
+
+    processed_at = datetime.now(timezone.utc)
+    for event in events:
+        event.status = "done"
+        event.attempts += 1
+        event.processed_at = processed_at
+    db.commit()
+    logger.info(
+        f"Processed {len(events)} webhook events: {counts['updated']} payments updated, {counts['failed']} failed"
+    )
+    return len(events)
+
+
+def release_stale_claims(db: Session) -> int:
+    """Return events claimed by a worker that died mid-batch to the queue."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=WEBHOOK_CLAIM_TIMEOUT_SECONDS)
+    result = db.execute(
+        update(WebhookEvent)
+        .where(WebhookEvent.status == "processing", WebhookEvent.claimed_at < cutoff)
+        .values(status="pending", claim_token=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    if result.rowcount:
+        logger.warning(f"Released {result.rowcount} stale webhook event claims")
+    return result.rowcount
+
+
+class WebhookConsumer:
+    """Background thread draining one location's webhook queue; woken by new events, polls as a fallback."""
+
+    def __init__(self, location_id: int):
+        self.location_id = location_id
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"webhook-consumer-{self.location_id}", daemon=True)
+        self._thread.start()
+        logger.info(f"Webhook consumer of location {self.location_id} started")
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+
+    def _run(self) -> None:
+        last_recovery = 0.0
+        while not self._stop.is_set():
+            self._wake.clear()
+            db = SessionLocal(location_id=self.location_id)
+            try:
+                if time.monotonic() - last_recovery > WEBHOOK_CLAIM_TIMEOUT_SECONDS:
+                    release_stale_claims(db)
+                    last_recovery = time.monotonic()
+                # Pełne paczki oznaczają zaległości - pobieramy kolejne bez czekania
+                while not self._stop.is_set() and process_batch(db) >= WEBHOOK_BATCH_SIZE:
+                    pass
+            except Exception:
+                logger.error("Webhook consumer iteration failed", exc_info=True)
+            finally:
+                db.close()
+            self._wake.wait(WEBHOOK_POLL_SECONDS)
+
+
+# Osobny konsument dla każdej placówki - zaległości jednej nie opóźniają pozostałych
+consumers = {location_id: WebhookConsumer(location_id) for location_id in LOCATION_IDS}
@@ -0,0 +1,227 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import delete, event, func, select, update
+from sqlalchemy.orm import Session
+from app.database.database import RoutingSession
+from app.models.stay import Stay
+from app.models.payment import Payment
+from app.models.dashboard import DashboardCounter
+from app.services.overdue import DUE_DATE, OVERDUE_NOTIFY_AFTER_DAYS
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_CACHE_SECONDS = float(os.getenv("DASHBOARD_CACHE_SECONDS", "2"))  # jak długo worker ufa swojej kopii liczników
+DASHBOARD_RECONCILE_SECONDS = int(os.getenv("DASHBOARD_RECONCILE_SECONDS", "300"))
+
+COUNTERS = ("dogs_on_site", "check_ins", "check_outs", "unpaid_total", "overdue_payments")
+
+_cache: dict = {}  # location_id -> {"summary": ..., "loaded_at": ...}
+_cache_lock = threading.Lock()
+
+
+def _stay_counts(start_date: date, end_date: date, today: date) -> Counter:
+    return Counter(
+        dogs_on_site=int(start_date <= today <= end_date),
+        check_ins=int(start_date == today),
+        check_outs=int(end_date == today),
+    )
+
+
+def _payment_counts(amount: float, paid_amount: float, is_paid: bool, due_date: date, today: date) -> Counter:
+    if is_paid:
+        return Counter()
+    overdue_cutoff = today - timedelta(days=OVERDUE_NOTIFY_AFTER_DAYS)
+    # Do zapłaty zostaje kwota pomniejszona o wpłaty częściowe
+    return Counter(unpaid_total=(amount or 0.0) - (paid_amount or 0.0), overdue_payments=int(due_date < overdue_cutoff))
+
+
+def _flush_deltas(session: Session, today: date) -> Counter:
+    """Change of every counter caused by the pending inserts, updates and deletes.
+
+    Values before the change are read from the database, which still holds them
+    while the flush has not run - object history is incomplete for expired objects.
+    """
+    new_stays = [obj for obj in session.new if isinstance(obj, Stay)]
+    changed_stays = [
+        obj for obj in list(session.dirty) + list(session.deleted)
+        if isinstance(obj, Stay) and (obj in session.deleted or session.is_modified(obj))
+    ]
+    payments = {
+        id(obj): obj for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+        if isinstance(obj, Payment) and (obj not in session.dirty or session.is_modified(obj))
+    }
+
+    deltas = Counter()
+    for stay in new_stays:
+        deltas.update(_stay_counts(stay.start_date, stay.end_date, today))
+
+    if changed_stays:
+        stored = {
+            row.id: row for row in session.execute(
+                select(Stay.id, Stay.start_date, Stay.end_date)
+                .where(Stay.id.in_([stay.id for stay in changed_stays]))
+            )
+        }
+        for stay in changed_stays:
+            old = stored.get(stay.id)
+            if old is not None:
+                deltas.subtract(_stay_counts(old.start_date, old.end_date, today))
+            if stay not in session.deleted:
+                deltas.update(_stay_counts(stay.start_date, stay.end_date, today))
+                # Przesunięcie końca pobytu zmienia, czy jego płatność liczy się jako zaległa
+                if old is not None and old.end_date != stay.end_date:
+                    payments.update((id(payment), payment) for payment in stay.payments)
+
+    stored_payments = [payment.id for payment in payments.values() if payment not in session.new]
+    if stored_payments:
+        for old in session.execute(
+            select(Payment.amount, Payment.paid_amount, Payment.is_paid, DUE_DATE.label("due_date"))
+            .join(Stay, Payment.stay_id == Stay.id)
+            .where(Payment.id.in_(stored_payments))
+        ):
+            deltas.subtract(_payment_counts(old.amount, old.paid_amount, old.is_paid, old.due_date, today))
+    for payment in payments.values():
+        if payment in session.deleted:
+            continue
+        stay = payment.stay if payment.stay is not None else session.get(Stay, payment.stay_id)
+        if stay is not None:
+            deltas.update(_payment_counts(payment.amount, payment.paid_amount, payment.is_paid, payment.due_date or stay.end_date, today))
+
+    return Counter({name: value for name, value in deltas.items() if value})
+
+
+@event.listens_for(RoutingSession, "before_flush")
+def _collect_counter_deltas(session, flush_context, instances):
+    with session.no_autoflush:
+        deltas = _flush_deltas(session, date.today())
+    if deltas:
+        session.info.setdefault("dashboard_deltas", Counter()).update(deltas)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _apply_counter_deltas(session, flush_context):
+    # Zmiana liczników w tej samej transakcji co zapis, więc obie wycofują się razem
+    deltas = session.info.pop("dashboard_deltas", None)
+    if not deltas:
+        return
+    table = DashboardCounter.__table__
+    connection = session.connection()
+    for name, value in deltas.items():
+        connection.execute(
+            update(table)
+            .where(table.c.location_id == session.location_id, table.c.name == name)
+            .values(value=table.c.value + value)
+        )
+    session.info["dashboard_dirty"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _invalidate_cache(session):
+    if session.info.pop("dashboard_dirty", False):
+        with _cache_lock:
+            _cache.pop(session.location_id, None)
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _discard_deltas(session):
+    session.info.pop("dashboard_deltas", None)
+    session.info.pop("dashboard_dirty", None)
+
+
+@event.listens_for(RoutingSession, "after_soft_rollback")
+def _discard_pending_deltas(session, previous_transaction):
+    # Także wycofany SAVEPOINT (group commit) - delty nieudanego flusha nie mogą trafić do następnego
+    session.info.pop("dashboard_deltas", None)
+
+
+def _store_cache(location_id: int, summary: dict) -> dict:
+    with _cache_lock:
+        _cache[location_id] = {"summary": summary, "loaded_at": time.monotonic()}
+    return summary
+
+
+def _summary(values: dict, as_of: date, reconciled_at: datetime) -> dict:
+    return {
+        "date": as_of,
+        "dogs_on_site": int(values["dogs_on_site"]),
+        "check_ins": int(values["check_ins"]),
+        "check_outs": int(values["check_outs"]),
+        "unpaid_total": round(values["unpaid_total"], 2),
+        "overdue_payments": int(values["overdue_payments"]),
+        "overdue_after_days": OVERDUE_NOTIFY_AFTER_DAYS,
+        "reconciled_at": reconciled_at,
+    }
+
+
+def compute_counters(db: Session, today: Optional[date] = None) -> dict:
+    """Count everything from scratch - the source of truth for the counters."""
+    today = today or date.today()
+    overdue_cutoff = today - timedelta(days=OVERDUE_NOTIFY_AFTER_DAYS)
+    stays = db.execute(
+        select(
+            func.count().filter(Stay.start_date <= today, Stay.end_date >= today),
+            func.count().filter(Stay.start_date == today),
+            func.count().filter(Stay.end_date == today),
+        ).select_from(Stay)
+    ).one()
+    payments = db.execute(
+        select(
+            func.coalesce(func.sum(Payment.amount - Payment.paid_amount), 0.0),
+            func.count().filter(DUE_DATE < overdue_cutoff),
+        )
+        .join(Stay, Payment.stay_id == Stay.id)
+        .where(Payment.is_paid == False)
+    ).one()
+    return {
+        "dogs_on_site": stays[0],
+        "check_ins": stays[1],
+        "check_outs": stays[2],
+        "unpaid_total": float(payments[0]),
+        "overdue_payments": payments[1],
+    }
+
+
+def reconcile_counters(db: Session, today: Optional[date] = None) -> dict:
+    """Overwrite the shared counters with freshly computed values.
+
+    Fixes any drift from writes that bypass the ORM and rolls date based counters
+    over to a new day.
+    """
+    today = today or date.today()
+    values = compute_counters(db, today)
+    reconciled_at = datetime.now(timezone.utc)
+    try:
+        db.execute(delete(DashboardCounter))
+        db.add_all(
+            DashboardCounter(name=name, value=value, as_of=today, reconciled_at=reconciled_at)
+            for name, value in values.items()
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    logger.info(f"Dashboard counters of location {db.location_id} reconciled for {today}: {values}")
+    return _store_cache(db.location_id, _summary(values, today, reconciled_at))
+
+
+def dashboard_summary(db: Session) -> dict:
+    """Summary from this worker's copy of the counters, refreshed from the shared table when stale."""
+    today = date.today()
+    cached = _cache.get(db.location_id)
+    if (
+        cached is not None
+        and cached["summary"]["date"] == today
+        and time.monotonic() - cached["loaded_at"] < DASHBOARD_CACHE_SECONDS
+    ):
+        return cached["summary"]
+
+    rows = db.execute(select(DashboardCounter)).scalars().all()
+    values = {row.name: row.value for row in rows}
+    if set(values) != set(COUNTERS) or any(row.as_of != today for row in rows):
+        return reconcile_counters(db, today)
+    return _store_cache(db.location_id, _summary(values, today, min(row.reconciled_at for row in rows)))
@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import random
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+from app.services.bank_webhook import sign
+
+MAX_DELIVERY_ATTEMPTS = 5
+
+
+def deliver(url: str, secret: str, event: dict, location_id: Optional[int] = None) -> int:
+    """POST one signed event the way the bank does, honouring 503 + Retry-After."""
+    body = json.dumps(event).encode()
+    for attempt in range(1, MAX_DELIVERY_ATTEMPTS + 1):
+        timestamp = str(int(time.time()))
+        headers = {
+            "Content-Type": "application/json",
+            "X-Bank-Timestamp": timestamp,
+            "X-Bank-Signature": sign(secret, timestamp, body),
+        }
+        if location_id is not None:
+            headers["X-Location-Id"] = str(location_id)
+        request = urllib.request.Request(url, data=body, method="POST", headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            if e.code != 503 or attempt == MAX_DELIVERY_ATTEMPTS:
+                return e.code
+            time.sleep(float(e.headers.get("Retry-After", "1")))
+    return 503
+
+
+def transfer_event(stay_id: int, amount: float, event_id: Optional[str] = None) -> dict:
+    return {
+        "event_id": event_id or uuid.uuid4().hex,
+        "type": "transfer.received",
+        "data": {
+            "from_account": "PL61109010140000071219812874",
+            "sender_name": "Fake Bank Customer",
+            "title": str(stay_id),
+            "amount": amount,
+            "received_at": datetime.now(timezone.utc).isoformat(),
+            "bank_reference": uuid.uuid4().hex[:16],
+        },
+    }
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Local fake bank pushing signed transfer notifications")
+    parser.add_argument("stay_ids", type=int, nargs="+")
+    parser.add_argument("--url", default="http://localhost:8000/webhooks/bank")
+    parser.add_argument("--secret", default=os.getenv("BANK_WEBHOOK_SECRET"))
+    parser.add_argument("--amount", type=float, default=None, help="default: random amount per transfer")
+    parser.add_argument("--redeliver", type=float, default=0.0, help="share of events sent twice, like a real bank retry")
+    parser.add_argument("--location", type=int, default=None, help="location id sent as X-Location-Id")
+    args = parser.parse_args(argv)
+    if not args.secret:
+        parser.error("--secret or BANK_WEBHOOK_SECRET is required")
+
+    statuses: dict[int, int] = {}
+    for stay_id in args.stay_ids:
+        event = transfer_event(stay_id, args.amount if args.amount is not None else round(random.uniform(50, 500), 2))
+        deliveries = 2 if random.random() < args.redeliver else 1
+        for _ in range(deliveries):
+            status = deliver(args.url, args.secret, event, args.location)
+            statuses[status] = statuses.get(status, 0) + 1
+    print(f"Sent {len(args.stay_ids)} events: " + ", ".join(f"{count}x {status}" for status, count in sorted(statuses.items())))
+
+
+if __name__ == "__main__":
+    main()
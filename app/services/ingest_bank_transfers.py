@@ -0,0 +1,95 @@
+import logging
+from datetime import datetime, timezone
+from sqlalchemy.orm import Session
+from sqlalchemy import insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.database.database import SQLITE_MAX_VARIABLES
+from app.models.bank_transfer import BankTransfer
+from app.models.archive import ArchivedBankTransfer
+
+logger = logging.getLogger(__name__)
+
+# Wielowierszowy INSERT wiąże każdą kolumnę każdego wiersza
+INSERT_CHUNK_SIZE = SQLITE_MAX_VARIABLES // len(BankTransfer.__table__.columns)
+
+
+def _prepare_row(data: dict) -> dict:
+    row = dict(data)
+    if row.get("received_at") is None:
+        row["received_at"] = datetime.now(timezone.utc)
+    row["fingerprint"] = BankTransfer.compute_fingerprint(
+        row["from_account"], row["amount"], row["title"], row["received_at"], row.get("bank_reference")
+    )
+    return row
+
+
+def _insert_ignore(db: Session, rows: list[dict]) -> set[str]:
+    """Insert rows skipping fingerprints that already exist; returns inserted fingerprints."""
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ("sqlite", "postgresql"):
+        dialect_insert = sqlite_insert if dialect == "sqlite" else pg_insert
+        stmt = (
+            dialect_insert(BankTransfer)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=["location_id", "fingerprint"])
+            .returning(BankTransfer.fingerprint)
+        )
+        return set(db.execute(stmt).scalars().all())
+
+    # Inne bazy: odfiltruj istniejące odciski przed wstawieniem (zapytanie ORM - tylko ta placówka)
+    existing = set(db.execute(
+        select(BankTransfer.fingerprint).where(BankTransfer.fingerprint.in_([r["fingerprint"] for r in rows]))
+    ).scalars().all())
+    new_rows = [r for r in rows if r["fingerprint"] not in existing]
+    if new_rows:
+        db.execute(insert(BankTransfer), new_rows)
+    return {r["fingerprint"] for r in new_rows}
+
+
+def ingest_transfers(db: Session, transfers: list[dict]) -> tuple[list[BankTransfer], list[dict]]:
+    """Store transfers with insert-or-ignore semantics on their fingerprint.
+
+    Returns the newly created transfers and the input rows skipped as duplicates
+    (already stored, or repeated within the same batch).
+    """
+    logger.info(f"Ingesting {len(transfers)} bank transfers")
+
+    rows: list[dict] = []
+    skipped: list[dict] = []
+    seen: set[str] = set()
+    for data in transfers:
+        row = _prepare_row(data)
+        row["location_id"] = db.location_id  # wstawienie Core - bez automatycznej placówki sesji
+        if row["fingerprint"] in seen:
+            skipped.append(row)
+            continue
+        seen.add(row["fingerprint"])
+        rows.append(row)
+
+    inserted: list[str] = []
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[i:i + INSERT_CHUNK_SIZE]
+        # Przelewy przeniesione do archiwum nie są już chronione unikalnym indeksem
+        archived = set(db.execute(
+            select(ArchivedBankTransfer.fingerprint)
+            .where(ArchivedBankTransfer.fingerprint.in_([r["fingerprint"] for r in chunk]))
+        ).scalars().all())
+        skipped.extend(r for r in chunk if r["fingerprint"] in archived)
+        chunk = [r for r in chunk if r["fingerprint"] not in archived]
+        if chunk:
+            chunk_inserted = _insert_ignore(db, chunk)
+            skipped.extend(r for r in chunk if r["fingerprint"] not in chunk_inserted)
+            inserted.extend(chunk_inserted)
+    db.commit()
+
+    created: list[BankTransfer] = []
+    for i in range(0, len(inserted), INSERT_CHUNK_SIZE):
+        created.extend(db.execute(
+            select(BankTransfer).where(BankTransfer.fingerprint.in_(inserted[i:i + INSERT_CHUNK_SIZE]))
+        ).scalars().all())
+    created.sort(key=lambda transfer: transfer.id)
+
+    logger.info(f"Ingested {len(created)} bank transfers, skipped {len(skipped)} duplicates")
+    return created, skipped
@@ -0,0 +1,309 @@
+import argparse
+import hashlib
+import html
+import json
+import logging
+import os
+import string
+import threading
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Iterable, Iterator, Optional
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from app.database import repository
+from app.models.dog import Dog
+from app.models.owner import Owner
+from app.models.payment import DAILY_RATE, Payment
+from app.models.stay import Stay
+
+logger = logging.getLogger(__name__)
+
+INVOICE_WORKERS = int(os.getenv("INVOICE_WORKERS", "4"))
+# Wyrenderowane dokumenty według skrótu treści - niezmieniona faktura nie jest renderowana ponownie
+INVOICE_CACHE_DIR = os.getenv(
+    "INVOICE_CACHE_DIR", os.path.join(os.path.dirname(__file__), "..", "..", "invoice_cache")
+)
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "..", "templates", "invoices")
+TEMPLATE_NAMES = ("invoice", "statement", "statement_row")
+
+_executor = ThreadPoolExecutor(max_workers=INVOICE_WORKERS, thread_name_prefix="invoice")
+
+
+@lru_cache(maxsize=None)
+def _template(name: str) -> string.Template:
+    # Czytany z dysku i parsowany raz na proces
+    with open(os.path.join(TEMPLATE_DIR, f"{name}.html")) as f:
+        template = string.Template(f.read())
+    if not template.is_valid():
+        raise ValueError(f"Invalid invoice template: {name}")
+    return template
+
+
+@lru_cache(maxsize=None)
+def _templates_hash() -> str:
+    # Zmiana dowolnego szablonu unieważnia cały cache dokumentów
+    digest = hashlib.sha256()
+    for name in TEMPLATE_NAMES:
+        digest.update(_template(name).template.encode())
+    return digest.hexdigest()
+
+
+def _payment_status(is_paid: Optional[bool]) -> str:
+    if is_paid is None:
+        return "no payment"
+    return "paid" if is_paid else "unpaid"
+
+
+def _stay_rows(db: Session, start_date: date, end_date: date, stay_id: Optional[int] = None, owner_id: Optional[int] = None):
+    # Jedno zapytanie na wszystkie pobyty zakresu razem z psem i płatnością
+    stmt = (
+        select(
+            Stay.id.label("stay_id"),
+            Stay.start_date,
+            Stay.end_date,
+            Stay.duration_days,
+            Stay.additional_fee_per_day,
+            Stay.kennel_type,
+            Stay.owner_id,
+            Stay.recurring_stay_id,
+            Stay.occurrence_date,
+            Dog.name.label("dog_name"),
+            Payment.amount,
+            Payment.is_paid,
+        )
+        .join(Dog, Stay.dog_id == Dog.id)
+        .outerjoin(Payment, Payment.stay_id == Stay.id)
+        .order_by(Stay.id)
+    )
+    if stay_id is not None:
+        stmt = stmt.where(Stay.id == stay_id)
+    else:
+        stmt = stmt.where(Stay.end_date >= start_date, Stay.end_date <= end_date)
+    if owner_id is not None:
+        stmt = stmt.where(Stay.owner_id == owner_id)
+    return db.execute(stmt).all()
+
+
+def _outstanding(db: Session, owner_ids: Iterable[int]) -> dict[int, float]:
+    # Wszystkie nieopłacone płatności właścicieli, także z wcześniejszych okresów, bez wpłat częściowych
+    rows = db.execute(
+        select(Payment.owner_id, func.sum(Payment.amount - Payment.paid_amount))
+        .where(Payment.owner_id.in_(list(owner_ids)), Payment.is_paid == False)
+        .group_by(Payment.owner_id)
+    ).all()
+    return {owner_id: total for owner_id, total in rows}
+
+
+def _period_payments(db: Session, rows) -> dict[tuple[int, date], Optional[bool]]:
+    # Wystąpienia wzorca płaci jedna płatność miesiąca, na ostatnim wystąpieniu - może leżeć poza zakresem
+    occurrences = [row.occurrence_date for row in rows if row.recurring_stay_id is not None]
+    if not occurrences:
+        return {}
+    rows = db.execute(
+        select(Stay.recurring_stay_id, Stay.occurrence_date, Payment.is_paid)
+        .join(Payment, Payment.stay_id == Stay.id)
+        .where(
+            Stay.recurring_stay_id.in_({row.recurring_stay_id for row in rows if row.recurring_stay_id is not None}),
+            Stay.occurrence_date >= min(occurrences).replace(day=1),
+            Stay.occurrence_date <= month_range(f"{max(occurrences):%Y-%m}")[1],
+        )
+    ).all()
+    return {(pattern_id, day.replace(day=1)): is_paid for pattern_id, day, is_paid in rows}
+
+
+def _invoice_item(row, period_payments: dict) -> dict:
+    rate = DAILY_RATE + (row.additional_fee_per_day or 0)
+    amount = row.amount if row.amount is not None else row.duration_days * rate
+    is_paid = row.is_paid
+    if row.recurring_stay_id is not None:
+        # Kwota okresu rozbita na wystąpienia, status wspólny dla całego miesiąca
+        amount = row.duration_days * rate
+        is_paid = period_payments.get((row.recurring_stay_id, row.occurrence_date.replace(day=1)))
+    return {
+        "stay_id": row.stay_id,
+        "dog_name": row.dog_name,
+        "kennel_type": row.kennel_type,
+        "start_date": row.start_date.isoformat(),
+        "end_date": row.end_date.isoformat(),
+        "days": row.duration_days,
+        "rate": rate,
+        "amount": amount,
+        "is_paid": bool(is_paid),
+        "payment_status": _payment_status(is_paid),
+    }
+
+
+def _owner_context(owner: Owner) -> dict:
+    return {
+        "owner_fullname": owner.fullname,
+        "owner_email": owner.email,
+        "owner_phone_number": owner.phone_number,
+    }
+
+
+def collect_documents(
+    db: Session,
+    start_date: date,
+    end_date: date,
+    invoices: bool = True,
+    statements: bool = True,
+    stay_id: Optional[int] = None,
+    owner_id: Optional[int] = None,
+) -> list[dict]:
+    """Invoices of the stays ending between the dates and one statement per owner for that period.
+
+    All data comes from four queries (stays with dogs and payments, monthly payments
+    of recurring stays, owners, outstanding balances); the documents only hold plain
+    values, so they can be rendered outside the session. Recurring stay occurrences
+    are billed per month and only appear on statements.
+    """
+    location_id = db.location_id
+    rows = _stay_rows(db, start_date, end_date, stay_id=stay_id, owner_id=owner_id)
+    if not rows:
+        return []
+    owners = repository.get_many(db, Owner, {row.owner_id for row in rows})
+    period_payments = _period_payments(db, rows)
+
+    documents = []
+    by_owner: dict[int, list[dict]] = defaultdict(list)
+    for row in rows:
+        item = _invoice_item(row, period_payments)
+        by_owner[row.owner_id].append(item)
+        if invoices and row.recurring_stay_id is None:
+            number = f"{location_id}-{row.stay_id}"
+            documents.append({
+                "filename": f"invoices/invoice-{number}.html",
+                "template": "invoice",
+                # Data wystawienia to koniec pobytu - treść nie zmienia się z dnia na dzień
+                "context": {"number": number, "issued_on": item["end_date"], **_owner_context(owners[row.owner_id]), **item},
+            })
+
+    if statements:
+        outstanding = _outstanding(db, by_owner)
+        for statement_owner_id, items in by_owner.items():
+            number = f"{location_id}-{statement_owner_id}-{start_date:%Y%m%d}-{end_date:%Y%m%d}"
+            documents.append({
+                "filename": f"statements/statement-{number}.html",
+                "template": "statement",
+                "context": {
+                    "number": number,
+                    "period_start": start_date.isoformat(),
+                    "period_end": end_date.isoformat(),
+                    **_owner_context(owners[statement_owner_id]),
+                    "items": items,
+                    "billed": sum((item["amount"] for item in items), 0.0),
+                    "paid": sum((item["amount"] for item in items if item["is_paid"]), 0.0),
+                    "outstanding": outstanding.get(statement_owner_id, 0.0),
+                },
+            })
+    return documents
+
+
+def _format(value) -> str:
+    if isinstance(value, float):
+        value = f"{value:.2f}"
+    return html.escape("" if value is None else str(value))
+
+
+def _render(document: dict) -> str:
+    context = {key: _format(value) for key, value in document["context"].items() if key != "items"}
+    if document["template"] == "statement":
+        row_template = _template("statement_row")
+        context["rows"] = "\n".join(
+            row_template.substitute({key: _format(value) for key, value in item.items()}).rstrip("\n")
+            for item in document["context"]["items"]
+        )
+    return _template(document["template"]).substitute(context)
+
+
+def content_hash(document: dict) -> str:
+    payload = json.dumps([_templates_hash(), document["template"], document["context"]], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def render_document(document: dict) -> bytes:
+    """Rendered document, from the cache when a document with the same content was rendered before."""
+    key = content_hash(document)
+    path = os.path.join(INVOICE_CACHE_DIR, key[:2], f"{key}.html")
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    content = _render(document).encode()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Zapis przez plik tymczasowy - równoległy odczyt nigdy nie zobaczy połowy dokumentu
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+    return content
+
+
+class _ZipStream:
+    """Write-only file for zipfile; the bytes written so far are taken out after every entry."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(documents: list[dict]) -> Iterator[bytes]:
+    """ZIP of the documents, yielded entry by entry while the worker pool renders the next ones."""
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for document, content in zip(documents, _executor.map(render_document, documents)):
+            archive.writestr(document["filename"], content)
+            yield stream.take()
+    yield stream.take()
+
+
+def month_range(month: str) -> tuple[date, date]:
+    start_date = date.fromisoformat(f"{month}-01")
+    next_month = (start_date + timedelta(days=32)).replace(day=1)
+    return start_date, next_month - timedelta(days=1)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    from app.database.database import Base, engine, Session as SessionLocal
+
+    parser = argparse.ArgumentParser(description="Write the month-end invoices and owner statements as a ZIP")
+    parser.add_argument("month", help="YYYY-MM, stays ending in this month are invoiced")
+    parser.add_argument("--output", help="ZIP file, invoices-<month>.zip by default")
+    parser.add_argument("--no-statements", action="store_true", help="only per stay invoices")
+    parser.add_argument("--location", type=int, default=None, help="location id, the default location if omitted")
+    args = parser.parse_args(argv)
+
+    start_date, end_date = month_range(args.month)
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal(location_id=args.location)
+    try:
+        documents = collect_documents(db, start_date, end_date, statements=not args.no_statements)
+    finally:
+        db.close()
+
+    output = args.output or f"invoices-{args.month}.zip"
+    with open(output, "wb") as f:
+        for chunk in stream_zip(documents):
+            f.write(chunk)
+    print(f"Wrote {len(documents)} documents to {output}")
+
+
+if __name__ == "__main__":
+    main()
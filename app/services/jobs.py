@@ -0,0 +1,124 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from sqlalchemy import select
+from app.database.database import Session
+from app.database.location import LOCATION_IDS
+from app.models.job import Job
+from app.services.update_payments_from_transfers import update_payments_from_transfers
+from app.services.transfer_catchup import catch_up_transfers
+from app.utils.profiling import profile_run
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+MAX_STORED_ERRORS = 50
+
+IN_FLIGHT_STATUSES = ("queued", "running")
+
+# Zadania, które można uruchomić w tle: nazwa -> funkcja(db, progress) zwracająca podsumowanie
+JOB_TASKS = {
+    "bank_transfer_matching": update_payments_from_transfers,
+    "bank_transfer_catchup": catch_up_transfers,
+}
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+_enqueue_lock = threading.Lock()
+
+
+def enqueue_job(name: str, location_id: int) -> tuple[Job, bool]:
+    """Queue a run of `name` for a location, or return that location's run already in flight.
+
+    Returns the job and whether the request was coalesced into an existing run.
+    """
+    if name not in JOB_TASKS:
+        raise ValueError(f"Unknown job: {name}")
+
+    with _enqueue_lock:
+        db = Session(location_id=location_id)
+        try:
+            in_flight = db.execute(
+                select(Job).where(Job.name == name, Job.status.in_(IN_FLIGHT_STATUSES)).order_by(Job.id)
+            ).scalars().first()
+            if in_flight:
+                logger.info(f"Job {name} already in flight as {in_flight.id}, coalescing")
+                return in_flight, True
+
+            job = Job(name=name, status="queued", counts={}, errors=[], created_at=datetime.now(timezone.utc))
+            db.add(job)
+            db.commit()
+            db.refresh(job)
+        finally:
+            db.close()
+
+    _executor.submit(_run_job, job.id, name, location_id)
+    logger.info(f"Queued job {name} of location {location_id} as {job.id}")
+    return job, False
+
+
+def _run_job(job_id: int, name: str, location_id: int) -> None:
+    db = Session(location_id=location_id)
+    try:
+        job = db.get(Job, job_id)
+        job.status = "running"
+        job.started_at = datetime.now(timezone.utc)
+        db.commit()
+
+        def report(summary: dict) -> None:
+            job.counts = {key: summary[key] for key in ("total", "processed", "updated", "failed")}
+            job.progress = summary["processed"] / summary["total"] if summary["total"] else 0.0
+            db.commit()
+
+        work_db = Session(location_id=location_id)
+        try:
+            with profile_run(f"job_{name}"):
+                summary = JOB_TASKS[name](work_db, progress=report)
+        finally:
+            work_db.close()
+
+        if not summary["ok"]:
+            job.status = "failed"
+        elif summary["failed"]:
+            job.status = "completed_with_errors"
+        else:
+            job.status = "succeeded"
+        job.progress = 1.0 if summary["ok"] else job.progress
+        job.errors = summary["errors"][:MAX_STORED_ERRORS]
+        job.finished_at = datetime.now(timezone.utc)
+        db.commit()
+        logger.info(f"Job {name} ({job_id}) finished with status {job.status}")
+
+    except Exception as e:
+        logger.error(f"Job {name} ({job_id}) crashed", exc_info=True)
+        db.rollback()
+        job = db.get(Job, job_id)
+        if job:
+            job.status = "failed"
+            job.errors = [str(e)]
+            job.finished_at = datetime.now(timezone.utc)
+            db.commit()
+    finally:
+        db.close()
+
+
+def recover_interrupted_jobs() -> None:
+    """Mark runs left queued/running by a previous process as failed so they don't block new triggers."""
+    for location_id in LOCATION_IDS:
+        db = Session(location_id=location_id)
+        try:
+            jobs = db.execute(select(Job).where(Job.status.in_(IN_FLIGHT_STATUSES))).scalars().all()
+            for job in jobs:
+                job.status = "failed"
+                job.errors = (job.errors or []) + ["Interrupted by application restart"]
+                job.finished_at = datetime.now(timezone.utc)
+            db.commit()
+            if jobs:
+                logger.warning(f"Marked {len(jobs)} interrupted jobs of location {location_id} as failed")
+        finally:
+            db.close()
+
+
+def shutdown_jobs() -> None:
+    _executor.shutdown(wait=False, cancel_futures=True)
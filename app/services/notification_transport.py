@@ -0,0 +1,67 @@
+import logging
+import os
+import smtplib
+from email.message import EmailMessage
+from typing import Protocol
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_TRANSPORT = os.getenv("NOTIFY_TRANSPORT", "log")  # "smtp" albo "log"
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "25"))
+SMTP_SENDER = os.getenv("SMTP_SENDER", "noreply@doghotel.local")
+SMTP_USERNAME = os.getenv("SMTP_USERNAME")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "false").lower() == "true"
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", "10"))
+
+
+class NotificationTransport(Protocol):
+    def send(self, to: str, subject: str, body: str) -> None: ...
+
+
+class LogTransport:
+    """Writes messages to the log instead of sending them (default when SMTP is not configured)."""
+
+    def send(self, to: str, subject: str, body: str) -> None:
+        logger.info(f"Notification to {to}: {subject}\n{body}")
+
+
+class SmtpTransport:
+    def __init__(
+        self,
+        host: str = SMTP_HOST,
+        port: int = SMTP_PORT,
+        sender: str = SMTP_SENDER,
+        username: str | None = SMTP_USERNAME,
+        password: str | None = SMTP_PASSWORD,
+        starttls: bool = SMTP_STARTTLS,
+        timeout: float = SMTP_TIMEOUT_SECONDS,
+    ):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def send(self, to: str, subject: str, body: str) -> None:
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = to
+        message["Subject"] = subject
+        message.set_content(body)
+
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password or "")
+            smtp.send_message(message)
+
+
+def get_transport() -> NotificationTransport:
+    if NOTIFY_TRANSPORT == "smtp":
+        return SmtpTransport()
+    return LogTransport()
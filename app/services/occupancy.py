@@ -0,0 +1,178 @@
+import logging
+import os
+from collections import Counter
+from datetime import date, timedelta
+from typing import Optional
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from app.database.database import SQLITE_MAX_VARIABLES
+from app.models.occupancy import DailyOccupancy
+from app.models.stay import Stay
+
+logger = logging.getLogger(__name__)
+
+ALL_KENNELS = "*"
+DEFAULT_KENNEL_TYPE = "standard"
+
+
+def _parse_type_capacity(value: str) -> dict[str, int]:
+    capacity = {}
+    for item in value.split(","):
+        if item.strip():
+            name, _, count = item.partition("=")
+            capacity[name.strip()] = int(count)
+    return capacity
+
+
+KENNEL_CAPACITY = int(os.getenv("KENNEL_CAPACITY", "20"))  # wszystkie boksy razem
+KENNEL_TYPE_CAPACITY = _parse_type_capacity(os.getenv("KENNEL_TYPE_CAPACITY", f"{DEFAULT_KENNEL_TYPE}=20"))
+
+# Zapytania Core na tabeli nie przechodzą przez filtr placówki sesji - location_id podajemy jawnie
+_table = DailyOccupancy.__table__
+INSERT_CHUNK_SIZE = SQLITE_MAX_VARIABLES // len(_table.columns)  # każda kolumna wiersza to jeden parametr
+
+
+class CapacityError(Exception):
+    def __init__(self, kennel_type: str, full: list[tuple[date, str]]):
+        self.kennel_type = kennel_type
+        self.full = full
+        messages = []
+        for name in (kennel_type, ALL_KENNELS):
+            days = ", ".join(day.isoformat() for day, full_name in full if full_name == name)
+            if days:
+                messages.append(f"No free kennel on {days}" if name == ALL_KENNELS else f"No free {name} kennel on {days}")
+        super().__init__("; ".join(messages))
+
+
+def capacity_of(kennel_type: str) -> int:
+    return KENNEL_CAPACITY if kennel_type == ALL_KENNELS else KENNEL_TYPE_CAPACITY[kennel_type]
+
+
+def stay_days(start_date: date, end_date: date) -> list[date]:
+    return [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+
+
+def _insert_missing(db: Session, rows: list[dict]) -> None:
+    dialect = db.get_bind().dialect.name
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[i:i + INSERT_CHUNK_SIZE]
+        if dialect in ("sqlite", "postgresql"):
+            dialect_insert = sqlite_insert if dialect == "sqlite" else pg_insert
+            db.execute(
+                dialect_insert(_table).values(chunk)
+                .on_conflict_do_nothing(index_elements=["location_id", "day", "kennel_type"])
+            )
+            continue
+        existing = set(db.execute(
+            select(_table.c.day, _table.c.kennel_type)
+            .where(
+                _table.c.location_id == db.location_id,
+                _table.c.day.in_({r["day"] for r in chunk}),
+                _table.c.kennel_type.in_({r["kennel_type"] for r in chunk}),
+            )
+        ).all())
+        new_rows = [r for r in chunk if (r["day"], r["kennel_type"]) not in existing]
+        if new_rows:
+            db.execute(insert(_table), new_rows)
+
+
+def _change(db: Session, kennel_type: str, start_date: date, end_date: date, delta: int) -> None:
+    kennel_types = (kennel_type, ALL_KENNELS)
+    if delta > 0:
+        _insert_missing(db, [
+            {"location_id": db.location_id, "day": day, "kennel_type": name, "occupied": 0}
+            for day in stay_days(start_date, end_date) for name in kennel_types
+        ])
+    # UPDATE blokuje wiersze dni, więc równoległe rezerwacje tych samych dni czekają na siebie
+    db.execute(
+        update(_table)
+        .where(
+            _table.c.location_id == db.location_id,
+            _table.c.day >= start_date,
+            _table.c.day <= end_date,
+            _table.c.kennel_type.in_(kennel_types),
+        )
+        .values(occupied=_table.c.occupied + delta)
+    )
+
+
+def reserve(
+    db: Session, kennel_type: str, start_date: date, end_date: date, planned: Optional[Counter] = None
+) -> None:
+    """Count a stay into the occupancy of its days; raises CapacityError when any day is full.
+
+    `planned` adds occupancy not counted in the table yet, i.e. recurring stay occurrences
+    beyond their horizon. Runs in the caller's transaction - roll it back on CapacityError.
+    """
+    planned = planned or Counter()
+    _change(db, kennel_type, start_date, end_date, +1)
+    rows = db.execute(
+        select(_table.c.day, _table.c.kennel_type, _table.c.occupied)
+        .where(
+            _table.c.location_id == db.location_id,
+            _table.c.day >= start_date,
+            _table.c.day <= end_date,
+            _table.c.kennel_type.in_((kennel_type, ALL_KENNELS)),
+        )
+    ).all()
+    full = sorted(
+        (day, name) for day, name, occupied in rows if occupied + planned[(day, name)] > capacity_of(name)
+    )
+    if full:
+        raise CapacityError(kennel_type, full)
+
+
+def release(db: Session, kennel_type: str, start_date: date, end_date: date) -> None:
+    _change(db, kennel_type, start_date, end_date, -1)
+
+
+def availability(db: Session, start_date: date, end_date: date, planned: Optional[Counter] = None) -> list[dict]:
+    occupied = Counter(planned or {})
+    for day, name, count in db.execute(
+        select(_table.c.day, _table.c.kennel_type, _table.c.occupied)
+        .where(_table.c.location_id == db.location_id, _table.c.day >= start_date, _table.c.day <= end_date)
+    ):
+        occupied[(day, name)] += count
+
+    def slot(day: date, name: str) -> dict:
+        count = occupied.get((day, name), 0)
+        capacity = capacity_of(name)
+        return {"capacity": capacity, "occupied": count, "free": max(0, capacity - count)}
+
+    return [
+        {
+            "day": day,
+            "total": slot(day, ALL_KENNELS),
+            "kennel_types": {name: slot(day, name) for name in KENNEL_TYPE_CAPACITY},
+        }
+        for day in stay_days(start_date, end_date)
+    ]
+
+
+def rebuild_occupancy(db: Session, from_day: Optional[date] = None) -> int:
+    """Recount occupancy from today on from the stays, e.g. for data written before the table existed."""
+    from_day = from_day or date.today()
+    counts: Counter = Counter()
+    for start_date, end_date, kennel_type in db.execute(
+        select(Stay.start_date, Stay.end_date, Stay.kennel_type).where(Stay.end_date >= from_day)
+    ):
+        for day in stay_days(max(start_date, from_day), end_date):
+            counts[(day, kennel_type)] += 1
+            counts[(day, ALL_KENNELS)] += 1
+
+    try:
+        db.execute(delete(_table).where(_table.c.location_id == db.location_id, _table.c.day >= from_day))
+        rows = [
+            {"location_id": db.location_id, "day": day, "kennel_type": name, "occupied": count}
+            for (day, name), count in counts.items()
+        ]
+        for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+            db.execute(insert(_table), rows[i:i + INSERT_CHUNK_SIZE])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    logger.info(f"Rebuilt occupancy of location {db.location_id} from {from_day}: {len(counts)} day counters")
+    return len(counts)
@@ -1,10 +1,17 @@
 import logging
 import os
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
 from sqlalchemy.orm import Session
-from app.models.dog import Dog
-from datetime import datetime, timedelta, timezone
-from sqlalchemy import select
-from sqlalchemy import func
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import exists, func, select
+from app.models.owner import Owner
+from app.models.stay import Stay
+from app.models.payment import Payment
+from app.models.notification import OverdueNotification
+from app.services.notification_transport import NotificationTransport, get_transport
 
 # Tworzenie katalogu 'logs', jeśli nie istnieje
 log_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'logs')
@@ -30,5 +37,119 @@ if not logger.handlers:  # Avoid adding handlers multiple times
     logger.addHandler(file_handler)
     logger.addHandler(console_handler)
     
-#TODO: wyliczać overdue i informować kiedy jest ponad 30 dni
-    
+OVERDUE_NOTIFY_AFTER_DAYS = int(os.getenv("OVERDUE_NOTIFY_AFTER_DAYS", "30"))
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "4"))
+
+# Termin płatności w zapytaniach złączonych z pobytem - odpowiednik Payment.due_on()
+DUE_DATE = func.coalesce(Payment.due_date, Stay.end_date)
+
+
+def update_overdue_payments(db: Session, today: Optional[date] = None) -> int:
+    """Mark unpaid payments past their due date as overdue and refresh their overdue_days."""
+    today = today or date.today()
+    rows = db.execute(
+        select(Payment, DUE_DATE)
+        .join(Stay, Payment.stay_id == Stay.id)
+        .where(Payment.is_paid == False, DUE_DATE < today)
+    ).all()
+
+    for payment, due_date in rows:
+        payment.is_overdue = True
+        payment.overdue_days = (today - due_date).days
+
+    db.commit()
+    logger.info(f"Updated overdue status of {len(rows)} payments")
+    return len(rows)
+
+
+def _digest_body(fullname: str, items: list, today: date) -> str:
+    lines = [f"Dear {fullname},", "", "The following Dog Hotel payments are overdue:", ""]
+    for item in items:
+        lines.append(
+            f"- stay #{item.stay_id} ({item.start_date} - {item.end_date}): "
+            f"{item.amount:.2f}, {(today - item.due_date).days} days overdue"
+        )
+    lines += ["", "Please transfer the amount with the stay number as the transfer title."]
+    return "\n".join(lines)
+
+
+def notify_overdue_owners(
+    db: Session,
+    transport: Optional[NotificationTransport] = None,
+    threshold_days: Optional[int] = None,
+    today: Optional[date] = None,
+) -> dict:
+    """Send each owner one digest of payments newly overdue by more than `threshold_days`.
+
+    Payments already notified are skipped, and a payment is recorded only once its
+    digest was sent, so a failed send is retried on the next run.
+    """
+    transport = transport or get_transport()
+    threshold_days = OVERDUE_NOTIFY_AFTER_DAYS if threshold_days is None else threshold_days
+    today = today or date.today()
+    cutoff = today - timedelta(days=threshold_days)
+
+    rows = db.execute(
+        select(
+            Payment.id.label("payment_id"),
+            (Payment.amount - Payment.paid_amount).label("amount"),  # do zapłaty zostaje reszta
+            Stay.id.label("stay_id"),
+            Stay.start_date,
+            Stay.end_date,
+            DUE_DATE.label("due_date"),
+            Owner.id.label("owner_id"),
+            Owner.email,
+            Owner.fullname,
+        )
+        .join(Stay, Payment.stay_id == Stay.id)
+        .join(Owner, Stay.owner_id == Owner.id)
+        .where(
+            Payment.is_paid == False,
+            DUE_DATE < cutoff,
+            ~exists().where(OverdueNotification.payment_id == Payment.id),
+        )
+        .order_by(Owner.id, DUE_DATE)
+    ).all()
+
+    digests: dict[int, list] = defaultdict(list)
+    for row in rows:
+        digests[row.owner_id].append(row)
+    logger.info(f"Found {len(rows)} newly overdue payments for {len(digests)} owners")
+
+    summary = {"owners": len(digests), "payments": len(rows), "sent": 0, "failed": 0}
+    if not digests:
+        return summary
+
+    with ThreadPoolExecutor(max_workers=NOTIFY_CONCURRENCY, thread_name_prefix="notify") as pool:
+        futures = {}
+        for owner_id, items in digests.items():
+            body = _digest_body(items[0].fullname, items, today)
+            future = pool.submit(transport.send, items[0].email, "Overdue payments at Dog Hotel", body)
+            futures[future] = (owner_id, items)
+
+        for future in as_completed(futures):
+            owner_id, items = futures[future]
+            try:
+                future.result()
+            except Exception:
+                logger.error(f"Failed to send overdue digest to owner {owner_id}", exc_info=True)
+                summary["failed"] += 1
+                continue
+
+            digest_id = uuid.uuid4().hex
+            sent_at = datetime.now(timezone.utc)
+            db.add_all(
+                OverdueNotification(
+                    payment_id=item.payment_id,
+                    owner_id=owner_id,
+                    email=item.email,
+                    digest_id=digest_id,
+                    sent_at=sent_at,
+                )
+                for item in items
+            )
+            db.commit()
+            summary["sent"] += 1
+
+    logger.info(f"Overdue digests sent: {summary['sent']}, failed: {summary['failed']}")
+    return summary
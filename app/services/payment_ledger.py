@@ -0,0 +1,129 @@
+"""Payment ledger: every matched bank transfer is one entry, payments keep the running sum.
+
+Payment.paid_amount is updated together with each entry, so the balance of a payment
+never needs a rescan of its transfers. `rebuild_payment_balances` recomputes all of
+them from the ledger with one grouped SUM - after restoring a backup, fixing data by
+hand, or upgrading a database created before the ledger:
+
+    python -m app.services.payment_ledger [--location N] rebuild
+"""
+import argparse
+import logging
+from datetime import date, datetime, timezone
+from typing import Optional
+from sqlalchemy import DateTime, exists, func, insert, literal, or_, select
+from sqlalchemy.orm import Session, joinedload
+from app.models.bank_transfer import BankTransfer
+from app.models.payment import Payment
+from app.models.payment_ledger import PaymentLedgerEntry
+
+logger = logging.getLogger(__name__)
+
+
+def settle(payment: Payment, today: Optional[date] = None) -> None:
+    """Derive the paid and overdue flags of a payment from its paid amount."""
+    today = today or date.today()
+    # Porównanie w groszach - suma kilku przelewów nie może przegrać z błędem zaokrąglenia
+    payment.is_paid = round(payment.paid_amount or 0.0, 2) >= round(payment.amount, 2)
+    due_date = payment.due_on()
+    payment.is_overdue = not payment.is_paid and due_date < today
+    payment.overdue_days = (today - due_date).days if payment.is_overdue else 0
+
+
+def record_transfer(db: Session, transfer: BankTransfer, payment: Payment) -> PaymentLedgerEntry:
+    """Add the transfer to the ledger of the payment and settle the payment from the new balance."""
+    entry = PaymentLedgerEntry(payment_id=payment.id, bank_transfer_id=transfer.id, amount=transfer.amount)
+    db.add(entry)
+    payment.paid_amount = (payment.paid_amount or 0.0) + transfer.amount
+    settle(payment)
+    return entry
+
+
+def reverse_transfer(db: Session, transfer: BankTransfer) -> Optional[Payment]:
+    """Remove the ledger entry of a transfer, if any; returns the payment it was booked on."""
+    entry = db.execute(
+        select(PaymentLedgerEntry).where(PaymentLedgerEntry.bank_transfer_id == transfer.id)
+    ).scalar_one_or_none()
+    if entry is None:
+        return None
+    payment = db.get(Payment, entry.payment_id)
+    db.delete(entry)
+    if payment is not None:
+        payment.paid_amount = (payment.paid_amount or 0.0) - entry.amount
+        settle(payment)
+    return payment
+
+
+def rebuild_payment_balances(db: Session, today: Optional[date] = None) -> int:
+    """Recompute paid amounts and flags of the location's payments from the ledger; returns payments changed.
+
+    Matched transfers without an entry (matched before the ledger existed) are entered
+    first. Payments without any entry keep their flags - they may be marked paid by hand.
+    """
+    today = today or date.today()
+    entered_at = datetime.now(timezone.utc)
+    ledger = PaymentLedgerEntry.__table__
+    transfers = BankTransfer.__table__
+    # Zapytania Core na tabeli nie przechodzą przez filtr placówki sesji - location_id podajemy jawnie
+    backfilled = db.execute(
+        insert(ledger).from_select(
+            ["location_id", "payment_id", "bank_transfer_id", "amount", "created_at"],
+            select(
+                transfers.c.location_id, transfers.c.matched_payment_id, transfers.c.id,
+                transfers.c.amount, literal(entered_at, DateTime).label("created_at"),
+            ).where(
+                transfers.c.location_id == db.location_id,
+                transfers.c.matched_payment_id.is_not(None),
+                ~exists().where(ledger.c.bank_transfer_id == transfers.c.id),
+            ),
+        )
+    ).rowcount
+
+    totals = (
+        select(PaymentLedgerEntry.payment_id, func.sum(PaymentLedgerEntry.amount).label("total"))
+        .group_by(PaymentLedgerEntry.payment_id)
+        .subquery()
+    )
+    rows = db.execute(
+        select(Payment, totals.c.total)
+        .outerjoin(totals, totals.c.payment_id == Payment.id)
+        .options(joinedload(Payment.stay))
+        .where(or_(totals.c.total.is_not(None), Payment.paid_amount != 0))
+    ).all()
+
+    changed = 0
+    for payment, total in rows:
+        before = (payment.paid_amount, payment.is_paid, payment.is_overdue, payment.overdue_days)
+        payment.paid_amount = total or 0.0
+        if total is not None:
+            settle(payment, today)
+        if (payment.paid_amount, payment.is_paid, payment.is_overdue, payment.overdue_days) != before:
+            changed += 1
+    db.commit()
+    logger.info(
+        f"Rebuilt payment balances of location {db.location_id}: {backfilled} transfers entered, {changed} payments changed"
+    )
+    return changed
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    from app.database.database import Base, Session as SessionLocal, engine
+    from app.models.dog import Dog  # relacje Stay wymagają zarejestrowanych modeli
+
+    parser = argparse.ArgumentParser(description="Maintain payment balances derived from the payment ledger")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild", help="recompute paid amounts and flags of all payments from the ledger")
+    parser.add_argument("--location", type=int, default=None, help="location id, the default location if omitted")
+    args = parser.parse_args(argv)
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal(location_id=args.location)
+    try:
+        count = rebuild_payment_balances(db)
+        print(f"Rebuilt balances, {count} payments changed")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+import logging
+import math
+import os
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from typing import Iterable, Iterator, Optional
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+from app.database import repository
+from app.models.payment import DAILY_RATE, Payment
+from app.models.recurring_stay import RecurringStay, RecurringStayException
+from app.models.stay import Stay, stay_duration_days
+from app.services.occupancy import ALL_KENNELS, CapacityError, release, reserve, stay_days
+
+logger = logging.getLogger(__name__)
+
+# Wystąpienia do dziś + horyzont mają wiersze w stays; dalsze rozwijamy z wzorca w locie
+RECURRING_HORIZON_DAYS = int(os.getenv("RECURRING_HORIZON_DAYS", "28"))
+MAX_OCCURRENCE_DAYS = 7
+# Płatność za miesiąc powstaje po jego końcu - zaległa dopiero po terminie liczonym od wystawienia
+RECURRING_PAYMENT_DUE_DAYS = int(os.getenv("RECURRING_PAYMENT_DUE_DAYS", "14"))
+
+
+def min_gap_days(weekdays: list[int], interval_weeks: int) -> int:
+    """Shortest distance between two consecutive occurrences - the longest an occurrence may last."""
+    cycle = 7 * interval_weeks
+    gaps = [later - earlier for earlier, later in zip(weekdays, weekdays[1:])]
+    return min(gaps + [cycle - weekdays[-1] + weekdays[0]])
+
+
+def occurrence_dates(pattern: RecurringStay, start_date: date, end_date: date) -> Iterator[date]:
+    """First days of the pattern's occurrences between the dates, in order, exceptions included.
+
+    Starts at the first active week of the range, so the cost depends on the range,
+    not on how long ago the pattern started.
+    """
+    first = max(start_date, pattern.starts_on)
+    last = end_date if pattern.ends_on is None else min(end_date, pattern.ends_on)
+    if first > last:
+        return
+    anchor = pattern.starts_on - timedelta(days=pattern.starts_on.weekday())  # poniedziałek pierwszego tygodnia
+    week = (first - anchor).days // 7
+    week += -week % pattern.interval_weeks
+    weekdays = pattern.weekday_numbers
+    while True:
+        week_start = anchor + timedelta(weeks=week)
+        if week_start > last:
+            return
+        for weekday in weekdays:
+            day = week_start + timedelta(days=weekday)
+            if first <= day <= last:
+                yield day
+        week += pattern.interval_weeks
+
+
+def occurrence_end(pattern: RecurringStay, day: date) -> date:
+    return day + timedelta(days=pattern.duration_days - 1)
+
+
+def pending_occurrences(
+    pattern: RecurringStay, start_date: date, end_date: date, excluded: Iterable[date] = ()
+) -> Iterator[tuple[date, date]]:
+    """(first, last day) of occurrences overlapping the dates that have no row in stays yet.
+
+    Only days after the pattern's horizon qualify; `excluded` are the exceptions and
+    occurrences materialized early, see _pending_exclusions.
+    """
+    excluded = set(excluded)
+    first = max(start_date - timedelta(days=pattern.duration_days - 1), pattern.materialized_until + timedelta(days=1))
+    for day in occurrence_dates(pattern, first, end_date):
+        if day not in excluded:
+            yield day, occurrence_end(pattern, day)
+
+
+def _patterns_pending_in(db: Session, start_date: date, end_date: date, dog_id: Optional[int] = None) -> list[RecurringStay]:
+    # Wzorce, które mogą mieć niezmaterializowane wystąpienia w zakresie
+    stmt = select(RecurringStay).where(
+        RecurringStay.starts_on <= end_date,
+        RecurringStay.materialized_until < end_date,
+        or_(RecurringStay.ends_on.is_(None), RecurringStay.ends_on >= start_date - timedelta(days=MAX_OCCURRENCE_DAYS)),
+    )
+    if dog_id is not None:
+        stmt = stmt.where(RecurringStay.dog_id == dog_id)
+    return list(db.execute(stmt).scalars())
+
+
+def _pending_exclusions(db: Session, patterns: list[RecurringStay], start_date: date) -> dict[int, set[date]]:
+    excluded: dict[int, set[date]] = defaultdict(set)
+    if not patterns:
+        return excluded
+    ids = [pattern.id for pattern in patterns]
+    since = start_date - timedelta(days=MAX_OCCURRENCE_DAYS)
+    for model in (RecurringStayException, Stay):
+        for pattern_id, day in db.execute(
+            select(model.recurring_stay_id, model.occurrence_date)
+            .where(model.recurring_stay_id.in_(ids), model.occurrence_date >= since)
+        ):
+            excluded[pattern_id].add(day)
+    return excluded
+
+
+def planned_occupancy(db: Session, start_date: date, end_date: date) -> Counter:
+    """Occupancy per (day, kennel type) of occurrences in the range not counted in daily_occupancy yet."""
+    patterns = _patterns_pending_in(db, start_date, end_date)
+    excluded = _pending_exclusions(db, patterns, start_date)
+    counts: Counter = Counter()
+    for pattern in patterns:
+        for first_day, last_day in pending_occurrences(pattern, start_date, end_date, excluded[pattern.id]):
+            for day in stay_days(max(first_day, start_date), min(last_day, end_date)):
+                counts[(day, pattern.kennel_type)] += 1
+                counts[(day, ALL_KENNELS)] += 1
+    return counts
+
+
+def pending_overlap(db: Session, dog_id: int, start_date: date, end_date: date) -> Optional[tuple[int, date]]:
+    """(pattern id, day) of the first not yet materialized occurrence of the dog overlapping the dates."""
+    patterns = _patterns_pending_in(db, start_date, end_date, dog_id)
+    excluded = _pending_exclusions(db, patterns, start_date)
+    for pattern in patterns:
+        for first_day, _ in pending_occurrences(pattern, start_date, end_date, excluded[pattern.id]):
+            return pattern.id, first_day
+    return None
+
+
+def pattern_overlap(db: Session, pattern: RecurringStay) -> Optional[str]:
+    """The stay or other pattern of the same dog that an occurrence of `pattern` would overlap.
+
+    Checks each stay of the dog and each of its patterns once, so the cost does not
+    grow with the number of occurrences.
+    """
+    lead = timedelta(days=pattern.duration_days - 1)
+    stays = select(Stay.id, Stay.start_date, Stay.end_date).where(
+        Stay.dog_id == pattern.dog_id, Stay.end_date >= pattern.starts_on
+    )
+    if pattern.ends_on is not None:
+        stays = stays.where(Stay.start_date <= pattern.ends_on + lead)
+    for stay_id, start_date, end_date in db.execute(stays):
+        if next(occurrence_dates(pattern, start_date - lead, end_date), None) is not None:
+            return f"stay {stay_id}"
+
+    others = select(RecurringStay).where(
+        RecurringStay.dog_id == pattern.dog_id,
+        or_(RecurringStay.ends_on.is_(None), RecurringStay.ends_on >= pattern.starts_on),
+    )
+    if pattern.id is not None:
+        others = others.where(RecurringStay.id != pattern.id)
+    for other in db.execute(others).scalars():
+        # Od startu późniejszego wzorca układ wystąpień obu powtarza się co NWW ich interwałów
+        first = max(pattern.starts_on, other.starts_on) - timedelta(days=MAX_OCCURRENCE_DAYS)
+        last = first + timedelta(weeks=math.lcm(pattern.interval_weeks, other.interval_weeks), days=2 * MAX_OCCURRENCE_DAYS)
+        other_occurrences = [(day, occurrence_end(other, day)) for day in occurrence_dates(other, first, last)]
+        for day in occurrence_dates(pattern, first, last):
+            end_date = occurrence_end(pattern, day)
+            if any(start <= end_date and end >= day for start, end in other_occurrences):
+                return f"recurring stay {other.id}"
+    return None
+
+
+def _occurrence_stay(pattern: RecurringStay, day: date) -> Stay:
+    return Stay(
+        recurring_stay_id=pattern.id,
+        occurrence_date=day,
+        start_date=day,
+        end_date=occurrence_end(pattern, day),
+        dog_id=pattern.dog_id,
+        owner_id=pattern.owner_id,
+        kennel_type=pattern.kennel_type,
+        additional_fee_per_day=pattern.additional_fee_per_day,
+        notes=pattern.notes,
+    )
+
+
+def materialize(db: Session, pattern: RecurringStay, until: date, skip_full: bool = False) -> list[Stay]:
+    """Create stay rows for the pattern's occurrences up to `until`, counted into occupancy.
+
+    A full day raises CapacityError, or with `skip_full` records the occurrence as an
+    exception. Runs in the caller's transaction; the pattern must be flushed.
+    """
+    start_date = pattern.materialized_until + timedelta(days=1)
+    if until < start_date:
+        return []
+    excluded = {exception.occurrence_date for exception in pattern.exceptions}
+    excluded |= set(db.execute(
+        select(Stay.occurrence_date).where(Stay.recurring_stay_id == pattern.id, Stay.occurrence_date >= start_date)
+    ).scalars())
+
+    created, skipped = [], []
+    for day in occurrence_dates(pattern, start_date, until):
+        if day in excluded:
+            continue
+        try:
+            reserve(db, pattern.kennel_type, day, occurrence_end(pattern, day))
+        except CapacityError:
+            if not skip_full:
+                raise
+            release(db, pattern.kennel_type, day, occurrence_end(pattern, day))  # reserve zdążył doliczyć dni
+            pattern.exceptions.append(RecurringStayException(occurrence_date=day, reason="no capacity"))
+            skipped.append(day)
+            continue
+        stay = _occurrence_stay(pattern, day)
+        db.add(stay)
+        created.append(stay)
+    if skipped:
+        logger.warning(
+            f"Skipped {len(skipped)} occurrences of recurring stay {pattern.id} for lack of capacity: "
+            f"{', '.join(day.isoformat() for day in skipped)}"
+        )
+    pattern.materialized_until = until
+    return created
+
+
+def materialize_occurrence(db: Session, pattern: RecurringStay, day: date) -> Stay:
+    """Row of one occurrence, created ahead of the horizon when needed, e.g. to edit it."""
+    stay = repository.first_by(db, Stay, recurring_stay_id=pattern.id, occurrence_date=day)
+    if stay is not None:
+        return stay
+    if next(occurrence_dates(pattern, day, day), None) != day:
+        raise ValueError(f"{day} is not an occurrence of recurring stay {pattern.id}")
+    if any(exception.occurrence_date == day for exception in pattern.exceptions):
+        raise ValueError(f"Occurrence {day} of recurring stay {pattern.id} was cancelled")
+    reserve(db, pattern.kennel_type, day, occurrence_end(pattern, day))
+    stay = _occurrence_stay(pattern, day)
+    db.add(stay)
+    return stay
+
+
+def cancel_occurrence(db: Session, pattern: RecurringStay, day: date) -> None:
+    if day <= pattern.billed_until:
+        raise ValueError(f"Occurrence {day} is in an already billed month")
+    if next(occurrence_dates(pattern, day, day), None) != day:
+        raise ValueError(f"{day} is not an occurrence of recurring stay {pattern.id}")
+    stay = repository.first_by(db, Stay, recurring_stay_id=pattern.id, occurrence_date=day)
+    if stay is not None:
+        release(db, stay.kennel_type, stay.start_date, stay.end_date)
+        db.delete(stay)
+    if not any(exception.occurrence_date == day for exception in pattern.exceptions):
+        pattern.exceptions.append(RecurringStayException(occurrence_date=day))
+
+
+def end_pattern(db: Session, pattern: RecurringStay, ends_on: date) -> int:
+    """Set the last day of the pattern and remove the rows of occurrences after it."""
+    if ends_on < pattern.billed_until:
+        raise ValueError(f"Recurring stay {pattern.id} is billed until {pattern.billed_until}")
+    later = db.execute(
+        select(Stay).where(Stay.recurring_stay_id == pattern.id, Stay.occurrence_date > ends_on)
+    ).scalars().all()
+    for stay in later:
+        release(db, stay.kennel_type, stay.start_date, stay.end_date)
+        db.delete(stay)
+    pattern.ends_on = ends_on
+    return len(later)
+
+
+def materialize_horizon(db: Session, today: Optional[date] = None) -> int:
+    """Roll every pattern's rows forward to today + RECURRING_HORIZON_DAYS, one transaction per pattern."""
+    until = (today or date.today()) + timedelta(days=RECURRING_HORIZON_DAYS)
+    patterns = db.execute(
+        select(RecurringStay).where(
+            RecurringStay.materialized_until < until,
+            or_(RecurringStay.ends_on.is_(None), RecurringStay.ends_on > RecurringStay.materialized_until),
+        )
+    ).scalars().all()
+
+    created = 0
+    for pattern in patterns:
+        try:
+            created += len(materialize(db, pattern, until, skip_full=True))
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.error(f"Failed to materialize recurring stay {pattern.id}", exc_info=True)
+    logger.info(f"Materialized {created} occurrences of {len(patterns)} recurring stays up to {until}")
+    return created
+
+
+def _month_end(day: date) -> date:
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+
+def occurrence_amount(stay: Stay) -> float:
+    return stay_duration_days(stay.start_date, stay.end_date) * (DAILY_RATE + (stay.additional_fee_per_day or 0))
+
+
+def bill_recurring_stays(db: Session, today: Optional[date] = None) -> int:
+    """Bill each finished month of each pattern with one payment, attached to the month's last occurrence.
+
+    The payment's stay id is the transfer title, as for single stays, and the month's
+    occurrences are materialized first if the horizon has not reached them. The payment
+    is due RECURRING_PAYMENT_DUE_DAYS after billing, not at the end of the occurrence.
+    """
+    today = today or date.today()
+    due_date = today + timedelta(days=RECURRING_PAYMENT_DUE_DAYS)
+    last_billable = today.replace(day=1) - timedelta(days=1)
+    patterns = db.execute(
+        select(RecurringStay).where(
+            RecurringStay.billed_until < last_billable,
+            RecurringStay.starts_on <= last_billable,
+            or_(RecurringStay.ends_on.is_(None), RecurringStay.ends_on > RecurringStay.billed_until),
+        )
+    ).scalars().all()
+
+    billed = 0
+    for pattern in patterns:
+        try:
+            while pattern.billed_until < last_billable and (pattern.ends_on is None or pattern.billed_until < pattern.ends_on):
+                period_start = pattern.billed_until + timedelta(days=1)
+                period_end = _month_end(period_start)
+                materialize(db, pattern, period_end, skip_full=True)
+                db.flush()
+                stays = db.execute(
+                    select(Stay)
+                    .where(
+                        Stay.recurring_stay_id == pattern.id,
+                        Stay.occurrence_date >= period_start,
+                        Stay.occurrence_date <= period_end,
+                    )
+                    .order_by(Stay.occurrence_date)
+                ).scalars().all()
+                if stays:
+                    db.add(Payment(
+                        stay_id=stays[-1].id,
+                        amount=sum(occurrence_amount(stay) for stay in stays),
+                        due_date=due_date,
+                    ))
+                    billed += 1
+                pattern.billed_until = period_end
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.error(f"Failed to bill recurring stay {pattern.id}", exc_info=True)
+    logger.info(f"Created {billed} period payments for {len(patterns)} recurring stays")
+    return billed
@@ -0,0 +1,162 @@
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from urllib.parse import urlencode
+
+REPLAY_TIMEOUT_SECONDS = 30
+
+
+def load_records(path: str, routes: Optional[list[str]] = None) -> list[dict]:
+    records = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            # Ciał ponad limit nagrania nie da się odtworzyć
+            if isinstance(record.get("body"), dict) and "_bytes" in record["body"]:
+                continue
+            if routes and record.get("route") not in routes:
+                continue
+            records.append(record)
+    records.sort(key=lambda record: record["ts"])
+    return records
+
+
+def _send(base_url: str, record: dict) -> tuple[int, float]:
+    url = base_url.rstrip("/") + record["path"]
+    if record["query"]:
+        url += "?" + urlencode([tuple(pair) for pair in record["query"]])
+    body = None if record["body"] is None else json.dumps(record["body"]).encode()
+    headers = dict(record.get("headers") or {})
+    if body is not None:
+        headers["Content-Type"] = "application/json"
+    request = urllib.request.Request(url, data=body, method=record["method"], headers=headers)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=REPLAY_TIMEOUT_SECONDS) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = 0  # połączenie zerwane lub przekroczony czas
+    return status, (time.perf_counter() - started) * 1000
+
+
+def replay(records: list[dict], base_url: str, speed: float = 1.0, concurrency: int = 32) -> list[dict]:
+    """Send the records with their recorded spacing divided by `speed`; returns one result per record."""
+    results: list[dict] = []
+    lock = threading.Lock()
+
+    def run(record: dict) -> None:
+        status, ms = _send(base_url, record)
+        with lock:
+            results.append({
+                "route": f"{record['method']} {record['route'] or record['path']}",
+                "recorded_ms": record["ms"],
+                "recorded_status": record["status"],
+                "ms": ms,
+                "status": status,
+            })
+
+    if not records:
+        return results
+    first_ts = records[0]["ts"]
+    started = time.perf_counter()
+    futures = []
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="replay") as pool:
+        for record in records:
+            # Zachowujemy odstępy z nagrania - paczki rezerwacji i nakładanie się zadań zostają
+            delay = (record["ts"] - first_ts) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(run, record))
+    for future in futures:
+        future.result()
+    return results
+
+
+def _percentile(values: list[float], percentile: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile))]
+
+
+def summarize(results: list[dict]) -> dict[str, dict]:
+    by_route: dict[str, list[dict]] = defaultdict(list)
+    for result in results:
+        by_route[result["route"]].append(result)
+    summary = {}
+    for route, items in sorted(by_route.items()):
+        replayed = [item["ms"] for item in items]
+        recorded = [item["recorded_ms"] for item in items]
+        summary[route] = {
+            "count": len(items),
+            "p50_ms": round(_percentile(replayed, 0.5), 2),
+            "p95_ms": round(_percentile(replayed, 0.95), 2),
+            "p99_ms": round(_percentile(replayed, 0.99), 2),
+            "recorded_p50_ms": round(_percentile(recorded, 0.5), 2),
+            "recorded_p95_ms": round(_percentile(recorded, 0.95), 2),
+            "errors": sum(1 for item in items if item["status"] == 0 or item["status"] >= 500),
+            "status_mismatches": sum(1 for item in items if item["status"] != item["recorded_status"]),
+        }
+    return summary
+
+
+def format_report(summary: dict[str, dict], baseline: Optional[dict[str, dict]] = None) -> str:
+    """Per route latency of the replay against the baseline run, or against production timings without one."""
+    against = "baseline" if baseline else "recorded"
+    lines = [
+        f"{'route':<45} {'n':>6} {'p50':>9} {'p95':>9} {against + ' p95':>14} {'delta p95':>12} {'errors':>7} {'status!=':>9}"
+    ]
+    for route, stats in summary.items():
+        if baseline:
+            reference = baseline.get(route, {}).get("p95_ms")
+        else:
+            reference = stats["recorded_p95_ms"]
+        if reference:
+            delta = f"{stats['p95_ms'] - reference:+.1f} ({(stats['p95_ms'] / reference - 1) * 100:+.0f}%)"
+        else:
+            delta = "-"
+        lines.append(
+            f"{route[:45]:<45} {stats['count']:>6} {stats['p50_ms']:>8.1f}ms {stats['p95_ms']:>7.1f}ms "
+            f"{(reference or 0):>12.1f}ms {delta:>12} {stats['errors']:>7} {stats['status_mismatches']:>9}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Replay captured traffic against an instance and report latency per route")
+    parser.add_argument("capture", help="NDJSON file written by TrafficCaptureMiddleware")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--speed", type=float, default=1.0, help="speed multiplier, e.g. 4 replays an hour in 15 minutes")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--route", action="append", help="replay only this route template (repeatable)")
+    parser.add_argument("--baseline", help="report of an earlier replay to compare with instead of recorded timings")
+    parser.add_argument("--output", help="write this run's per route report as JSON")
+    args = parser.parse_args(argv)
+
+    records = load_records(args.capture, args.route)
+    print(f"Replaying {len(records)} requests at {args.speed}x against {args.url}")
+    started = time.perf_counter()
+    summary = summarize(replay(records, args.url, args.speed, args.concurrency))
+    print(f"Finished in {time.perf_counter() - started:.1f}s")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(format_report(summary, baseline))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
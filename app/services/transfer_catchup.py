@@ -0,0 +1,254 @@
+import argparse
+import bisect
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+from datetime import datetime, timezone
+from typing import Callable, Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from app.database.database import Session as SessionLocal
+from app.models.bank_transfer import BankTransfer
+from app.models.matching_checkpoint import MatchingCheckpoint
+from app.services.update_payments_from_transfers import (
+    MATCH_MAX_ATTEMPTS,
+    MATCH_RETRY_BACKOFF_SECONDS,
+    match_selected_transfers,
+)
+
+logger = logging.getLogger(__name__)
+
+CATCHUP_WORKERS = int(os.getenv("CATCHUP_WORKERS", "4"))
+CATCHUP_PARTITION_STAYS = int(os.getenv("CATCHUP_PARTITION_STAYS", "1000"))  # pobytów na partycję
+CATCHUP_CHUNK_SIZE = int(os.getenv("CATCHUP_CHUNK_SIZE", "500"))  # przelewów na transakcję
+MAX_REPORTED_ERRORS = 100
+
+
+def _stay_id(title: str) -> Optional[int]:
+    try:
+        return int(title.strip())  # title is supposed to be the stay_id
+    except (ValueError, AttributeError):
+        return None
+
+
+def _scan_unmatched(db: Session, summary: dict) -> dict[int, list[int]]:
+    """Unmatched transfer ids grouped by the stay id in their title, each list in id order."""
+    by_stay: dict[int, list[int]] = defaultdict(list)
+    rows = db.execute(
+        select(BankTransfer.id, BankTransfer.title)
+        .where(BankTransfer.matched_payment_id.is_(None))
+        .order_by(BankTransfer.id)
+    )
+    for transfer_id, title in rows:
+        stay_id = _stay_id(title)
+        if stay_id is None:
+            summary["failed"] += 1
+            if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+                summary["errors"].append(f"Transfer {transfer_id}: title {title!r} is not a stay id")
+            continue
+        by_stay[stay_id].append(transfer_id)
+    return by_stay
+
+
+def _resume_run(db: Session) -> Optional[tuple[str, list[MatchingCheckpoint]]]:
+    """Unfinished partitions of the latest interrupted run, if any."""
+    unfinished = db.execute(
+        select(MatchingCheckpoint.run_id)
+        .where(MatchingCheckpoint.status != "done")
+        .order_by(MatchingCheckpoint.id.desc())
+    ).scalars().first()
+    if not unfinished:
+        return None
+    checkpoints = db.execute(
+        select(MatchingCheckpoint)
+        .where(MatchingCheckpoint.run_id == unfinished, MatchingCheckpoint.status != "done")
+        .order_by(MatchingCheckpoint.stay_from)
+    ).scalars().all()
+    logger.info(f"Resuming catch-up run {unfinished} with {len(checkpoints)} unfinished partitions")
+    return unfinished, list(checkpoints)
+
+
+def _start_run(db: Session, stay_ids: list[int]) -> tuple[str, list[MatchingCheckpoint]]:
+    """Split `stay_ids` into partitions of a new run."""
+    run_id = uuid.uuid4().hex
+    now = datetime.now(timezone.utc)
+    checkpoints = [
+        MatchingCheckpoint(
+            run_id=run_id,
+            stay_from=stay_ids[i],
+            stay_to=stay_ids[min(i + CATCHUP_PARTITION_STAYS, len(stay_ids)) - 1],
+            status="pending",
+            updated_at=now,
+        )
+        for i in range(0, len(stay_ids), CATCHUP_PARTITION_STAYS)
+    ]
+    db.add_all(checkpoints)
+    db.commit()
+    logger.info(f"Started catch-up run {run_id} with {len(checkpoints)} partitions")
+    return run_id, checkpoints
+
+
+def _chunks(stays: list[tuple[int, list[int]]]):
+    """Groups of whole stays holding about CATCHUP_CHUNK_SIZE transfers."""
+    chunk, size = [], 0
+    for stay_id, transfer_ids in stays:
+        chunk.append((stay_id, transfer_ids))
+        size += len(transfer_ids)
+        if size >= CATCHUP_CHUNK_SIZE:
+            yield chunk
+            chunk, size = [], 0
+    if chunk:
+        yield chunk
+
+
+def _process_chunk(db: Session, checkpoint_id: int, chunk: list[tuple[int, list[int]]]) -> dict:
+    counts = match_selected_transfers(db, [transfer_id for _, ids in chunk for transfer_id in ids])
+
+    # Punkt kontrolny w tej samej transakcji co dopasowania
+    checkpoint = db.get(MatchingCheckpoint, checkpoint_id)
+    checkpoint.last_stay_id = chunk[-1][0]
+    checkpoint.processed += counts["processed"]
+    checkpoint.updated += counts["updated"]
+    checkpoint.failed += counts["failed"]
+    checkpoint.updated_at = datetime.now(timezone.utc)
+    db.commit()
+    return counts
+
+
+def _run_partition(
+    location_id: int, checkpoint_id: int, stays: list[tuple[int, list[int]]], summary: dict, lock: threading.Lock
+) -> None:
+    db = SessionLocal(location_id=location_id)
+    try:
+        for chunk in _chunks(stays):
+            for attempt in range(1, MATCH_MAX_ATTEMPTS + 1):
+                try:
+                    counts = _process_chunk(db, checkpoint_id, chunk)
+                    break
+                except StaleDataError:
+                    db.rollback()
+                    if attempt == MATCH_MAX_ATTEMPTS:
+                        raise
+                    logger.warning(f"Payment changed concurrently, retrying chunk of partition {checkpoint_id}")
+                    time.sleep(MATCH_RETRY_BACKOFF_SECONDS * attempt)
+                except Exception:
+                    db.rollback()
+                    raise
+            with lock:
+                for key in ("processed", "updated", "failed"):
+                    summary[key] += counts[key]
+                summary["errors"].extend(counts["errors"][:MAX_REPORTED_ERRORS - len(summary["errors"])])
+
+        checkpoint = db.get(MatchingCheckpoint, checkpoint_id)
+        checkpoint.status = "done"
+        checkpoint.updated_at = datetime.now(timezone.utc)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _run_partitions(
+    db: Session,
+    run_id: str,
+    checkpoints: list[MatchingCheckpoint],
+    stay_ids: list[int],
+    by_stay: dict[int, list[int]],
+    summary: dict,
+    workers: int,
+    progress: Optional[Callable[[dict], None]],
+) -> set[int]:
+    """Match the stays of the given partitions in parallel; returns the stay ids they covered."""
+    partitions = []
+    for checkpoint in checkpoints:
+        # Przy wznawianiu pomijamy pobyty zatwierdzone już w tej partycji
+        low = checkpoint.stay_from if checkpoint.last_stay_id is None else checkpoint.last_stay_id + 1
+        selected = stay_ids[bisect.bisect_left(stay_ids, low):bisect.bisect_right(stay_ids, checkpoint.stay_to)]
+        partitions.append((checkpoint.id, [(stay_id, by_stay[stay_id]) for stay_id in selected]))
+    total = sum(len(ids) for _, stays in partitions for _, ids in stays)
+    summary["total"] += total
+    logger.info(f"Catch-up run {run_id}: {total} transfers in {len(partitions)} partitions, {workers} workers")
+
+    lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="catchup") as pool:
+        futures = [
+            pool.submit(_run_partition, db.location_id, checkpoint_id, stays, summary, lock)
+            for checkpoint_id, stays in partitions
+        ]
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=1, return_when=FIRST_EXCEPTION)
+            if progress:
+                with lock:
+                    progress(dict(summary, errors=list(summary["errors"])))
+        for future in futures:
+            future.result()
+
+    logger.info(f"Catch-up run {run_id} finished: {summary['updated']} updated, {summary['failed']} failed")
+    return {stay_id for _, stays in partitions for stay_id, _ in stays}
+
+
+def catch_up_transfers(
+    db: Session,
+    progress: Optional[Callable[[dict], None]] = None,
+    workers: Optional[int] = None,
+) -> dict:
+    """Match all unmatched transfers in parallel, resuming an interrupted run from its checkpoints.
+
+    Transfers are partitioned by the stay id in their title, so all transfers of one
+    payment are applied by one worker in id order, exactly like the regular pass.
+    Each worker uses its own session and commits every chunk with its checkpoint.
+    Unmatched stays outside the partitions of a resumed run go to a new run started after it.
+    """
+    workers = workers or CATCHUP_WORKERS
+    summary = {"total": 0, "processed": 0, "updated": 0, "failed": 0, "errors": [], "ok": True}
+
+    try:
+        by_stay = _scan_unmatched(db, summary)
+        stay_ids = sorted(by_stay)
+        resumed = _resume_run(db)
+        if resumed:
+            covered = _run_partitions(db, *resumed, stay_ids, by_stay, summary, workers, progress)
+            # Pobyty spoza wznawianych zakresów (nowe, z ukończonych partycji) - w nowym przebiegu zaraz po nim
+            stay_ids = [stay_id for stay_id in stay_ids if stay_id not in covered]
+            if stay_ids:
+                logger.info(f"{len(stay_ids)} stays with unmatched transfers lie outside the resumed run")
+        if stay_ids or not resumed:
+            _run_partitions(db, *_start_run(db, stay_ids), stay_ids, by_stay, summary, workers, progress)
+    except Exception as e:
+        # Zatwierdzone paczki zostają - kolejne uruchomienie wznowi od punktów kontrolnych
+        logger.error("Catch-up matching failed", exc_info=True)
+        db.rollback()
+        summary["ok"] = False
+        summary["errors"].append(str(e))
+
+    if progress:
+        progress(summary)
+    return summary
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    from app.database.database import Base, engine
+    from app.models.dog import Dog  # relacje Stay wymagają zarejestrowanych modeli
+
+    parser = argparse.ArgumentParser(description="Match the backlog of unmatched bank transfers in parallel")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--location", type=int, default=None, help="location id, the default location if omitted")
+    args = parser.parse_args(argv)
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal(location_id=args.location)
+    try:
+        summary = catch_up_transfers(db, workers=args.workers)
+        print(f"Processed {summary['processed']} of {summary['total']} transfers, "
+              f"updated {summary['updated']}, failed {summary['failed']}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,162 @@
 import logging
-from datetime import datetime, timezone
-from sqlalchemy.orm import Session
-from sqlalchemy import select
+import os
+import time
+from typing import Callable, Optional
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy import exists, select
 from app.models.payment import Payment
+from app.database import repository
 from app.models.bank_transfer import BankTransfer
+from app.services.payment_ledger import record_transfer
 
 logger = logging.getLogger(__name__)
 
-def update_payments_from_transfers(db: Session):
+PROGRESS_EVERY = 100  # co ile przelewów raportować postęp
+MATCH_MAX_ATTEMPTS = int(os.getenv("MATCH_MAX_ATTEMPTS", "3"))  # przebiegi przy konflikcie wersji płatności
+MATCH_RETRY_BACKOFF_SECONDS = float(os.getenv("MATCH_RETRY_BACKOFF_SECONDS", "0.5"))
+
+def update_payments_from_transfers(db: Session, progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """Match the unmatched transfers to payments; a pass that lost a version conflict is retried from scratch."""
     logger.info("Starting payment update from bank transfers")
 
-    try:
-        transfers = db.execute(select(BankTransfer)).scalars().all()
-        logger.info(f"Found {len(transfers)} bank transfers")
-
-        updated_count = 0
-
-        for transfer in transfers:
-            try:
-                stay_id = int(transfer.title.strip()) # title is supposed to be the stay_id
-                payment = db.execute(
-                    select(Payment).where(Payment.stay_id == stay_id)
-                ).scalars().first()
-
-                if not payment:
-                    logger.warning(f"No payment found for stay_id: {stay_id}")
-                    continue
-
-                required_amount = payment.calculate_amount(db)
-                received_amount = transfer.amount
-
-                if received_amount >= required_amount:
-                    payment.amount = required_amount
-                    payment.is_paid = True
-                    payment.is_overdue = False
-                    payment.overdue_days = 0
-                    logger.info(f"Marked payment for stay_id {stay_id} as fully paid")
-                else:
-                    payment.amount = received_amount
-                    payment.is_paid = False
-                    payment.is_overdue = True
-                    today = datetime.now(timezone.utc).date()
-                    overdue_days = (today - payment.stay.end_date).days
-                    payment.overdue_days = max(0, overdue_days)
-
-                    logger.info(
-                        f"Partial payment for stay_id {stay_id}: received {received_amount}, required {required_amount}. Overdue days: {payment.overdue_days}"
-                    )
+    for attempt in range(1, MATCH_MAX_ATTEMPTS + 1):
+        summary = {"total": 0, "processed": 0, "updated": 0, "failed": 0, "errors": [], "ok": True, "retries": attempt - 1}
+        try:
+            _match_transfers(db, summary, progress)
+            break
+        except StaleDataError as e:
+            # Płatność zmieniona w międzyczasie (np. przez API) - dopasowanie jest idempotentne, więc powtarzamy
+            db.rollback()
+            if attempt == MATCH_MAX_ATTEMPTS:
+                logger.error(f"Giving up after {attempt} attempts due to concurrent payment updates")
+                summary["ok"] = False
+                summary["errors"].append(f"Concurrent update conflict: {e}")
+                break
+            logger.warning(f"Payment changed concurrently, retrying transfer matching (attempt {attempt + 1})")
+            time.sleep(MATCH_RETRY_BACKOFF_SECONDS * attempt)
+        except Exception as e:
+            logger.error("Error while updating payments from transfers", exc_info=True)
+            db.rollback()
+            summary["ok"] = False
+            summary["errors"].append(str(e))
+            break
+
+    if progress:
+        progress(summary)
+    return summary
+
+
+def apply_transfer(db: Session, transfer: BankTransfer, payment: Payment) -> None:
+    """Match a transfer to its payment and book it in the payment ledger.
+
+    The amount due is left as it is - a second transfer adds to what was paid instead
+    of replacing it, and a recurring stay's period amount is not recalculated per stay.
+    """
+    transfer.matched_payment_id = payment.id
+    record_transfer(db, transfer, payment)
+
+    if payment.is_paid:
+        logger.info(f"Marked payment for stay_id {payment.stay_id} as fully paid")
+    else:
+        logger.info(
+            f"Partial payment for stay_id {payment.stay_id}: received {transfer.amount}, "
+            f"paid {payment.paid_amount} of {payment.amount}. Overdue days: {payment.overdue_days}"
+        )
+
+
+def has_unmatched_transfers(db: Session) -> bool:
+    # exists() to zapytanie Core - bez jawnego location_id sprawdzałoby przelewy wszystkich placówek
+    return db.execute(
+        select(exists().where(BankTransfer.location_id == db.location_id, BankTransfer.matched_payment_id.is_(None)))
+    ).scalar()
+
+
+def match_selected_transfers(db: Session, transfer_ids: list[int]) -> dict:
+    """Match the given transfers that are still unmatched, loading their payments in one query.
+
+    Transfers are applied in id order; the caller commits.
+    """
+    counts = {"processed": 0, "updated": 0, "failed": 0, "errors": []}
+    transfers = db.execute(
+        select(BankTransfer)
+        .where(BankTransfer.id.in_(transfer_ids), BankTransfer.matched_payment_id.is_(None))
+        .order_by(BankTransfer.id)
+    ).scalars().all()
+
+    stay_ids = {}
+    for transfer in transfers:
+        try:
+            stay_ids[transfer.id] = int(transfer.title.strip())  # title is supposed to be the stay_id
+        except ValueError:
+            stay_ids[transfer.id] = None
+    payments = {
+        payment.stay_id: payment
+        for payment in db.execute(
+            select(Payment)
+            .options(joinedload(Payment.stay))
+            .where(Payment.stay_id.in_({stay_id for stay_id in stay_ids.values() if stay_id is not None}))
+        ).scalars()
+    }
+
+    for transfer in transfers:
+        counts["processed"] += 1
+        stay_id = stay_ids[transfer.id]
+        if stay_id is None:
+            counts["failed"] += 1
+            counts["errors"].append(f"Transfer {transfer.id}: title {transfer.title!r} is not a stay id")
+            continue
+        payment = payments.get(stay_id)
+        if not payment:
+            logger.warning(f"No payment found for stay_id: {stay_id}")
+            continue
+        try:
+            apply_transfer(db, transfer, payment)
+            counts["updated"] += 1
+        except StaleDataError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to process transfer {transfer.id}", exc_info=True)
+            counts["failed"] += 1
+            counts["errors"].append(f"Transfer {transfer.id}: {e}")
+    return counts
+
+
+def _match_transfers(db: Session, summary: dict, progress: Optional[Callable[[dict], None]]) -> None:
+    # Dopasowane przelewy są już w księdze płatności - nie przeliczamy ich w każdym przebiegu
+    transfers = db.execute(
+        select(BankTransfer).where(BankTransfer.matched_payment_id.is_(None)).order_by(BankTransfer.id)
+    ).scalars().all()
+    logger.info(f"Found {len(transfers)} unmatched bank transfers")
+    summary["total"] = len(transfers)
+
+    updated_count = 0
+
+    for index, transfer in enumerate(transfers, start=1):
+        try:
+            stay_id = int(transfer.title.strip()) # title is supposed to be the stay_id
+            payment = repository.first_by(db, Payment, stay_id=stay_id)
 
+            if payment:
+                apply_transfer(db, transfer, payment)
                 updated_count += 1
+            else:
+                logger.warning(f"No payment found for stay_id: {stay_id}")
 
-            except Exception as e:
-                logger.error(f"Failed to process transfer {transfer.id}", exc_info=True)
+        except StaleDataError:
+            raise  # autoflush wykrył konflikt - przebieg do powtórzenia, zatwierdzone dopasowania nie wrócą
+        except Exception as e:
+            logger.error(f"Failed to process transfer {transfer.id}", exc_info=True)
+            summary["failed"] += 1
+            summary["errors"].append(f"Transfer {transfer.id}: {e}")
 
-        db.commit()
-        logger.info(f"Finished updating payments. Total updated: {updated_count}")
+        summary["processed"] = index
+        if progress and index % PROGRESS_EVERY == 0:
+            # Zatwierdzamy przed raportem - postęp zapisuje inna sesja, a SQLite ma jedną blokadę zapisu
+            db.commit()
+            summary["updated"] = updated_count
+            progress(summary)
 
-    except Exception as e:
-        logger.error("Error while updating payments from transfers", exc_info=True)
+    db.commit()
+    summary["updated"] = updated_count
+    logger.info(f"Finished updating payments. Total updated: {updated_count}")
@@ -0,0 +1,62 @@
+import hashlib
+import hmac
+import os
+import secrets
+from datetime import date, datetime
+
+# Wspólna sól przechwytywania ruchu i migawki bazy - z tą samą solą wyszukiwanie
+# "fullname=<token>" z nagrania trafia w tego samego, zanonimizowanego właściciela w migawce
+ANONYMIZE_SALT = os.getenv("ANONYMIZE_SALT") or secrets.token_hex(16)
+
+# Pola z danymi osobowymi - zawsze zastępowane tokenem (liczby liczbą, teksty tekstem)
+SENSITIVE_FIELDS = {
+    "fullname", "email", "phone_number", "bank_account", "name", "notes", "medicine",
+    "sender_name", "from_account", "bank_reference",
+}
+# Pola tekstowe bez danych osobowych, potrzebne do odtworzenia ruchu
+SAFE_FIELDS = {"fields", "include", "kennel_type", "food", "status", "type", "event_id"}
+
+
+def _digest(value) -> bytes:
+    normalized = str(value).strip().lower()  # wyszukiwanie ignoruje wielkość liter
+    return hmac.new(ANONYMIZE_SALT.encode(), normalized.encode(), hashlib.sha256).digest()
+
+
+def token(value):
+    """Stable pseudonym of a value; numbers stay numbers so typed fields still validate."""
+    if value is None:
+        return None
+    if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        value = int(value)  # np. phone_number z query string - ten sam token co w bazie
+    if isinstance(value, int) and not isinstance(value, bool):
+        return int.from_bytes(_digest(value)[:4], "big") % 10**9
+    if isinstance(value, str) and "@" in value:
+        return f"{_digest(value).hex()[:12]}@example.invalid"
+    return f"~{_digest(value).hex()[:12]}"
+
+
+def _is_plain(value: str) -> bool:
+    if value.replace(".", "", 1).lstrip("-").isdigit() or value.lower() in ("true", "false"):
+        return True
+    try:
+        datetime.fromisoformat(value)
+        return True
+    except ValueError:
+        pass
+    try:
+        date.fromisoformat(value)
+        return True
+    except ValueError:
+        return False
+
+
+def anonymize_value(key: str, value):
+    if key in SENSITIVE_FIELDS:
+        return token(value)
+    if isinstance(value, dict):
+        return {k: anonymize_value(k, v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [anonymize_value(key, item) for item in value]
+    if isinstance(value, str) and key not in SAFE_FIELDS and not _is_plain(value):
+        return token(value)
+    return value
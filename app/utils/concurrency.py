@@ -0,0 +1,28 @@
+from typing import Optional
+from fastapi import HTTPException
+
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Version expected by the client; accepts `"3"`, `W/"3"` and `3`, `*` means any."""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    value = if_match.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be a version number")
+
+
+def check_version(obj, if_match: Optional[str], label: str) -> None:
+    expected = parse_if_match(if_match)
+    if expected is not None and expected != obj.version:
+        raise HTTPException(
+            status_code=409,
+            detail=f"{label} was modified by another request (current version {obj.version})",
+        )
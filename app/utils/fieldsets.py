@@ -0,0 +1,99 @@
+from functools import lru_cache
+from typing import Annotated, Any, Optional, Union, get_origin
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ConfigDict, Field, create_model
+from sqlalchemy.orm import joinedload, load_only, selectinload
+
+
+def parse_csv(value: Optional[str]) -> tuple[str, ...]:
+    if not value:
+        return ()
+    return tuple(sorted({part.strip() for part in value.split(",") if part.strip()}))
+
+
+class SparseFieldset:
+    """`fields=` / `include=` support for a read endpoint.
+
+    `fields` limits the columns loaded and returned, `include` embeds related
+    objects loaded eagerly (joined for many-to-one, selectin for collections),
+    so a list with includes costs one query per collection instead of one per row.
+
+    `relations` maps each include name to its schema, `list[Schema]` for collections.
+    Routes declare `item_response` / `list_response` as their response_model, so
+    OpenAPI shows both the full read schema and the sparse/include shape.
+    """
+
+    def __init__(self, model, read_schema: type[BaseModel], relations: dict[str, Any]):
+        self.model = model
+        self.read_schema = read_schema
+        self.relations = relations
+        self.sparse_schema = self._sparse_schema()
+        # left_to_right: pełna odpowiedź przechodzi już przez schemat odczytu, bez sięgania po relacje
+        self.item_response = Annotated[Union[read_schema, self.sparse_schema], Field(union_mode="left_to_right")]
+        self.list_response = Annotated[
+            Union[list[read_schema], list[self.sparse_schema]], Field(union_mode="left_to_right")
+        ]
+
+    def parse(self, fields: Optional[str], include: Optional[str]) -> tuple[tuple[str, ...], tuple[str, ...]]:
+        field_names = parse_csv(fields)
+        include_names = parse_csv(include)
+
+        unknown_fields = set(field_names) - set(self.read_schema.model_fields)
+        if unknown_fields:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown_fields))}")
+        unknown_includes = set(include_names) - set(self.relations)
+        if unknown_includes:
+            raise HTTPException(status_code=400, detail=f"Unknown include: {', '.join(sorted(unknown_includes))}")
+
+        return field_names, include_names
+
+    def apply(self, stmt, field_names: tuple[str, ...], include_names: tuple[str, ...]):
+        if field_names:
+            stmt = stmt.options(load_only(*(getattr(self.model, name) for name in field_names)))
+        for name in include_names:
+            attr = getattr(self.model, name)
+            loader = selectinload(attr) if attr.property.uselist else joinedload(attr)
+            stmt = stmt.options(loader)
+        return stmt
+
+    def render(self, result, field_names: tuple[str, ...], include_names: tuple[str, ...]) -> JSONResponse:
+        schema = self.response_model(field_names, include_names)
+        if isinstance(result, list):
+            content = [schema.model_validate(obj).model_dump() for obj in result]
+        else:
+            content = schema.model_validate(result).model_dump()
+        return JSONResponse(content=jsonable_encoder(content))
+
+    def _sparse_schema(self) -> type[BaseModel]:
+        """Shape of a response with `fields=` / `include=`, for the OpenAPI schema only."""
+        definitions = {
+            name: (Optional[info.annotation], Field(None, description="Returned when listed in `fields=`"))
+            for name, info in self.read_schema.model_fields.items()
+        }
+        for name, annotation in self.relations.items():
+            definitions[name] = (Optional[annotation], Field(None, description="Embedded when listed in `include=`"))
+        return create_model(f"{self.read_schema.__name__}Sparse", **definitions)
+
+    @lru_cache(maxsize=128)
+    def response_model(self, field_names: tuple[str, ...], include_names: tuple[str, ...]) -> type[BaseModel]:
+        schema_fields = self.read_schema.model_fields
+        definitions = {
+            name: (info.annotation, info)
+            for name, info in schema_fields.items()
+            if not field_names or name in field_names
+        }
+        for name in include_names:
+            annotation = self.relations[name]
+            if get_origin(annotation) is list:
+                definitions[name] = (annotation, [])
+            else:
+                definitions[name] = (Optional[annotation], None)
+
+        suffix = "_".join(field_names + include_names)
+        return create_model(
+            f"{self.read_schema.__name__}_{suffix}",
+            __config__=ConfigDict(from_attributes=True),
+            **definitions,
+        )
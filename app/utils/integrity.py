@@ -0,0 +1,14 @@
+from sqlalchemy.exc import IntegrityError
+
+# Fragmenty komunikatów błędów identyfikujące ograniczenia (PostgreSQL podaje nazwę, SQLite kolumny)
+OWNER_EMAIL = ("uq_owners_location_id_email", "owners.email")
+OWNER_PHONE_NUMBER = ("uq_owners_location_id_phone_number", "owners.phone_number")
+DOG_NAME_PER_OWNER = ("uq_dogs_owner_id_name", "dogs.owner_id, dogs.name")
+PAYMENT_PER_STAY = ("uq_payments_stay_id", "payments.stay_id")
+FOREIGN_KEY = ("FOREIGN KEY constraint failed", "violates foreign key constraint")
+
+
+def violates(error: IntegrityError, constraint: tuple[str, ...]) -> bool:
+    message = str(error.orig)
+    return any(marker in message for marker in constraint)
+
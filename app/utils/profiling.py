@@ -0,0 +1,248 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+log = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")  # wartość nagłówka X-Profile włączająca profilowanie żądania
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))  # ułamek żądań/uruchomień profilowanych losowo
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+PROFILING_KEEP = int(os.getenv("PROFILING_KEEP", "50"))  # ile ostatnich profili trzymać na dysku
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR", os.path.join(os.path.dirname(__file__), "..", "..", "logs", "profiles")
+)
+
+PROFILE_HEADER = "x-profile"
+
+_current_profiler: contextvars.ContextVar = contextvars.ContextVar("current_profiler", default=None)
+
+
+class SamplingProfiler:
+    """Statistical profiler sampling the stacks of the threads registered with it.
+
+    A background thread reads `sys._current_frames()` every interval, so the
+    profiled code itself runs unmodified.
+    """
+
+    def __init__(self, name: str, interval_ms: float = PROFILING_INTERVAL_MS):
+        self.id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}_{uuid.uuid4().hex[:8]}"
+        self.name = name
+        self.interval = interval_ms / 1000
+        self.samples: Counter = Counter()
+        self._threads: set[int] = set()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name=f"profiler-{self.id}", daemon=True)
+        self.started_at = 0.0
+        self.duration = 0.0
+
+    def add_thread(self, ident: int) -> None:
+        self._threads.add(ident)
+
+    def remove_thread(self, ident: int) -> None:
+        self._threads.discard(ident)
+
+    def start(self) -> None:
+        self.started_at = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in list(self._threads):
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                self.samples[tuple(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        lines = []
+        for stack, count in self.samples.most_common():
+            names = ";".join(f"{name} ({os.path.basename(filename)}:{line})" for name, filename, line in stack)
+            lines.append(f"{names} {count}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self) -> dict:
+        frame_index: dict[tuple, int] = {}
+        frames, samples, weights = [], [], []
+        interval_ms = self.interval * 1000
+        for stack, count in self.samples.items():
+            indexes = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                indexes.append(frame_index[frame])
+            samples.append(indexes)
+            weights.append(count * interval_ms)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "dog_hotel_api",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": self.name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+    def write(self) -> str:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        safe_name = "".join(c if c.isalnum() else "_" for c in self.name).strip("_")
+        base = os.path.join(PROFILE_DIR, f"{self.id}_{safe_name}")
+        with open(f"{base}.collapsed", "w") as f:
+            f.write(self.collapsed())
+        with open(f"{base}.speedscope.json", "w") as f:
+            json.dump(self.speedscope(), f)
+        _rotate()
+        log.info(f"Profile {self.id} for {self.name} written ({self.duration * 1000:.1f} ms, {sum(self.samples.values())} samples)")
+        return base
+
+
+def _rotate() -> None:
+    profiles = list_profiles()
+    ids = sorted({p["id"] for p in profiles}, reverse=True)
+    for stale in ids[PROFILING_KEEP:]:
+        for p in profiles:
+            if p["id"] == stale:
+                os.remove(os.path.join(PROFILE_DIR, p["file"]))
+
+
+def list_profiles() -> list[dict]:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for file in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        path = os.path.join(PROFILE_DIR, file)
+        profiles.append({
+            "id": "_".join(file.split("_")[:2]),
+            "file": file,
+            "size": os.path.getsize(path),
+            "created_at": datetime.fromtimestamp(os.path.getmtime(path), timezone.utc),
+        })
+    return profiles
+
+
+def should_profile(header_value: str | None = None) -> bool:
+    if not PROFILING_ENABLED:
+        return False
+    if PROFILING_TOKEN and header_value == PROFILING_TOKEN:
+        return True
+    return PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE
+
+
+@contextmanager
+def profile_run(name: str):
+    """Profile the current thread, e.g. a scheduler run, when sampling picks it."""
+    if not should_profile():
+        yield
+        return
+    profiler = SamplingProfiler(name)
+    profiler.add_thread(threading.get_ident())
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        profiler.write()
+
+
+def _profiled_call(call):
+    """Register the thread running an endpoint with the request's profiler, if any."""
+    if inspect.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def async_wrapper(*args, **kwargs):
+            profiler = _current_profiler.get()
+            if profiler is None:
+                return await call(*args, **kwargs)
+            ident = threading.get_ident()
+            profiler.add_thread(ident)
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                profiler.remove_thread(ident)
+        return async_wrapper
+
+    @functools.wraps(call)
+    def wrapper(*args, **kwargs):
+        profiler = _current_profiler.get()
+        if profiler is None:
+            return call(*args, **kwargs)
+        ident = threading.get_ident()
+        profiler.add_thread(ident)
+        try:
+            return call(*args, **kwargs)
+        finally:
+            profiler.remove_thread(ident)
+    return wrapper
+
+
+def instrument_routes(app) -> None:
+    from fastapi.routing import APIRoute
+
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            route.dependant.call = _profiled_call(route.dependant.call)
+
+
+class ProfilingMiddleware:
+    """Profiles requests carrying `X-Profile: <PROFILING_TOKEN>` or picked by PROFILING_SAMPLE_RATE.
+
+    Only installed when PROFILING_ENABLED is set, so it costs nothing otherwise.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith("/debug/profiles"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        header_value = headers.get(PROFILE_HEADER.encode(), b"").decode() or None
+        if not should_profile(header_value):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = SamplingProfiler(f"{scope['method']} {scope['path']}")
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profiler.id.encode())]
+            await send(message)
+
+        token = _current_profiler.set(profiler)
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.stop()
+            _current_profiler.reset(token)
+            profiler.write()